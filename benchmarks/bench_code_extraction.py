@@ -0,0 +1,117 @@
+"""
+Benchmark: CodeExtractor on large (reasoning-model style) responses.
+
+Compares the lexer-based CodeExtractor in inference_module/output_format.py with the
+previous regex / character-loop implementation (kept below as LegacyCodeExtractor).
+
+Usage:
+    python benchmarks/bench_code_extraction.py --size_kb 200 --repeat 5
+"""
+import re
+import sys
+import time
+import argparse
+
+sys.path.append('.')
+from inference_module.output_format import CodeExtractor
+
+
+class LegacyCodeExtractor:
+    """previous implementation, kept only as the benchmark baseline"""
+
+    @staticmethod
+    def extract_code_from_markdown(text):
+        pattern = r"```(?:cpp|c|python|java|\w*)\s*(.*?)```"
+        match = re.search(pattern, text, re.DOTALL)
+        if match:
+            return match.group(1).strip()
+        return None
+
+    @staticmethod
+    def extract_c_style_main_function(text):
+        main_start = re.search(r"\b(?:int\s+)?main\s*\(", text)
+        if not main_start:
+            return text
+
+        open_braces = 0
+        closing_brace_position = -1
+        main_function_started = False
+
+        char_pos = main_start.end()
+        while char_pos < len(text):
+            if text[char_pos] == "{":
+                open_braces += 1
+                if not main_function_started:
+                    main_function_started = True
+            elif text[char_pos] == "}":
+                open_braces -= 1
+                if open_braces == 0 and main_function_started:
+                    closing_brace_position = char_pos
+                    break
+            char_pos += 1
+
+        if closing_brace_position != -1:
+            return text[: closing_brace_position + 1]
+        return text
+
+    @staticmethod
+    def extract_code_or_main_function(text):
+        code_block = LegacyCodeExtractor.extract_code_from_markdown(text)
+        if code_block is None:
+            return LegacyCodeExtractor.extract_c_style_main_function(text)
+        return code_block
+
+
+CODE_BODY = (
+    "    for (int i = 0; i < n; ++i) {\n"
+    "        if (a[i] == '{') { cnt++; }\n"
+    "        printf(\"%d }\\n\", a[i]);\n"
+    "    }\n"
+)
+
+
+def make_response(size_kb, kind):
+    """build a synthetic response of about size_kb kilobytes"""
+    reasoning = "Let me think about the loop bounds and the `vector` usage, then main( calls. " * 64
+    n_reasoning = max(1, size_kb * 1024 // len(reasoning))
+    think = "<think>\n" + "\n".join(reasoning for _ in range(n_reasoning)) + "\n</think>\n"
+    body = CODE_BODY * max(1, size_kb * 1024 // (4 * len(CODE_BODY)))
+    code = "#include <cstdio>\nint a[100005];\nint main() {\n    int n, cnt = 0;\n" + body + "    return 0;\n}\n"
+
+    if kind == 'fenced':
+        # long reasoning followed by a complete fenced answer
+        return think + "Here is the optimized code:\n```cpp\n" + code + "```\n"
+    if kind == 'unterminated':
+        # generation stopped (num_ctx / num_predict) before the closing fence
+        return think + "Here is the optimized code:\n```cpp\n" + code
+    if kind == 'unfenced':
+        # plain code without any fence after the reasoning part
+        return think + code + "\nThis version avoids repeated work.\n"
+    raise ValueError(f"unknown response kind: {kind}")
+
+
+def time_call(func, text, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CodeExtractor benchmark')
+    parser.add_argument('--size_kb', type=int, default=200, help='approximate response size in KB')
+    parser.add_argument('--repeat', type=int, default=5, help='number of repetitions (best time is reported)')
+    args = parser.parse_args()
+
+    print(f"{'response':<14}{'size(KB)':>10}{'legacy(ms)':>14}{'lexer(ms)':>12}{'speedup':>10}")
+    for kind in ['fenced', 'unterminated', 'unfenced']:
+        text = make_response(args.size_kb, kind)
+        legacy = time_call(LegacyCodeExtractor.extract_code_or_main_function, text, args.repeat)
+        lexer = time_call(CodeExtractor.extract_code_or_main_function, text, args.repeat)
+        print(f"{kind:<14}{len(text) / 1024:>10.0f}{legacy * 1000:>14.2f}{lexer * 1000:>12.2f}{legacy / lexer:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Benchmark: parity and CPU latency / throughput of the embedding backends.
+
+Encodes the same texts with the reference torch model and the int8 ONNX export
+(EmbeddingProcessor(backend='onnx-int8')) and reports
+- parity: cosine similarity between the two embeddings of every text, and the
+  overlap of the top-k neighbours among the texts (retrieval agreement)
+- latency: single-query encode time (the retrieval workload)
+- throughput: texts per second with batched encoding (the store building workload)
+
+Usage:
+    python benchmarks/bench_embedding_backends.py --data_path ./BRIDGE_data/PIE_test.jsonl --n_texts 64
+"""
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+sys.path.append('.')
+from detection_module_LLM_based.embedding_processor import EmbeddingProcessor
+from detection_module_LLM_based.vector_matrix import normalize_rows
+
+
+def load_texts(data_path, n_texts):
+    with open(data_path, 'r') as f:
+        return [json.loads(line)['src_code'] for line in f][:n_texts]
+
+
+def measure(processor, texts, batch_size):
+    # warm up (graph optimization / lazy initialization)
+    processor.encode(texts[0])
+
+    start = time.perf_counter()
+    single = [processor.encode(text) for text in texts]
+    latency = (time.perf_counter() - start) / len(texts)
+
+    truncated = [processor._truncate_text(text) for text in texts]
+    start = time.perf_counter()
+    processor.model.encode(truncated, batch_size=batch_size, convert_to_numpy=True)
+    throughput = len(texts) / (time.perf_counter() - start)
+    return normalize_rows(np.stack(single)), latency, throughput
+
+
+def neighbour_overlap(reference, candidate, k):
+    """mean overlap of the top-k neighbours (excluding the text itself) computed with both embeddings"""
+    def neighbours(matrix):
+        sims = matrix @ matrix.T
+        np.fill_diagonal(sims, -np.inf)
+        return np.argsort(-sims, axis=1)[:, :k]
+    ref, cand = neighbours(reference), neighbours(candidate)
+    return np.mean([len(set(r) & set(c)) / k for r, c in zip(ref, cand)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='embedding backend parity / latency benchmark')
+    parser.add_argument('--model_name', type=str, default='Qodo/Qodo-Embed-1-1.5B', help='embedding model')
+    parser.add_argument('--data_path', type=str, default='./BRIDGE_data/PIE_test.jsonl', help='jsonl with src_code used as texts')
+    parser.add_argument('--n_texts', type=int, default=64, help='number of texts')
+    parser.add_argument('--batch_size', type=int, default=16, help='batch size of the throughput run')
+    parser.add_argument('--quantization_config', type=str, default='avx2', help='ONNX Runtime int8 target (avx2, avx512, avx512_vnni, arm64)')
+    parser.add_argument('--k', type=int, default=5, help='neighbours compared for the retrieval agreement')
+    args = parser.parse_args()
+
+    texts = load_texts(args.data_path, args.n_texts)
+    reference, ref_latency, ref_throughput = measure(EmbeddingProcessor(args.model_name, backend='torch'), texts, args.batch_size)
+    onnx_processor = EmbeddingProcessor(args.model_name, backend='onnx-int8', quantization_config=args.quantization_config)
+    candidate, onnx_latency, onnx_throughput = measure(onnx_processor, texts, args.batch_size)
+
+    cosine = np.sum(reference * candidate, axis=1)
+    print(f"{len(texts)} texts from {args.data_path}")
+    print(f"parity: cosine(torch, onnx-int8) mean {cosine.mean():.4f}, min {cosine.min():.4f}; "
+          f"top-{args.k} neighbour agreement {neighbour_overlap(reference, candidate, args.k):.3f}")
+    print(f"{'backend':<12}{'latency(ms)':>13}{'throughput(texts/s)':>22}")
+    print(f"{'torch':<12}{ref_latency * 1000:>13.1f}{ref_throughput:>22.2f}")
+    print(f"{'onnx-int8':<12}{onnx_latency * 1000:>13.1f}{onnx_throughput:>22.2f}")
+    print(f"speedup: latency {ref_latency / onnx_latency:.2f}x, throughput {onnx_throughput / ref_throughput:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
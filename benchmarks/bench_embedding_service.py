@@ -0,0 +1,59 @@
+"""
+Benchmark: query throughput of the shared embedding service.
+
+Sends the src_code of the test set as single-query requests (the retrieval workload
+of main_inference.py) to a running embedding service, first one at a time and then
+from --n_clients concurrent clients, and reports the throughput and the mean batch
+size formed by the service's micro-batching.
+
+Usage:
+    python detection_module_LLM_based/embedding_service.py --port 8765 &
+    python benchmarks/bench_embedding_service.py --service_url localhost:8765 --n_texts 256 --n_clients 8
+"""
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append('.')
+from detection_module_LLM_based.embedding_service import EmbeddingClient
+
+
+def load_texts(data_path, n_texts):
+    with open(data_path, 'r') as f:
+        return [json.loads(line)['src_code'] for line in f][:n_texts]
+
+
+def run(client, texts, n_clients):
+    before = client.info()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=n_clients) as executor:
+        list(executor.map(lambda text: client.encode_batch([text], truncate=False), texts))
+    elapsed = time.perf_counter() - start
+    after = client.info()
+    batches = after['batches'] - before['batches']
+    return len(texts) / elapsed, (after['texts'] - before['texts']) / batches if batches else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='embedding service throughput benchmark')
+    parser.add_argument('--service_url', type=str, default='localhost:8765', help='running embedding service')
+    parser.add_argument('--data_path', type=str, default='./BRIDGE_data/PIE_test.jsonl', help='jsonl with src_code used as queries')
+    parser.add_argument('--n_texts', type=int, default=256, help='number of queries')
+    parser.add_argument('--n_clients', type=int, default=8, help='concurrent clients (inference workers)')
+    args = parser.parse_args()
+
+    client = EmbeddingClient(args.service_url)
+    texts = load_texts(args.data_path, args.n_texts)
+    client.encode(texts[0])  # warm up
+
+    print(f"{len(texts)} queries, {client.model_name} ({client.backend}) at {client.url}")
+    print(f"{'clients':>8}{'queries/s':>12}{'mean batch':>12}")
+    for n_clients in (1, args.n_clients):
+        throughput, mean_batch = run(client, texts, n_clients)
+        print(f"{n_clients:>8}{throughput:>12.2f}{mean_batch:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
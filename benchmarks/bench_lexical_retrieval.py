@@ -0,0 +1,70 @@
+"""
+Benchmark: latency and agreement of the dense, hybrid and lexical (BM25) retrieval modes.
+
+The queries are the src_code of the test set, searched in the store as retrieve_basic
+does. For every mode the mean latency (including the query embedding for dense and
+hybrid) is reported, with the overlap of its top-k with the dense top-k. Without an
+embedding model (--lexical_only) only the BM25 index build time and search latency
+are measured.
+
+Usage:
+    python benchmarks/bench_lexical_retrieval.py \
+        --store_path ./BRIDGE_data/rag_store/hq_snippet \
+        --test_data_path ./BRIDGE_data/PIE_test.jsonl --n_queries 100
+"""
+import sys
+import json
+import time
+import argparse
+
+sys.path.append('.')
+from detection_module_LLM_based.vector_store import DiskBackedVectorStore, RETRIEVAL_MODES
+from detection_module_LLM_based.lexical_index import LexicalIndex
+
+
+def main():
+    parser = argparse.ArgumentParser(description='lexical / hybrid retrieval benchmark')
+    parser.add_argument('--store_path', type=str, default='./BRIDGE_data/rag_store/hq_snippet', help='existing vector store')
+    parser.add_argument('--test_data_path', type=str, default='./BRIDGE_data/PIE_test.jsonl', help='test data whose src_code are the queries')
+    parser.add_argument('--model_name', type=str, default='Qodo/Qodo-Embed-1-1.5B', help='embedding model of the store')
+    parser.add_argument('--n_queries', type=int, default=100, help='number of queries')
+    parser.add_argument('--k', type=int, default=2, help='retrieved examples per query')
+    parser.add_argument('--mode_filter', type=str, default='full', help='store mode searched')
+    parser.add_argument('--lexical_only', action='store_true', help='do not load the embedding model')
+    args = parser.parse_args()
+
+    with open(args.test_data_path, 'r') as f:
+        queries = [json.loads(line)['src_code'] for line in f][:args.n_queries]
+
+    store = DiskBackedVectorStore(args.store_path, model_name=args.model_name)
+    start = time.perf_counter()
+    index = LexicalIndex.build(store.metadata, store.version)
+    print(f"{len(store.metadata)} entries, {len(index.terms)} terms, BM25 index built in {time.perf_counter() - start:.1f}s")
+
+    embedder = None
+    modes = ['lexical']
+    if not args.lexical_only:
+        from detection_module_LLM_based.embedding_service import load_embedder
+        embedder = load_embedder(args.model_name)
+        modes = RETRIEVAL_MODES
+
+    results = {}
+    print(f"{'mode':<10}{'latency(ms)':>13}{f'overlap@{args.k} with dense':>24}")
+    for mode in modes:
+        store = DiskBackedVectorStore(args.store_path, model_name=args.model_name, retrieval_mode=mode)
+        store.search_parallel(queries[0], embedder, [args.mode_filter], args.k)  # warm up (matrix / index load)
+        start = time.perf_counter()
+        results[mode] = [
+            {r['entry_id'] for r in store.search_parallel(query, embedder, [args.mode_filter], args.k)}
+            for query in queries
+        ]
+        latency = (time.perf_counter() - start) / len(queries) * 1000
+        if 'dense' in results:
+            overlap = sum(len(a & b) for a, b in zip(results[mode], results['dense'])) / (args.k * len(queries))
+            print(f"{mode:<10}{latency:>13.2f}{overlap:>24.3f}")
+        else:
+            print(f"{mode:<10}{latency:>13.2f}{'-':>24}")
+
+
+if __name__ == '__main__':
+    main()
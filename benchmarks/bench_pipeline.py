@@ -0,0 +1,250 @@
+"""
+Benchmark: end-to-end inference pipeline with per-stage timings.
+
+The first --n_items of the test set are run through every prompt strategy with
+main_inference.run_inference, against a stand-in LLM backend that answers after a
+fixed latency (--llm_latency_ms) with the first code block of the prompt, so the
+measured time is the pipeline's own work. For every strategy it reports
+- the latency distribution (mean / p50 / p90 / p99 / max) of the stages timed in
+  inference_module/profiling.py (data load, rule prompt, embedding, search, token
+  trimming, LLM call, write, formatting)
+- throughput (items/s), resource load time and peak RSS
+Every strategy runs in its own subprocess, so the peak memory and the loaded
+resources of one strategy do not leak into the next. The retrieval result cache
+is off unless --retrieval_cache is given, so every item embeds and searches.
+
+Results are written to --output_dir for comparison between versions:
+
+    pipeline_<timestamp>.json   git commit, arguments and the stage summaries per strategy
+    pipeline_<timestamp>.csv    one row per (strategy, stage), times in ms
+
+With --baseline (an earlier pipeline_<timestamp>.json) the change of every stage p50
+and of the throughput is printed.
+
+Usage:
+    python benchmarks/bench_pipeline.py --test_data_path ./BRIDGE_data/PIE_test.jsonl --n_items 20
+    python benchmarks/bench_pipeline.py --strategies base,rules,retrieve_basic --sampling k_sample --sample_num 4 \
+        --baseline results/benchmarks/pipeline_20250101-120000.json
+"""
+import os
+import sys
+import csv
+import json
+import time
+import shutil
+import logging
+import platform
+import resource
+import tempfile
+import argparse
+import subprocess
+from types import SimpleNamespace
+from datetime import datetime
+
+sys.path.append('.')
+from inference_module.main_inference import PROMPT_STRATEGIES, build_parser, finalize_args, run_inference, count_tokens
+from inference_module.retrieval_resources import get_shared_resources
+from inference_module.output_format import CodeExtractor
+from inference_module.profiling import get_profiler, timed_embedder
+
+
+class StandInBackend:
+    """answers every chat request after a fixed latency with the first code block of the prompt (same interface as BackendPool)"""
+
+    def __init__(self, latency_ms=50.0):
+        self.latency_ms = latency_ms
+
+    def chat(self, model, messages, options=None):
+        time.sleep(self.latency_ms / 1000)
+        blocks = CodeExtractor.find_code_blocks(messages[-1]['content'])
+        code = blocks[0][0] if blocks else 'int main() { return 0; }'
+        return SimpleNamespace(message=SimpleNamespace(content=f"```cpp\n{code}\n```"))
+
+
+def write_subset(test_data_path, n_items, work_dir):
+    """the first n_items of the test set; hybrid_after_rules gets the source code as its previous (rules) answer"""
+    with open(test_data_path, 'r') as f:
+        items = [json.loads(line) for _, line in zip(range(n_items), f)]
+    for item in items:
+        item.setdefault('generated_answers', [item['src_code']])
+    subset_path = os.path.join(work_dir, 'bench_test.jsonl')
+    with open(subset_path, 'w') as f:
+        for item in items:
+            f.write(json.dumps(item) + '\n')
+    return subset_path, len(items)
+
+
+def format_outputs(output_dir):
+    """extract the code of every result file as output_format.py does (timed as the 'formatting' stage)"""
+    profiler = get_profiler()
+    for file_name in os.listdir(output_dir):
+        if not file_name.endswith('.jsonl'):
+            continue
+        with open(os.path.join(output_dir, file_name), 'r') as f:
+            responses = [json.loads(line)['response'] for line in f if line.strip()]
+        with profiler.stage('formatting'):
+            for response in responses:
+                CodeExtractor.extract_code_or_main_function(response)
+
+
+def run_strategy(args):
+    """run one strategy in this process and return its measurements"""
+    work_dir = tempfile.mkdtemp(prefix='bench_pipeline_')
+    try:
+        subset_path, n_items = write_subset(args.test_data_path, args.n_items, work_dir)
+        run_args = finalize_args(build_parser().parse_args([
+            '--model_name', args.model_name,
+            '--test_data_path', subset_path,
+            '--prompt_strategy', args.strategy,
+            '--sampling', args.sampling,
+            '--sample_num', str(args.sample_num),
+            '--num_workers', str(args.num_workers),
+            '--output_root', work_dir
+        ]))
+
+        resources = get_shared_resources()
+        resources.result_cache = args.retrieval_cache
+        resources.retrieval_mode = args.retrieval_mode
+        start = time.perf_counter()
+        retrieval_resources = resources.get(args.strategy)
+        count_tokens('warm up', args.model_name)  # tokenizer load
+        setup_seconds = time.perf_counter() - start
+
+        profiler = get_profiler()
+        profiler.reset()
+        profiler.enabled = True
+        store, embedder, *rest = retrieval_resources
+        retrieval_resources = (store, timed_embedder(embedder), *rest)
+
+        start = time.perf_counter()
+        output_dir = run_inference(run_args, StandInBackend(args.llm_latency_ms), retrieval_resources)
+        elapsed = time.perf_counter() - start
+        format_outputs(output_dir)
+        profiler.enabled = False
+
+        completed = sum(1 for name in os.listdir(output_dir) if name.endswith('.jsonl'))
+        return {
+            'strategy': args.strategy,
+            'items': n_items,
+            'completed': completed,
+            'elapsed': elapsed,
+            'throughput': completed / elapsed if elapsed > 0 else 0.0,
+            'setup_seconds': setup_seconds,
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,  # KB on Linux
+            'stages': profiler.summary()
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_result(result):
+    print(f"\n== {result['strategy']}: {result['completed']}/{result['items']} items, {result['throughput']:.2f} items/s, "
+          f"setup {result['setup_seconds']:.1f}s, peak RSS {result['peak_rss_mb']:.0f} MB")
+    print(f"{'stage':<14}{'count':>7}{'mean(ms)':>11}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+    for name, s in result['stages'].items():
+        print(f"{name:<14}{s['count']:>7}{s['mean'] * 1000:>11.2f}{s['p50'] * 1000:>10.2f}"
+              f"{s['p90'] * 1000:>10.2f}{s['p99'] * 1000:>10.2f}{s['max'] * 1000:>10.2f}")
+
+
+def compare(results, baseline_path):
+    """p50 of every stage and the throughput against an earlier run"""
+    with open(baseline_path, 'r') as f:
+        baseline = {r['strategy']: r for r in json.load(f)['results']}
+    print(f"\n== change vs {baseline_path} (stage p50 in ms)")
+    print(f"{'strategy':<26}{'stage':<14}{'before':>12}{'after':>12}{'change':>9}")
+    for result in results:
+        before = baseline.get(result['strategy'])
+        if before is None:
+            continue
+        rows = [(name, before['stages'][name]['p50'] * 1000, s['p50'] * 1000)
+                for name, s in result['stages'].items() if name in before['stages']]
+        rows.append(('items/s', before['throughput'], result['throughput']))
+        for name, old, new in rows:
+            change = f"{(new - old) / old * 100:+.1f}%" if old > 0 else '-'
+            print(f"{result['strategy']:<26}{name:<14}{old:>12.2f}{new:>12.2f}{change:>9}")
+
+
+def save(results, args, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+    json_path = os.path.join(output_dir, f"pipeline_{stamp}.json")
+    report = {
+        'timestamp': stamp,
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'args': {k: v for k, v in vars(args).items() if k not in ('strategy', 'child_output')},
+        'results': results
+    }
+    with open(json_path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    csv_path = os.path.join(output_dir, f"pipeline_{stamp}.csv")
+    with open(csv_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['strategy', 'stage', 'count', 'mean_ms', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms', 'throughput', 'peak_rss_mb'])
+        for r in results:
+            for name, s in r['stages'].items():
+                writer.writerow([r['strategy'], name, s['count']] + [round(s[key] * 1000, 3) for key in ('mean', 'p50', 'p90', 'p99', 'max')]
+                                + [round(r['throughput'], 3), round(r['peak_rss_mb'], 1)])
+    return json_path, csv_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='end-to-end pipeline benchmark with per-stage timings')
+    parser.add_argument('--test_data_path', type=str, default='./BRIDGE_data/PIE_test.jsonl', help='test data (the first n_items are used)')
+    parser.add_argument('--n_items', type=int, default=20, help='number of test items')
+    parser.add_argument('--strategies', type=str, default=','.join(PROMPT_STRATEGIES), help='comma-separated prompt strategies')
+    parser.add_argument('--model_name', type=str, default='qwen2.5-coder:7b', help='model name recorded by the stand-in backend')
+    parser.add_argument('--sampling', type=str, choices=['greedy', 'k_sample'], default='greedy', help='sampling method')
+    parser.add_argument('--sample_num', type=int, default=4, help='samples per item with k_sample')
+    parser.add_argument('--num_workers', type=int, default=1, help='items processed concurrently')
+    parser.add_argument('--llm_latency_ms', type=float, default=50.0, help='response latency of the stand-in LLM backend')
+    parser.add_argument('--retrieval_mode', type=str, choices=['dense', 'hybrid', 'lexical'], default='dense', help='retrieval mode of the stores')
+    parser.add_argument('--retrieval_cache', action='store_true', help='use the persistent retrieval result cache')
+    parser.add_argument('--output_dir', type=str, default='results/benchmarks', help='directory of the json / csv results')
+    parser.add_argument('--baseline', type=str, default=None, help='earlier pipeline_<timestamp>.json to compare with')
+    parser.add_argument('--verbose', action='store_true', help='keep the INFO logs of the pipeline')
+    parser.add_argument('--strategy', type=str, default=None, help=argparse.SUPPRESS)  # set for the per-strategy subprocess
+    parser.add_argument('--child_output', type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    if args.strategy:
+        with open(args.child_output, 'w') as f:
+            json.dump(run_strategy(args), f)
+        return
+
+    results = []
+    for strategy in args.strategies.split(','):
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+            child_output = f.name
+        try:
+            subprocess.run([sys.executable, __file__, *sys.argv[1:], '--strategy', strategy, '--child_output', child_output], check=True)
+            with open(child_output, 'r') as f:
+                result = json.load(f)
+        except (subprocess.CalledProcessError, ValueError) as e:
+            print(f"{strategy}: failed ({e})")
+            continue
+        finally:
+            os.remove(child_output)
+        print_result(result)
+        results.append(result)
+
+    json_path, csv_path = save(results, args, args.output_dir)
+    print(f"\nresults: {json_path}, {csv_path}")
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == '__main__':
+    main()
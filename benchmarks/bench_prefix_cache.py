@@ -0,0 +1,169 @@
+"""
+Benchmark: server-side prefill time of the default and prefix_cache prompt layouts.
+
+Ollama keeps the KV cache of the last prompt of a slot and only evaluates the tokens
+after the longest common prefix with it. The default templates put the retrieved
+examples before the source code, so the prompts of the samples of an item already
+differ after a few hundred characters and every call re-prefills its full context.
+The prefix_cache layout (--prompt_layout prefix_cache, templates/prefix_cache/) puts
+the instructions and the source code first and the examples last.
+
+The first --n_items of the test set are prompted with --sample_num samples per item in
+both layouts (layouts alternate per item, so both see the same server state), against
+one real Ollama server. For every layout it reports
+- prompt_eval_duration (the server's prefill time) of the first sample of an item and
+  of the later samples, which can reuse the prefix of the previous sample
+- prompt_eval_count: the tokens the server actually evaluated (cached tokens excluded)
+- the mean share of a prompt that is a common prefix with the previous prompt
+and the total prefill savings of prefix_cache against default. Responses are limited
+to --num_predict tokens, as only the prefill is measured.
+
+Use a single server (--host) so both layouts see the same cache; keep OLLAMA_NUM_PARALLEL=1
+for the same reason (the inference runner keeps the samples of an item on one backend).
+
+Usage:
+    python benchmarks/bench_prefix_cache.py --model_name qwen2.5-coder:7b --test_data_path ./BRIDGE_data/PIE_test.jsonl \
+        --strategies retrieve_basic,hybrid --n_items 10 --sample_num 4 --output results/benchmarks/prefix_cache.json
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from datetime import datetime
+
+import numpy as np
+
+sys.path.append('.')
+from inference_module.main_inference import generate_prompt
+from inference_module.retrieval_resources import get_shared_resources
+from inference_module.backend_pool import BackendPool
+from inference_module.utils import PROMPT_LAYOUTS
+
+
+def common_prefix_length(a, b):
+    return len(os.path.commonprefix([a, b]))
+
+
+def load_items(test_data_path, n_items):
+    """the first n_items of the test set; hybrid_after_rules gets the source code as its previous (rules) answer"""
+    with open(test_data_path, 'r') as f:
+        items = [json.loads(line) for _, line in zip(range(n_items), f)]
+    for item in items:
+        item.setdefault('generated_answers', [item['src_code']])
+    return items
+
+
+def prefill(client, model_name, prompt, system_prompt, temperature, num_predict):
+    """one chat request; the server's prefill seconds and evaluated prompt tokens"""
+    messages = []
+    if system_prompt:
+        messages.append({'role': 'system', 'content': system_prompt})
+    messages.append({'role': 'user', 'content': prompt})
+    response = client.chat(
+        model=model_name,
+        messages=messages,
+        options={'temperature': temperature, 'num_ctx': 8192, 'num_predict': num_predict}
+    )
+    return (getattr(response, 'prompt_eval_duration', None) or 0) / 1e9, getattr(response, 'prompt_eval_count', None) or 0
+
+
+def run_strategy(strategy, items, client, args):
+    """
+    Returns:
+        dict: layout -> list of sample records {'src_id', 'sample', 'prompt_eval_seconds', 'prompt_eval_count', 'prompt_chars', 'shared_prefix'}
+    """
+    resources = get_shared_resources().get(strategy)
+    records = {layout: [] for layout in PROMPT_LAYOUTS}
+    for index, item in enumerate(items):
+        # alternate the layout that goes first, so neither always follows the other's cache
+        layouts = PROMPT_LAYOUTS if index % 2 == 0 else PROMPT_LAYOUTS[::-1]
+        for layout in layouts:
+            prompts = generate_prompt(item, strategy, 'k_sample', args.sample_num, *resources, client=client,
+                                      temperature=args.temperature, model_name=args.model_name, prompt_layout=layout)
+            previous = ''
+            for sample, dics in enumerate(prompts):
+                text = f"{dics['system_prompt'] or ''}\n{dics['prompt']}"
+                seconds, tokens = prefill(client, args.model_name, dics['prompt'], dics['system_prompt'], args.temperature, args.num_predict)
+                records[layout].append({
+                    'src_id': item['src_id'],
+                    'sample': sample,
+                    'prompt_eval_seconds': seconds,
+                    'prompt_eval_count': tokens,
+                    'prompt_chars': len(text),
+                    'shared_prefix': common_prefix_length(previous, text) / len(text) if previous else 0.0
+                })
+                previous = text
+        print(f"{strategy}: {index + 1}/{len(items)} items", end='\r', flush=True)
+    print()
+    return records
+
+
+def summarize(records):
+    first = [r for r in records if r['sample'] == 0]
+    later = [r for r in records if r['sample'] > 0]
+    mean = lambda rs, key: float(np.mean([r[key] for r in rs])) if rs else 0.0
+    return {
+        'calls': len(records),
+        'prefill_seconds': float(sum(r['prompt_eval_seconds'] for r in records)),
+        'first_prefill_ms': mean(first, 'prompt_eval_seconds') * 1000,
+        'later_prefill_ms': mean(later, 'prompt_eval_seconds') * 1000,
+        'first_eval_tokens': mean(first, 'prompt_eval_count'),
+        'later_eval_tokens': mean(later, 'prompt_eval_count'),
+        'shared_prefix': mean(later, 'shared_prefix')
+    }
+
+
+def print_summary(strategy, summary):
+    print(f"\n== {strategy}")
+    print(f"{'layout':<14}{'calls':>7}{'prefill(s)':>12}{'first(ms)':>11}{'later(ms)':>11}{'first tok':>11}{'later tok':>11}{'shared':>9}")
+    for layout, s in summary.items():
+        print(f"{layout:<14}{s['calls']:>7}{s['prefill_seconds']:>12.2f}{s['first_prefill_ms']:>11.1f}{s['later_prefill_ms']:>11.1f}"
+              f"{s['first_eval_tokens']:>11.0f}{s['later_eval_tokens']:>11.0f}{s['shared_prefix'] * 100:>8.1f}%")
+    before, after = summary['default']['prefill_seconds'], summary['prefix_cache']['prefill_seconds']
+    if before > 0:
+        print(f"prefill savings of prefix_cache: {(before - after) / before * 100:.1f}% ({before - after:.2f}s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='prefill time of the default and prefix_cache prompt layouts on an Ollama server')
+    parser.add_argument('--model_name', type=str, default='qwen2.5-coder:7b', help='model served by Ollama')
+    parser.add_argument('--test_data_path', type=str, default='./BRIDGE_data/PIE_test.jsonl', help='test data (the first n_items are used)')
+    parser.add_argument('--strategies', type=str, default='retrieve_basic,hybrid', help='comma-separated prompt strategies')
+    parser.add_argument('--n_items', type=int, default=10, help='number of test items')
+    parser.add_argument('--sample_num', type=int, default=4, help='samples per item')
+    parser.add_argument('--host', type=str, default='localhost:11434', help='Ollama server (a single one, see the module docstring)')
+    parser.add_argument('--temperature', type=float, default=0.7, help='sampling temperature')
+    parser.add_argument('--num_predict', type=int, default=16, help='response tokens per call (only the prefill is measured)')
+    parser.add_argument('--output', type=str, default=None, help='json file of the per-sample records and summaries')
+    parser.add_argument('--verbose', action='store_true', help='keep the INFO logs of the pipeline')
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    client = BackendPool([args.host])
+    if not client.check_all():
+        sys.exit(f"Ollama server {args.host} is not reachable")
+    client.preload(args.model_name)
+    items = load_items(args.test_data_path, args.n_items)
+
+    report = {'timestamp': datetime.now().strftime('%Y%m%d-%H%M%S'), 'args': vars(args), 'strategies': {}}
+    for strategy in args.strategies.split(','):
+        start = time.perf_counter()
+        records = run_strategy(strategy, items, client, args)
+        summary = {layout: summarize(records[layout]) for layout in PROMPT_LAYOUTS}
+        print_summary(strategy, summary)
+        print(f"({time.perf_counter() - start:.0f}s)")
+        report['strategies'][strategy] = {'summary': summary, 'records': records}
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nresults: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
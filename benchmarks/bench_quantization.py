@@ -0,0 +1,69 @@
+"""
+Benchmark: recall@k, latency and memory of the compressed vector representations.
+
+Runs on an existing store (its matrix.npy is built if needed) or on synthetic
+clustered vectors. Queries are store vectors perturbed with Gaussian noise, and
+recall@k is measured against the exact float32 search.
+
+Usage:
+    python benchmarks/bench_quantization.py --store_path ./BRIDGE_data/rag_store/distilled_deepseek
+    python benchmarks/bench_quantization.py --n_vectors 100000 --dim 1536 --kinds int8,pq
+"""
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.append('.')
+from detection_module_LLM_based.vector_matrix import VectorMatrix, normalize_rows
+from detection_module_LLM_based.quantization import QuantizedMatrix, QUANTIZATION_KINDS, evaluate_recall
+
+
+def synthetic_matrix(n_vectors, dim, n_clusters=500, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim), dtype=np.float32)
+    matrix = centers[rng.integers(0, n_clusters, n_vectors)] + 0.5 * rng.standard_normal((n_vectors, dim), dtype=np.float32)
+    return VectorMatrix(normalize_rows(matrix), np.arange(n_vectors, dtype=np.int64), {'full': (0, n_vectors)}, version='synthetic')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='quantized vector search benchmark')
+    parser.add_argument('--store_path', type=str, default=None, help='existing vector store (default: synthetic vectors)')
+    parser.add_argument('--n_vectors', type=int, default=50000, help='number of synthetic vectors')
+    parser.add_argument('--dim', type=int, default=1536, help='dimension of the synthetic vectors')
+    parser.add_argument('--kinds', type=str, default=','.join(QUANTIZATION_KINDS), help='comma-separated quantization kinds')
+    parser.add_argument('--k', type=str, default='2,10', help='comma-separated k values')
+    parser.add_argument('--n_queries', type=int, default=100, help='number of queries')
+    parser.add_argument('--noise', type=float, default=0.5, help='relative noise added to the query vectors')
+    parser.add_argument('--shortlist', type=int, default=None, help='rescored candidates (default: max(10 k, 100))')
+    args = parser.parse_args()
+
+    if args.store_path:
+        from detection_module_LLM_based.vector_store import DiskBackedVectorStore
+        vector_matrix = DiskBackedVectorStore(args.store_path, model_name=None).vector_matrix()
+    else:
+        vector_matrix = synthetic_matrix(args.n_vectors, args.dim)
+    n_rows, dim = vector_matrix.matrix.shape
+
+    rng = np.random.default_rng(1)
+    queries = np.asarray(vector_matrix.matrix[np.sort(rng.choice(n_rows, args.n_queries, replace=False))], dtype=np.float32)
+    queries = queries + args.noise / np.sqrt(dim) * rng.standard_normal(queries.shape, dtype=np.float32)
+
+    print(f"{n_rows} vectors x {dim} dims, {args.n_queries} queries")
+    print(f"{'kind':<10}{'k':>4}{'recall':>9}{'recall(no rescore)':>20}{'float32(ms)':>13}{'quant(ms)':>11}{'MB':>9}{'ratio':>8}{'build(s)':>10}")
+    for kind in args.kinds.split(','):
+        start = time.perf_counter()
+        quantized = QuantizedMatrix.build(vector_matrix, kind)
+        build_time = time.perf_counter() - start
+        for k in [int(k) for k in args.k.split(',')]:
+            result = evaluate_recall(vector_matrix, quantized, queries, k, rescore=True, shortlist=args.shortlist)
+            raw = evaluate_recall(vector_matrix, quantized, queries, k, rescore=False)
+            print(
+                f"{kind:<10}{k:>4}{result['recall']:>9.3f}{raw['recall']:>20.3f}{result['float32_ms']:>13.2f}{result['quantized_ms']:>11.2f}"
+                f"{result['quantized_mb']:>9.1f}{result['float32_mb'] / result['quantized_mb']:>7.1f}x{build_time:>10.1f}"
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Benchmark: two-stage search (reduced-dimension shortlist + full-vector rerank).
+
+With --store_path and --test_data_path the queries are the src_code of the test set
+(e.g. PIE) embedded with the store's embedding model, which is the retrieval workload
+of retrieve_basic / retrieve_LLM_codesim. Without them, synthetic vectors with a
+decaying spectrum are used.
+
+Usage:
+    python benchmarks/bench_two_stage_search.py \
+        --store_path ./BRIDGE_data/rag_store/hq_snippet \
+        --test_data_path ./BRIDGE_data/PIE_test.jsonl \
+        --dims 64,128,256
+    python benchmarks/bench_two_stage_search.py --n_vectors 100000 --dim 1536
+"""
+import os
+for var in ('OPENBLAS_NUM_THREADS', 'OMP_NUM_THREADS', 'MKL_NUM_THREADS'):
+    os.environ.setdefault(var, '1')
+
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+sys.path.append('.')
+from detection_module_LLM_based.vector_matrix import VectorMatrix, normalize_rows
+from detection_module_LLM_based.dim_reduction import ReducedMatrix, REDUCTION_METHODS
+from detection_module_LLM_based.quantization import evaluate_recall
+
+
+def synthetic_data(n_vectors, dim, n_queries, seed=0):
+    """vectors with a power-law spectrum (most of the variance in few directions, like sentence embeddings)"""
+    rng = np.random.default_rng(seed)
+    basis, _ = np.linalg.qr(rng.standard_normal((dim, dim)))
+    scales = (1.0 / np.arange(1, dim + 1) ** 0.8).astype(np.float32)
+    vectors = (rng.standard_normal((n_vectors + n_queries, dim), dtype=np.float32) * scales) @ basis.T.astype(np.float32)
+    vectors += 0.5 * basis[:, 0].astype(np.float32)
+    matrix = VectorMatrix(normalize_rows(vectors[:n_vectors]), np.arange(n_vectors, dtype=np.int64), {'full': (0, n_vectors)}, version='synthetic')
+    return matrix, vectors[n_vectors:]
+
+
+def store_data(store_path, test_data_path, mode, n_queries):
+    from detection_module_LLM_based.vector_store import DiskBackedVectorStore
+    from detection_module_LLM_based.embedding_processor import EmbeddingProcessor
+
+    store = DiskBackedVectorStore(store_path, model_name='Qodo/Qodo-Embed-1-1.5B')
+    full = store.vector_matrix()
+    start, end = full.mode_ranges[mode]
+    matrix = VectorMatrix(full.matrix[start:end], full.row_ids[start:end], {mode: (0, end - start)}, version=full.version)
+
+    with open(test_data_path, 'r') as f:
+        src_codes = [json.loads(line)['src_code'] for line in f][:n_queries]
+    embedder = EmbeddingProcessor(model_name=store.model_name)
+    queries = np.stack([embedder.encode(code) for code in src_codes])
+    return matrix, queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description='two-stage search benchmark')
+    parser.add_argument('--store_path', type=str, default=None, help='existing vector store')
+    parser.add_argument('--test_data_path', type=str, default=None, help='test data whose src_code are the queries (e.g. PIE_test.jsonl)')
+    parser.add_argument('--mode', type=str, default='full', help='store mode searched')
+    parser.add_argument('--n_vectors', type=int, default=100000, help='number of synthetic vectors')
+    parser.add_argument('--dim', type=int, default=1536, help='dimension of the synthetic vectors')
+    parser.add_argument('--n_queries', type=int, default=100, help='number of queries')
+    parser.add_argument('--dims', type=str, default='64,128,256', help='comma-separated reduced dimensions')
+    parser.add_argument('--methods', type=str, default=','.join(REDUCTION_METHODS), help='comma-separated reduction methods')
+    parser.add_argument('--k', type=str, default='2,10', help='comma-separated k values')
+    parser.add_argument('--shortlist', type=int, default=None, help='reranked candidates (default: max(10 k, 100))')
+    args = parser.parse_args()
+
+    if args.store_path and args.test_data_path:
+        matrix, queries = store_data(args.store_path, args.test_data_path, args.mode, args.n_queries)
+    else:
+        matrix, queries = synthetic_data(args.n_vectors, args.dim, args.n_queries)
+    n_rows, dim = matrix.matrix.shape
+
+    print(f"{n_rows} vectors x {dim} dims, {len(queries)} queries")
+    print(f"{'method':<10}{'dim':>5}{'k':>4}{'recall':>9}{'recall(stage 1)':>17}{'full(ms)':>10}{'2-stage(ms)':>13}{'speedup':>9}{'fit(s)':>8}")
+    for method in args.methods.split(','):
+        for reduced_dim in [int(d) for d in args.dims.split(',')]:
+            start = time.perf_counter()
+            reduced = ReducedMatrix.fit(matrix, reduced_dim, method)
+            fit_time = time.perf_counter() - start
+            for k in [int(k) for k in args.k.split(',')]:
+                result = evaluate_recall(matrix, reduced, queries, k, rescore=True, shortlist=args.shortlist)
+                stage_one = evaluate_recall(matrix, reduced, queries, k, rescore=False)
+                print(
+                    f"{method:<10}{reduced_dim:>5}{k:>4}{result['recall']:>9.3f}{stage_one['recall']:>17.3f}"
+                    f"{result['float32_ms']:>10.2f}{result['quantized_ms']:>13.2f}{result['float32_ms'] / result['quantized_ms']:>8.1f}x{fit_time:>8.1f}"
+                )
+
+
+if __name__ == '__main__':
+    main()
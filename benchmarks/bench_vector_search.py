@@ -0,0 +1,109 @@
+"""
+Benchmark: parallel top-k search over the memory-mapped vector matrix.
+
+Compares the previous search_parallel (stack the per-entry vectors, sklearn
+cosine_similarity, full sort) with VectorMatrix.top_k for an increasing number of
+scoring threads. BLAS threading is disabled so that the scaling comes from the
+block-level thread pool only.
+
+Usage:
+    python benchmarks/bench_vector_search.py --sizes 100000,300000 --dim 1536
+    python benchmarks/bench_vector_search.py --sizes 1000000 --dim 1536 --no_legacy   # ~6 GB matrix
+"""
+import os
+for var in ('OPENBLAS_NUM_THREADS', 'OMP_NUM_THREADS', 'MKL_NUM_THREADS'):
+    os.environ.setdefault(var, '1')
+
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+from sklearn.metrics.pairwise import cosine_similarity
+
+sys.path.append('.')
+from detection_module_LLM_based.vector_matrix import VectorMatrix, MATRIX_FILE, MATRIX_INDEX_FILE, normalize_rows
+
+
+def legacy_search(vectors, query_vec, k):
+    """previous search_parallel: stack the vectors of every entry and sort all similarities"""
+    vec_matrix = np.stack(vectors)
+    sims = cosine_similarity([query_vec], vec_matrix)[0]
+    return sorted(enumerate(sims), key=lambda x: x[1], reverse=True)[:k]
+
+
+def make_matrix(storage_path, n_rows, dim, seed=0):
+    """write a random normalized matrix (mode 'full') in blocks and return it memory-mapped"""
+    rng = np.random.default_rng(seed)
+    matrix = np.lib.format.open_memmap(os.path.join(storage_path, MATRIX_FILE), mode='w+', dtype=np.float32, shape=(n_rows, dim))
+    for start in range(0, n_rows, 65536):
+        end = min(start + 65536, n_rows)
+        matrix[start:end] = normalize_rows(rng.standard_normal((end - start, dim), dtype=np.float32))
+    matrix.flush()
+    del matrix
+
+    with open(os.path.join(storage_path, MATRIX_INDEX_FILE), 'w') as f:
+        json.dump({'version': 'bench', 'row_ids': list(range(n_rows)), 'mode_ranges': {'full': [0, n_rows]}}, f)
+    return VectorMatrix.load(storage_path, 'bench')
+
+
+def time_call(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='parallel vector search benchmark')
+    parser.add_argument('--sizes', type=str, default='100000,300000', help='comma-separated number of vectors')
+    parser.add_argument('--dim', type=int, default=1536, help='vector dimension (Qodo-Embed-1-1.5B: 1536)')
+    parser.add_argument('--k', type=int, default=2, help='number of results')
+    parser.add_argument('--workers', type=str, default=None, help='comma-separated thread counts (default: 1, 2, 4, ... up to the CPU count)')
+    parser.add_argument('--repeat', type=int, default=5, help='number of repetitions (best time is reported)')
+    parser.add_argument('--no_legacy', action='store_true', help='skip the previous implementation (slow for large stores)')
+    args = parser.parse_args()
+
+    cpu_count = os.cpu_count() or 1
+    if args.workers:
+        worker_counts = [int(w) for w in args.workers.split(',')]
+    else:
+        worker_counts = [1]
+        while worker_counts[-1] * 2 <= cpu_count:
+            worker_counts.append(worker_counts[-1] * 2)
+
+    rng = np.random.default_rng(1)
+    print(f"cpu count: {cpu_count}, dim: {args.dim}, k: {args.k}")
+    for n_rows in [int(n) for n in args.sizes.split(',')]:
+        storage_path = tempfile.mkdtemp(prefix='bench_vector_search_')
+        try:
+            matrix = make_matrix(storage_path, n_rows, args.dim)
+            query = rng.standard_normal(args.dim).astype(np.float32)
+            expected = [row for _, row in matrix.top_k(query, args.k, n_workers=1)]
+            matrix.top_k(query, args.k, n_workers=max(worker_counts))  # warm up the page cache and the thread pools
+
+            print(f"\n{n_rows} vectors ({n_rows * args.dim * 4 / 2**20:.0f} MB)")
+            if not args.no_legacy:
+                vectors = list(np.asarray(matrix.matrix))
+                legacy = time_call(lambda: legacy_search(vectors, query, args.k), args.repeat)
+                assert [row for row, _ in legacy_search(vectors, query, args.k)] == expected
+                del vectors
+                print(f"  {'legacy':<12}{legacy * 1000:>10.1f} ms")
+
+            base = None
+            for n_workers in worker_counts:
+                assert [row for _, row in matrix.top_k(query, args.k, n_workers=n_workers)] == expected
+                elapsed = time_call(lambda: matrix.top_k(query, args.k, n_workers=n_workers), args.repeat)
+                base = base or elapsed
+                print(f"  {f'{n_workers} threads':<12}{elapsed * 1000:>10.1f} ms   scaling {base / elapsed:.2f}x")
+        finally:
+            shutil.rmtree(storage_path)
+
+
+if __name__ == '__main__':
+    main()
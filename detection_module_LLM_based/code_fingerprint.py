@@ -0,0 +1,297 @@
+"""
+Structural code fingerprints (bottleneck profile) used as a retrieval key.
+
+A fingerprint is a small int16 vector per source:
+- per rule category of the symbolic advisor (NL_descriptions.json): number of findings
+  and the maximum loop depth of their lines
+- basic syntax statistics: lines, functions, loops, maximum loop depth, branches, calls
+and its bitmap has bit i set when rule category i has a finding.
+
+The findings of a source come from the rule detection results
+(detect_results/<code_id>/*.json, produced by Joern over the CPG of the source).
+Sources without a CPG, such as the HQ training codes of the vector store, use
+lexical approximations of the same rules; retrieval queries are fingerprinted
+with the lexical rules as well, so their bitmaps are comparable to the store's. Loop depths and functions come from a
+light brace / keyword scan of the code with comments and strings blanked, so line
+numbers match the detection results.
+
+DiskBackedVectorStore keeps the fingerprints of its entries (fingerprints.npz, rows
+aligned with matrix.npy) and can filter (bitmap pre-filter) or boost candidates with
+a matching bottleneck profile.
+"""
+import os
+import re
+import json
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import sys
+sys.path.append('.')
+from detection_module_LLM_based.vector_matrix import VectorMatrix
+
+NL_DESCRIPTIONS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                    'detection_module_rule_based', 'NL_descriptions.json')
+DETECT_RESULT_DIR = 'detection_module_rule_based/detect_results'
+FINGERPRINT_FILE = 'fingerprints.npz'
+
+SYNTAX_FEATURES = ['lines', 'functions', 'loops', 'max_loop_depth', 'branches', 'calls']
+
+# rule categories of the symbolic advisor, read on the first fingerprint (importing the module needs no data files)
+_rule_target_files: Optional[Dict[str, List[str]]] = None
+_rules_lock = threading.Lock()
+
+
+def rule_target_files() -> Dict[str, List[str]]:
+    """rule category -> detection result files of the category (NL_descriptions.json)"""
+    global _rule_target_files
+    with _rules_lock:
+        if _rule_target_files is None:
+            with open(NL_DESCRIPTIONS_PATH, 'r') as f:
+                _rule_target_files = {category: d['target_files'] for category, d in json.load(f).items()}
+        return _rule_target_files
+
+
+def categories() -> List[str]:
+    return list(rule_target_files())
+
+
+def feature_names() -> List[str]:
+    return [f"{c}_{s}" for c in categories() for s in ('count', 'loop_depth')] + SYNTAX_FEATURES
+
+KEYWORDS = {'if', 'for', 'while', 'do', 'switch', 'return', 'sizeof', 'else', 'case', 'catch', 'new', 'delete'}
+MATH_CALLS = r'sqrt|cbrt|log|log2|log10|exp|sin|cos|tan|atan2|hypot'
+
+# lexical approximations of the rules: category -> [(pattern, only inside loops)]
+HEURISTIC_RULES = {
+    'bit_manipulation': [(r'[%/*]\s*2\b(?![.\d])', False), (r'=\s*1\s*-\s*\w+\s*;', False)],
+    'vector': [(r'\bvector\s*<', False)],
+    'non_hash': [(r'\b(?:map|set|multimap|multiset)\s*<', False)],
+    'IO_library': [(r'\bcin\s*>>|\bcout\s*<<|\bendl\b', False), (r'\b[io]?stringstream\b', False), (r'\bgetchar\s*\(', True)],
+    'pow_library': [(r'\bpow\s*\(', False)],
+    'literal_math': [(rf'\b(?:{MATH_CALLS}|pow)\s*\(\s*[\d.]+\s*[,)]', False)],
+    'loop_invariant_math': [(rf'\b(?:{MATH_CALLS}|strlen)\s*\(', True)],
+    'expensive_std_in_loop': [(r'\b(?:sort|find)\s*\(', True)],
+    'string_concat_in_loop': [(r'\b(\w+)\s*=\s*\1\s*\+', True), (r'\+=\s*"', True), (r'\bstrcat\s*\(|\.append\s*\(', True)],
+}
+
+_BLANK_PATTERN = re.compile(r'//[^\n]*|/\*.*?\*/|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'', re.DOTALL)
+_SCAN_PATTERN = re.compile(r'[A-Za-z_]\w*|[{}();]')
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def blank_comments_and_strings(code: str) -> str:
+    """replace comments and string contents with spaces (line numbers are kept)"""
+    def blank(match):
+        text = match.group(0)
+        if text[0] in '"\'':
+            return text[0] + re.sub(r'[^\n]', ' ', text[1:-1]) + text[-1]
+        return re.sub(r'[^\n]', ' ', text)
+    return _BLANK_PATTERN.sub(blank, code)
+
+
+def scan_structure(code: str) -> Tuple[List[int], List[Tuple[str, int, int]], int]:
+    """
+    loop depth of every line, function definitions and loop count of (blanked) code.
+
+    Returns:
+        tuple: (loop depth per line, [(function name, first line, last line)], number of loops)
+    """
+    lines = code.split('\n')
+    depths = [0] * len(lines)
+    blocks = []             # (loop levels opened by the brace, is a do body) of every open brace
+    pending = 0             # loop headers whose body has not started
+    pending_do = False
+    in_header = False       # inside the parentheses of a for / while header
+    header_paren = 0
+    paren_depth = 0
+    loops = 0
+    last_token = None
+    last_name = None        # identifier before the last top-level '('
+    closed_do = False       # the previous token closed a do body (the next 'while' ends the do)
+    functions, function_start, function_name = [], None, None
+
+    for number, line in enumerate(lines):
+        depth = sum(levels for levels, _ in blocks) + pending
+        for token in _SCAN_PATTERN.findall(line):
+            if token == 'while' and closed_do:
+                pass
+            elif token in ('for', 'while', 'do'):
+                loops += 1
+                if token == 'do':
+                    pending += 1
+                    pending_do = True
+                else:
+                    in_header, header_paren = True, paren_depth
+            elif token == '(':
+                if paren_depth == 0 and last_token and (last_token[0].isalpha() or last_token[0] == '_'):
+                    last_name = last_token
+                paren_depth += 1
+            elif token == ')':
+                paren_depth = max(paren_depth - 1, 0)
+                if in_header and paren_depth == header_paren:
+                    in_header = False
+                    pending += 1
+            elif token == '{':
+                if not blocks and last_token in (')', 'const') and last_name and last_name not in KEYWORDS:
+                    function_start, function_name = number, last_name
+                blocks.append((pending, pending_do))
+                pending, pending_do = 0, False
+            elif token == '}':
+                _, is_do = blocks.pop() if blocks else (0, False)
+                if not blocks and function_start is not None:
+                    functions.append((function_name, function_start + 1, number + 1))
+                    function_start = None
+            elif token == ';' and paren_depth == 0:
+                # single-statement loop bodies end with their statement
+                pending, pending_do = 0, False
+            closed_do = token == '}' and is_do
+            depth = max(depth, sum(levels for levels, _ in blocks) + pending)
+            last_token = token
+        depths[number] = depth
+    return depths, functions, loops
+
+
+def heuristic_findings(code: str, depths: List[int] = None, functions: List[Tuple[str, int, int]] = None) -> Dict[str, List[int]]:
+    """
+    lexical approximation of the rule detection.
+
+    Returns:
+        dict: category -> line numbers (1-based) of the findings
+    """
+    blanked = blank_comments_and_strings(code)
+    if depths is None:
+        depths, functions, _ = scan_structure(blanked)
+    lines = blanked.split('\n')
+    findings = {category: [] for category in categories()}
+
+    for name, start, end in functions or []:
+        body = '\n'.join(lines[start - 1:end])
+        # the definition itself is one match, a second one is a self call
+        if len(re.findall(rf'\b{re.escape(name)}\s*\(', body)) > 1:
+            findings['recursive'].append(start)
+
+    for category, rules in HEURISTIC_RULES.items():
+        for number, line in enumerate(lines, start=1):
+            for pattern, loop_only in rules:
+                if (not loop_only or depths[number - 1] > 0) and re.search(pattern, line):
+                    findings[category].append(number)
+                    break
+    return findings
+
+
+def detected_findings(code_id: str, result_dir: str = DETECT_RESULT_DIR) -> Optional[Dict[str, List[int]]]:
+    """findings of the rule detection results of a source (None if the source was not analyzed)"""
+    if code_id.endswith('.cpp'):
+        code_id = code_id[:-4]
+    result_path = os.path.join(result_dir, code_id)
+    if not os.path.isdir(result_path):
+        return None
+    findings = {category: [] for category in categories()}
+    for category, files in rule_target_files().items():
+        for file in files:
+            path = os.path.join(result_path, file)
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r') as f:
+                for result in json.load(f)['results']:
+                    line = str(result['elements'].get('LINE_NUMBER', ''))
+                    findings[category].append(int(line) if line.isdigit() else 0)
+    return findings
+
+
+def code_fingerprint(code: str, code_id: str = None, result_dir: str = DETECT_RESULT_DIR) -> np.ndarray:
+    """
+    fingerprint of a source (feature_names() order).
+
+    Args:
+        code_id: id of the source in the rule detection results; the lexical rules are used without one or if it has none
+                 (store entries and retrieval queries use the lexical rules)
+    """
+    blanked = blank_comments_and_strings(code or '')
+    depths, functions, loops = scan_structure(blanked)
+    findings = detected_findings(code_id, result_dir) if code_id else None
+    if findings is None:
+        findings = heuristic_findings(code or '', depths, functions)
+
+    features = []
+    for category in categories():
+        lines = findings[category]
+        features.append(len(lines))
+        features.append(max((depths[line - 1] for line in lines if 0 < line <= len(depths)), default=0))
+
+    calls = [name for name in re.findall(r'\b([A-Za-z_]\w*)\s*\(', blanked) if name not in KEYWORDS]
+    features.extend([
+        sum(1 for line in blanked.split('\n') if line.strip()),
+        len(functions),
+        loops,
+        max(depths, default=0),
+        len(re.findall(r'\b(?:if|switch)\b|\?', blanked)),
+        len(calls)
+    ])
+    return np.clip(np.asarray(features), 0, np.iinfo(np.int16).max).astype(np.int16)
+
+
+def fingerprint_bits(fingerprint: np.ndarray) -> int:
+    """bitmap of the rule categories with findings"""
+    counts = np.asarray(fingerprint)[:2 * len(categories()):2]
+    return int(sum(1 << i for i, count in enumerate(counts) if count > 0))
+
+
+def popcount(bits: np.ndarray) -> np.ndarray:
+    bits = np.ascontiguousarray(bits, dtype=np.uint32)
+    return _POPCOUNT[bits.view(np.uint8)].reshape(-1, 4).sum(axis=1)
+
+
+class FingerprintMatrix:
+    def __init__(self, features: np.ndarray, bits: np.ndarray, version: str = None):
+        """
+        Args:
+            features: fingerprints [n_rows, len(feature_names())], rows aligned with the VectorMatrix
+            bits: bitmap of every row
+            version: the store version the fingerprints were computed from
+        """
+        self.features = features
+        self.bits = bits
+        self.version = version
+
+    @classmethod
+    def build(cls, vector_matrix: VectorMatrix, meta_by_id: Dict[int, Dict]) -> 'FingerprintMatrix':
+        """fingerprints of the entry texts (codes), in the row order of the vector matrix"""
+        features = np.zeros((len(vector_matrix.row_ids), len(feature_names())), dtype=np.int16)
+        for row, entry_id in enumerate(vector_matrix.row_ids):
+            text = meta_by_id[int(entry_id)]['text']
+            features[row] = code_fingerprint(' '.join(text) if isinstance(text, list) else text)
+        bits = np.array([fingerprint_bits(f) for f in features], dtype=np.uint32)
+        return cls(features, bits, vector_matrix.version)
+
+    def save(self, storage_path: str):
+        path = os.path.join(storage_path, FINGERPRINT_FILE)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, version=np.array(self.version or ''), features=self.features, bits=self.bits,
+                     feature_names=np.array(feature_names()))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, storage_path: str, version: str = None) -> Optional['FingerprintMatrix']:
+        """None if the file is missing, was computed from another store version or has other features"""
+        path = os.path.join(storage_path, FINGERPRINT_FILE)
+        if not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle=False) as data:
+            if str(data['version']) != (version or '') or data['feature_names'].tolist() != feature_names():
+                return None
+            return cls(data['features'], data['bits'], version)
+
+    def candidate_rows(self, query_bits: int, ranges: List[Tuple[int, int]]) -> np.ndarray:
+        """rows in the ranges that share at least one bottleneck category with the query (bitmap pre-filter)"""
+        parts = [start + np.flatnonzero(self.bits[start:end] & np.uint32(query_bits)) for start, end in ranges]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+
+    def overlap(self, query_bits: int) -> np.ndarray:
+        """Jaccard similarity of every row's bitmap with the query bitmap"""
+        query = np.uint32(query_bits)
+        union = popcount(self.bits | query)
+        return np.where(union > 0, popcount(self.bits & query) / np.maximum(union, 1), 0.0).astype(np.float32)
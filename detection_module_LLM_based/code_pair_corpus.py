@@ -0,0 +1,150 @@
+"""
+Precomputed corpus of comment-stripped slow-fast code pairs with an offset index.
+
+load_code_pair strips the comments of every HQ pair (a DOTALL regex over both
+sources) and keeps all of them in memory, although a prompt reads only a few
+pairs. The corpus is built once from the training data and read on demand:
+
+    magic (b'CPCORPUS') | code data (utf-8) | offset index (int64) | header (json) | header offset (int64)
+
+The offset index holds 2 * n + 1 byte offsets into the data, pair i is
+data[idx[2i]:idx[2i+1]] (slow) and data[idx[2i+1]:idx[2i+2]] (fast). Opening
+the corpus reads only the index; pairs are read with os.pread when indexed.
+
+CodePairCorpus is a Sequence of (slow_code, fast_code) tuples, so it can be used
+wherever the list of load_code_pair is expected (indexing, len, random.sample).
+
+Usage:
+    python detection_module_LLM_based/code_pair_corpus.py --train_data_path ./BRIDGE_data/HQ_data.jsonl
+"""
+import os
+import json
+import struct
+import logging
+import argparse
+from collections.abc import Sequence
+
+import numpy as np
+
+import sys
+sys.path.append('.')
+from detection_module_LLM_based.prompt import remove_c_cpp_comments
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'CPCORPUS'
+CORPUS_VERSION = 1
+
+
+def default_corpus_path(train_data_path):
+    return os.path.splitext(train_data_path)[0] + '.corpus'
+
+
+def source_signature(train_data_path):
+    stat = os.stat(train_data_path)
+    return {'version': CORPUS_VERSION, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def build_corpus(train_data_path, corpus_path=None):
+    """
+    write the comment-stripped code pairs of the training data to the corpus file (streaming, one pair at a time).
+
+    Returns:
+        str: the corpus path
+    """
+    corpus_path = corpus_path or default_corpus_path(train_data_path)
+    tmp_path = f"{corpus_path}.{os.getpid()}.tmp"
+
+    offsets = []
+    with open(train_data_path, 'r', encoding='utf-8') as src, open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        for line in src:
+            if not line.strip():
+                continue
+            d = json.loads(line)
+            for code in (d['src_code'], d['tgt_code']):
+                offsets.append(f.tell())
+                f.write(remove_c_cpp_comments(code).encode('utf-8'))
+        offsets.append(f.tell())
+
+        f.write(np.asarray(offsets, dtype='<i8').tobytes())
+        header_offset = f.tell()
+        header = dict(source_signature(train_data_path), count=(len(offsets) - 1) // 2)
+        f.write(json.dumps(header).encode('utf-8'))
+        f.write(struct.pack('<q', header_offset))
+
+    os.replace(tmp_path, corpus_path)
+    logger.info(f"built the code pair corpus {corpus_path} ({header['count']} pairs)")
+    return corpus_path
+
+
+class CodePairCorpus(Sequence):
+    def __init__(self, corpus_path):
+        self.corpus_path = corpus_path
+        self.fd = os.open(corpus_path, os.O_RDONLY)
+        try:
+            size = os.fstat(self.fd).st_size
+            if os.pread(self.fd, len(MAGIC), 0) != MAGIC:
+                raise ValueError(f"not a code pair corpus: {corpus_path}")
+            header_offset, = struct.unpack('<q', os.pread(self.fd, 8, size - 8))
+            self.header = json.loads(os.pread(self.fd, size - 8 - header_offset, header_offset))
+            n_offsets = 2 * self.header['count'] + 1
+            index_offset = header_offset - 8 * n_offsets
+            self.offsets = np.frombuffer(os.pread(self.fd, 8 * n_offsets, index_offset), dtype='<i8')
+        except Exception:
+            os.close(self.fd)
+            raise
+
+    def __len__(self):
+        return self.header['count']
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(f"code pair index out of range: {i}")
+        start, middle, end = (int(o) for o in self.offsets[2 * i:2 * i + 3])
+        data = os.pread(self.fd, end - start, start)
+        return data[:middle - start].decode('utf-8'), data[middle - start:].decode('utf-8')
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __del__(self):
+        self.close()
+
+
+def load_code_pair_corpus(train_data_path, corpus_path=None):
+    """
+    open the corpus of the training data, (re)building it if it is missing or older than the training data.
+    An existing corpus is used as is when the training data itself is not available.
+
+    Returns:
+        CodePairCorpus
+    """
+    corpus_path = corpus_path or default_corpus_path(train_data_path)
+    if os.path.exists(corpus_path):
+        corpus = CodePairCorpus(corpus_path)
+        if not os.path.exists(train_data_path):
+            return corpus
+        header = {k: corpus.header.get(k) for k in ('version', 'size', 'mtime_ns')}
+        if header == source_signature(train_data_path):
+            return corpus
+        corpus.close()
+        logger.info(f"code pair corpus {corpus_path} is outdated, rebuilding")
+    return CodePairCorpus(build_corpus(train_data_path, corpus_path))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description='build the comment-stripped code pair corpus')
+    parser.add_argument('--train_data_path', type=str, default='./BRIDGE_data/HQ_data.jsonl', help='training data (jsonl with src_code / tgt_code)')
+    parser.add_argument('--corpus_path', type=str, default=None, help='output corpus file (default: <train_data_path without .jsonl>.corpus)')
+    args = parser.parse_args()
+
+    build_corpus(args.train_data_path, args.corpus_path)
@@ -0,0 +1,133 @@
+"""
+Dimension-reduced copy of the vector matrix for two-stage search.
+
+Stage one scores a low-dimensional copy of the store vectors to shortlist
+candidates, stage two reranks the shortlist with the full float32 vectors
+(rows of the memory-mapped matrix.npy):
+
+    pca        projection onto the top principal components of the store vectors
+    truncate   the first dimensions (Matryoshka-style; only useful for models trained for it)
+
+The reduction is fitted when the store is built (populate_vector_store(reduced_dim=...))
+and saved as matrix_<method><dim>.npz next to the store; it is refitted when the
+store version changes.
+"""
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import sys
+sys.path.append('.')
+from detection_module_LLM_based.vector_matrix import VectorMatrix, normalize_rows, parallel_top_k, rescore_shortlist, row_ranges
+
+REDUCTION_METHODS = ['pca', 'truncate']
+
+
+def fit_pca(matrix: np.ndarray, dim: int, sample_size: int = 50000, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    principal components of the (sampled) rows.
+
+    Returns:
+        tuple: (mean [D], components [D, dim])
+    """
+    rng = np.random.default_rng(seed)
+    n_rows = len(matrix)
+    rows = np.sort(rng.choice(n_rows, min(sample_size, n_rows), replace=False))
+    sample = np.asarray(matrix[rows], dtype=np.float64)
+    mean = sample.mean(axis=0)
+    # eigenvectors of the covariance (D x D) are cheaper than an SVD of the sample for n >> D
+    eigenvalues, eigenvectors = np.linalg.eigh(np.cov(sample - mean, rowvar=False))
+    components = eigenvectors[:, np.argsort(eigenvalues)[::-1][:dim]]
+    return mean.astype(np.float32), components.astype(np.float32)
+
+
+class ReducedMatrix:
+    def __init__(self, method: str, dim: int, reduced: np.ndarray, row_ids: np.ndarray, mode_ranges: Dict[str, Tuple[int, int]],
+                 mean: np.ndarray = None, components: np.ndarray = None, version: str = None):
+        """
+        Args:
+            method: 'pca' or 'truncate'
+            dim: the reduced dimension
+            reduced: L2-normalized reduced rows [n_rows, dim]
+            mean, components: the PCA projection (None for truncate)
+            row_ids, mode_ranges, version: same as the VectorMatrix it was built from
+        """
+        if method not in REDUCTION_METHODS:
+            raise ValueError(f"unsupported reduction: {method} (expected one of {REDUCTION_METHODS})")
+        self.method = method
+        self.dim = dim
+        self.reduced = reduced
+        self.row_ids = row_ids
+        self.mode_ranges = mode_ranges
+        self.mean = mean
+        self.components = components
+        self.version = version
+
+    def project(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.method == 'pca':
+            return normalize_rows((vectors - self.mean) @ self.components)
+        return normalize_rows(vectors[..., :self.dim])
+
+    @classmethod
+    def fit(cls, vector_matrix: VectorMatrix, dim: int, method: str = 'pca', block_rows: int = 65536) -> 'ReducedMatrix':
+        matrix = vector_matrix.matrix
+        if not 0 < dim < matrix.shape[1]:
+            raise ValueError(f"the reduced dimension must be between 1 and {matrix.shape[1] - 1}: {dim}")
+        mean, components = fit_pca(matrix, dim) if method == 'pca' else (None, None)
+        reduced_matrix = cls(method, dim, None, vector_matrix.row_ids, vector_matrix.mode_ranges, mean, components, vector_matrix.version)
+
+        reduced = np.empty((len(matrix), dim), dtype=np.float32)
+        for start in range(0, len(matrix), block_rows):
+            reduced[start:start + block_rows] = reduced_matrix.project(matrix[start:start + block_rows])
+        reduced_matrix.reduced = reduced
+        return reduced_matrix
+
+    @staticmethod
+    def path(storage_path: str, method: str, dim: int) -> str:
+        return os.path.join(storage_path, f"matrix_{method}{dim}.npz")
+
+    def save(self, storage_path: str):
+        path = self.path(storage_path, self.method, self.dim)
+        arrays = {'reduced': self.reduced}
+        if self.method == 'pca':
+            arrays.update(mean=self.mean, components=self.components)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, version=np.array(self.version or ''), **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, storage_path: str, method: str, dim: int, vector_matrix: VectorMatrix) -> Optional['ReducedMatrix']:
+        """None if the file is missing or was fitted on another store version"""
+        path = cls.path(storage_path, method, dim)
+        if not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle=False) as data:
+            if str(data['version']) != (vector_matrix.version or ''):
+                return None
+            mean = data['mean'] if 'mean' in data.files else None
+            components = data['components'] if 'components' in data.files else None
+            return cls(method, dim, data['reduced'], vector_matrix.row_ids, vector_matrix.mode_ranges, mean, components, vector_matrix.version)
+
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self.reduced, self.mean, self.components) if a is not None)
+
+    def top_k(self, query_vec: np.ndarray, k: int, mode_filter=None, n_workers: int = None, rescore_matrix: np.ndarray = None, shortlist: int = None) -> List[Tuple[float, int]]:
+        """
+        Args:
+            rescore_matrix: the float32 matrix (memmap) used to rerank the shortlist; None returns the reduced scores
+            shortlist: number of candidates reranked (default: max(10 k, 100))
+
+        Returns:
+            List[Tuple[float, int]]: (similarity, row) pairs, best first
+        """
+        reduced_query = self.project(query_vec)
+        ranges = row_ranges(self.mode_ranges, len(self.row_ids), mode_filter)
+        score_rows = lambda start, end: self.reduced[start:end] @ reduced_query
+        if rescore_matrix is None:
+            return parallel_top_k(score_rows, ranges, k, n_workers)
+
+        candidates = parallel_top_k(score_rows, ranges, shortlist or max(10 * k, 100), n_workers)
+        return rescore_shortlist(rescore_matrix, normalize_rows(query_vec), candidates, k)
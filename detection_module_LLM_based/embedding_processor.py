@@ -7,7 +7,13 @@ Supported modes:
 - full: full response text
 - think_tail: <think> tag after the content
 - bullet: numbered bullet points
+
+Supported backends:
+- torch: the full-precision SentenceTransformer model
+- onnx-int8: dynamically int8-quantized ONNX export of the model for CPU-only nodes
+  (exported once with export_onnx_int8 into ONNX_EXPORT_DIR)
 """
+import os
 
 import re
 from typing import List, Dict, Literal, Optional, Tuple
@@ -18,6 +24,39 @@ from sentence_transformers import SentenceTransformer
 # define supported extraction modes
 EmbeddingMode = Literal['full', 'think_tail', 'bullet']
 
+EMBEDDING_BACKENDS = ['torch', 'onnx-int8']
+ONNX_EXPORT_DIR = './BRIDGE_data/onnx'
+
+
+def onnx_model_dir(model_name: str, export_dir: str = ONNX_EXPORT_DIR) -> str:
+    return os.path.join(export_dir, model_name.replace('/', '__'))
+
+
+def onnx_int8_file_name(quantization_config: str = 'avx2') -> str:
+    return f"onnx/model_qint8_{quantization_config}.onnx"
+
+
+def export_onnx_int8(model_name: str, export_dir: str = ONNX_EXPORT_DIR, quantization_config: str = 'avx2') -> str:
+    """
+    export the model to ONNX and quantize the weights to int8 (dynamic quantization, no calibration data).
+
+    Args:
+        model_name: the Hugging Face model name
+        quantization_config: ONNX Runtime target ('avx2', 'avx512', 'avx512_vnni' or 'arm64')
+
+    Returns:
+        str: the directory of the exported model (onnx/model.onnx and onnx/model_qint8_<config>.onnx)
+    """
+    # needs sentence-transformers[onnx] (optimum, onnxruntime)
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+
+    output_dir = onnx_model_dir(model_name, export_dir)
+    model = SentenceTransformer(model_name, backend='onnx')
+    model.save_pretrained(output_dir)
+    export_dynamic_quantized_onnx_model(model, quantization_config, output_dir)
+    return output_dir
+
+
 class TextExtractor:
     @staticmethod
     def extract_full(response: str) -> Optional[str]:
@@ -72,13 +111,28 @@ class EmbeddingProcessor:
     2. embedding generation: convert extracted text segments into vectors
     """
     
-    def __init__(self, model_name: str = 'Qodo/Qodo-Embed-1-1.5B', max_tokens: int = 2048):
+    def __init__(self, model_name: str = 'Qodo/Qodo-Embed-1-1.5B', max_tokens: int = 2048, backend: str = 'torch',
+                 export_dir: str = ONNX_EXPORT_DIR, quantization_config: str = 'avx2'):
         """
         Args:
             model_name: name of the embedding model to use
             max_tokens: maximum number of text tokens
+            backend: 'torch' or 'onnx-int8' (exported on first use if export_dir has no export yet)
+            export_dir, quantization_config: location and target of the ONNX int8 export
         """
-        self.model = SentenceTransformer(model_name)
+        if backend not in EMBEDDING_BACKENDS:
+            raise ValueError(f"unsupported embedding backend: {backend} (expected one of {EMBEDDING_BACKENDS})")
+        self.model_name = model_name
+        self.backend = backend
+        if backend == 'torch':
+            self.model = SentenceTransformer(model_name)
+        else:
+            model_dir = onnx_model_dir(model_name, export_dir)
+            file_name = onnx_int8_file_name(quantization_config)
+            if not os.path.exists(os.path.join(model_dir, file_name)):
+                print(f"exporting {model_name} to int8 ONNX in {model_dir} (one time)")
+                export_onnx_int8(model_name, export_dir, quantization_config)
+            self.model = SentenceTransformer(model_dir, backend='onnx', model_kwargs={'file_name': file_name})
         self.extractor = TextExtractor()
         self.max_tokens = max_tokens
         self.tokenizer = self.model.tokenizer
@@ -98,6 +152,20 @@ class EmbeddingProcessor:
         """encode single text into embedding"""
         truncated_text = self._truncate_text(text)
         return self.model.encode(truncated_text, convert_to_numpy=True)
+
+    def encode_batch(self, texts: List[str], truncate: bool = True) -> np.ndarray:
+        """
+        encode several texts in one model call.
+
+        Args:
+            truncate: apply the token limit first (search queries are encoded as-is)
+
+        Returns:
+            np.ndarray: embeddings [len(texts), dim]
+        """
+        if truncate:
+            texts = [self._truncate_text(t) for t in texts]
+        return self.model.encode(texts, convert_to_numpy=True)
         
     def encode_segments(self, response: str, mode: EmbeddingMode, analysis_id: str=None) -> List[Dict]:
         """
@@ -131,11 +199,8 @@ class EmbeddingProcessor:
         else:
             formatted_segments = segments
             
-        # apply token limit
-        truncated_segments = [self._truncate_text(s) for s in formatted_segments]
-            
-        # generate segment embeddings
-        vectors = self.model.encode(truncated_segments, convert_to_numpy=True)
+        # generate segment embeddings (with the token limit)
+        vectors = self.encode_batch(formatted_segments)
         
         # format the result
         result = []
@@ -0,0 +1,299 @@
+"""
+Local embedding service shared by all inference workers.
+
+One process loads the embedding model (EmbeddingProcessor) and serves it over HTTP;
+every worker uses an EmbeddingClient instead of loading its own copy of the model:
+
+    POST /encode   {"texts": [...], "truncate": true}  -> float32 rows (application/octet-stream, X-Rows / X-Dim headers)
+    GET  /info     model name, backend and batching statistics
+
+Concurrent requests are micro-batched: the batching thread waits at most
+`max_wait_ms` after the first queued request for more texts (up to `max_batch_size`)
+and encodes them in one model call.
+
+EmbeddingClient has the encode / encode_batch / encode_segments interface of
+EmbeddingProcessor, so it can be passed wherever an embedder is expected
+(DiskBackedVectorStore.search*, populate_vector_store, prompt.py). load_embedder
+returns a client when a service URL is given or EMBEDDING_SERVICE_URL is set.
+
+Usage:
+    python detection_module_LLM_based/embedding_service.py --model_name Qodo/Qodo-Embed-1-1.5B --port 8765
+    EMBEDDING_SERVICE_URL=localhost:8765 python inference_module/main_inference.py ...
+"""
+import os
+import json
+import time
+import queue
+import logging
+import argparse
+import threading
+import http.client
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+from urllib.parse import urlparse
+
+import numpy as np
+
+import sys
+sys.path.append('.')
+from detection_module_LLM_based.embedding_processor import EmbeddingProcessor, TextExtractor
+
+logger = logging.getLogger(__name__)
+
+SERVICE_URL_ENV = 'EMBEDDING_SERVICE_URL'
+
+
+class MicroBatcher:
+    def __init__(self, encode_batch, max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        """
+        Args:
+            encode_batch: function (texts, truncate) -> embeddings [len(texts), dim]
+            max_batch_size: texts encoded in one model call (a larger single request is encoded alone)
+            max_wait_ms: time the first queued request waits for others
+        """
+        self.encode_batch = encode_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = queue.Queue()
+        self.requests = 0
+        self.texts = 0
+        self.batches = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, texts: List[str], truncate: bool = True) -> np.ndarray:
+        """queue the texts and wait for their embeddings"""
+        future = Future()
+        self.queue.put((texts, truncate, future))
+        return future.result()
+
+    def _collect(self):
+        batch = [self.queue.get()]
+        n_texts = len(batch[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while n_texts < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(item)
+            n_texts += len(item[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            # queries (truncate=False) and documents are encoded in separate calls
+            for truncate in (True, False):
+                items = [item for item in batch if item[1] == truncate]
+                if not items:
+                    continue
+                texts = [text for item in items for text in item[0]]
+                try:
+                    vectors = self.encode_batch(texts, truncate) if texts else None
+                except Exception as e:
+                    for _, _, future in items:
+                        future.set_exception(e)
+                    continue
+                self.requests += len(items)
+                self.texts += len(texts)
+                self.batches += 1
+                offset = 0
+                for item_texts, _, future in items:
+                    future.set_result(vectors[offset:offset + len(item_texts)] if item_texts else np.empty((0, 0), dtype=np.float32))
+                    offset += len(item_texts)
+
+    def stats(self) -> dict:
+        return {
+            'requests': self.requests,
+            'texts': self.texts,
+            'batches': self.batches,
+            'mean_batch_size': self.texts / self.batches if self.batches else 0.0
+        }
+
+
+class EmbeddingRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _send(self, status: int, body: bytes, content_type: str, headers: dict = None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, data: dict):
+        self._send(status, json.dumps(data).encode('utf-8'), 'application/json')
+
+    def do_GET(self):
+        if self.path != '/info':
+            self._send_json(404, {'error': f"unknown path: {self.path}"})
+            return
+        server = self.server
+        self._send_json(200, {
+            'model_name': server.processor.model_name,
+            'backend': server.processor.backend,
+            'max_tokens': server.processor.max_tokens,
+            **server.batcher.stats()
+        })
+
+    def do_POST(self):
+        if self.path != '/encode':
+            self._send_json(404, {'error': f"unknown path: {self.path}"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            texts = request['texts']
+            if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+                raise ValueError("'texts' must be a list of strings")
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        try:
+            vectors = self.server.batcher.submit(texts, bool(request.get('truncate', True)))
+        except Exception as e:
+            logger.exception("encoding failed")
+            self._send_json(500, {'error': str(e)})
+            return
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self._send(200, vectors.tobytes(), 'application/octet-stream', {'X-Rows': str(vectors.shape[0]), 'X-Dim': str(vectors.shape[1])})
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+class EmbeddingServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, processor: EmbeddingProcessor, max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        super().__init__(address, EmbeddingRequestHandler)
+        self.processor = processor
+        self.batcher = MicroBatcher(processor.encode_batch, max_batch_size, max_wait_ms)
+
+
+def normalize_service_url(url: str) -> str:
+    """accept 'port', 'host:port' or full URLs"""
+    url = url.strip()
+    if url.isdigit():
+        url = f"localhost:{url}"
+    if not url.startswith(('http://', 'https://')):
+        url = f"http://{url}"
+    return url.rstrip('/')
+
+
+class EmbeddingClient:
+    """embedder backed by an embedding service (same interface as EmbeddingProcessor, no local model)"""
+
+    def __init__(self, url: str, timeout: float = 300.0):
+        self.url = normalize_service_url(url)
+        parsed = urlparse(self.url)
+        self.host, self.port = parsed.hostname, parsed.port or 80
+        self.timeout = timeout
+        self.local = threading.local()
+        self.extractor = TextExtractor()
+
+        info = self.info()
+        self.model_name = info['model_name']
+        self.backend = info['backend']
+        self.max_tokens = info['max_tokens']
+
+    def _request(self, method: str, path: str, body: bytes = None):
+        # one keep-alive connection per thread, reopened once if the server closed it
+        for attempt in range(2):
+            connection = getattr(self.local, 'connection', None)
+            if connection is None:
+                connection = self.local.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                connection.request(method, path, body=body, headers={'Content-Type': 'application/json'} if body else {})
+                response = connection.getresponse()
+                return response, response.read()
+            except (http.client.HTTPException, ConnectionError):
+                connection.close()
+                self.local.connection = None
+                if attempt == 1:
+                    raise
+
+    def _check(self, response, data: bytes):
+        if response.status != 200:
+            try:
+                error = json.loads(data)['error']
+            except (ValueError, KeyError):
+                error = data[:200]
+            raise RuntimeError(f"embedding service {self.url}: {response.status} {error}")
+
+    def info(self) -> dict:
+        response, data = self._request('GET', '/info')
+        self._check(response, data)
+        return json.loads(data)
+
+    def encode_batch(self, texts: List[str], truncate: bool = True) -> np.ndarray:
+        """see EmbeddingProcessor.encode_batch (the token limit is applied by the service)"""
+        body = json.dumps({'texts': list(texts), 'truncate': truncate}).encode('utf-8')
+        response, data = self._request('POST', '/encode', body)
+        self._check(response, data)
+        rows, dim = int(response.getheader('X-Rows')), int(response.getheader('X-Dim'))
+        return np.frombuffer(data, dtype=np.float32).reshape(rows, dim)
+
+    def encode(self, text: str) -> np.ndarray:
+        return self.encode_batch([text])[0]
+
+    # same segment extraction as the local processor, the vectors come from encode_batch
+    encode_segments = EmbeddingProcessor.encode_segments
+
+
+def load_embedder(model_name: str, backend: str = 'torch', service_url: Optional[str] = None, allow_mismatch: bool = False):
+    """
+    the embedder of a worker.
+
+    Args:
+        service_url: embedding service address (default: the EMBEDDING_SERVICE_URL environment variable)
+        allow_mismatch: use a service serving another model or backend (with a warning) instead of raising ValueError
+
+    Returns:
+        EmbeddingClient if a service is configured, else a local EmbeddingProcessor
+    """
+    service_url = service_url or os.environ.get(SERVICE_URL_ENV)
+    if not service_url:
+        return EmbeddingProcessor(model_name=model_name, backend=backend)
+
+    client = EmbeddingClient(service_url)
+    if client.model_name != model_name or client.backend != backend:
+        # the vectors of another model do not match the store (wrong neighbours or a dimension mismatch later on)
+        message = f"embedding service {client.url} serves {client.model_name} ({client.backend}), requested {model_name} ({backend})"
+        if not allow_mismatch:
+            raise ValueError(message)
+        logger.warning(message)
+    return client
+
+
+def main():
+    parser = argparse.ArgumentParser(description='embedding service shared by the inference workers')
+    parser.add_argument('--model_name', type=str, default='Qodo/Qodo-Embed-1-1.5B', help='embedding model')
+    parser.add_argument('--backend', type=str, choices=['torch', 'onnx-int8'], default='torch', help='embedding backend')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='listen address')
+    parser.add_argument('--port', type=int, default=8765, help='listen port')
+    parser.add_argument('--max_batch_size', type=int, default=32, help='texts encoded in one model call')
+    parser.add_argument('--max_wait_ms', type=float, default=5.0, help='time a request waits for others to batch with')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    processor = EmbeddingProcessor(model_name=args.model_name, backend=args.backend)
+    server = EmbeddingServer((args.host, args.port), processor, args.max_batch_size, args.max_wait_ms)
+    logger.info(f"serving {args.model_name} ({args.backend}) on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logger.info(f"batching: {server.batcher.stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""
+Lexical (BM25) index over the store texts for hybrid and embedder-free retrieval.
+
+The texts of the store entries (the HQ slow codes of hq_snippet, the analyses of
+distilled_deepseek) are tokenized into
+- identifiers, keywords and numbers (shared variables, STL calls, types)
+- token bigrams over all tokens including operators ('for (', 'cin >>', ') {'),
+  which capture loop and I/O structure
+and indexed as postings with precomputed BM25 weights. A search sums the weights of
+the query terms, so it needs no query embedding.
+
+The index is saved next to the store and rebuilt when the store version changes:
+
+    lexical_index.npz   terms, postings (rows, BM25 weights per term), entry id per row, row range per mode
+"""
+import os
+import re
+import json
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import sys
+sys.path.append('.')
+from detection_module_LLM_based.vector_matrix import parallel_top_k, row_ranges
+
+LEXICAL_INDEX_FILE = 'lexical_index.npz'
+
+TOKEN_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+(?:\.\d+)?|::|->|<<|>>|\+\+|--|[<>=!+\-*/%&|]=|&&|\|\||[-+*/%<>=!&|^~?:;,.(){}\[\]]")
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower()) if text else []
+
+
+def extract_terms(text: str) -> List[str]:
+    """word tokens and token bigrams of a text"""
+    tokens = tokenize(text)
+    words = [t for t in tokens if t[0].isalnum() or t[0] == '_']
+    return words + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+
+class LexicalIndex:
+    def __init__(self, terms: Dict[str, int], indptr: np.ndarray, rows: np.ndarray, weights: np.ndarray,
+                 row_ids: np.ndarray, mode_ranges: Dict[str, Tuple[int, int]], version: str = None):
+        """
+        Args:
+            terms: term -> term id
+            indptr, rows, weights: postings of term id t are rows[indptr[t]:indptr[t + 1]] with their BM25 weights
+            row_ids: entry id of every row
+            mode_ranges: mode -> (start row, end row)
+            version: the store version the index was built from
+        """
+        self.terms = terms
+        self.indptr = indptr
+        self.rows = rows
+        self.weights = weights
+        self.row_ids = row_ids
+        self.mode_ranges = mode_ranges
+        self.version = version
+
+    @classmethod
+    def build(cls, metadata: List[Dict], version: str = None, k1: float = 1.2, b: float = 0.75) -> 'LexicalIndex':
+        """index the entry texts, rows grouped by mode"""
+        by_mode: Dict[str, List[Dict]] = {}
+        for meta in metadata:
+            by_mode.setdefault(meta['mode'], []).append(meta)
+
+        row_ids, mode_ranges, counts = [], {}, []
+        for mode in sorted(by_mode):
+            mode_ranges[mode] = (len(row_ids), len(row_ids) + len(by_mode[mode]))
+            for meta in by_mode[mode]:
+                row_ids.append(meta['entry_id'])
+                text = ' '.join(meta['text']) if isinstance(meta['text'], list) else meta['text']
+                counts.append(Counter(extract_terms(text)))
+
+        terms: Dict[str, int] = {}
+        term_ids, rows, tfs = [], [], []
+        for row, count in enumerate(counts):
+            for term, tf in count.items():
+                term_ids.append(terms.setdefault(term, len(terms)))
+                rows.append(row)
+                tfs.append(tf)
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        rows = np.asarray(rows, dtype=np.int32)
+        tfs = np.asarray(tfs, dtype=np.float32)
+
+        # BM25 weight of every (term, row) posting
+        n_rows = len(counts)
+        doc_len = np.array([sum(c.values()) for c in counts], dtype=np.float32)
+        avg_len = doc_len.mean() if n_rows else 1.0
+        df = np.bincount(term_ids, minlength=len(terms))
+        idf = np.log1p((n_rows - df + 0.5) / (df + 0.5)).astype(np.float32)
+        norm = k1 * (1 - b + b * doc_len[rows] / avg_len)
+        weights = idf[term_ids] * tfs * (k1 + 1) / (tfs + norm)
+
+        order = np.argsort(term_ids, kind='stable')
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(df, out=indptr[1:])
+        return cls(terms, indptr, rows[order], weights[order].astype(np.float32), np.asarray(row_ids, dtype=np.int64), mode_ranges, version)
+
+    def save(self, storage_path: str):
+        path = os.path.join(storage_path, LEXICAL_INDEX_FILE)
+        header = {'version': self.version, 'mode_ranges': self.mode_ranges}
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, header=np.array(json.dumps(header)), terms=np.array(list(self.terms), dtype=str),
+                     indptr=self.indptr, rows=self.rows, weights=self.weights, row_ids=self.row_ids)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, storage_path: str, version: str = None) -> Optional['LexicalIndex']:
+        """None if the index is missing or was built from another store version"""
+        path = os.path.join(storage_path, LEXICAL_INDEX_FILE)
+        if not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle=False) as data:
+            header = json.loads(str(data['header']))
+            if version is not None and header['version'] != version:
+                return None
+            terms = {term: i for i, term in enumerate(data['terms'].tolist())}
+            mode_ranges = {mode: tuple(r) for mode, r in header['mode_ranges'].items()}
+            return cls(terms, data['indptr'], data['rows'], data['weights'], data['row_ids'], mode_ranges, header['version'])
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every row (each distinct query term counts once)"""
+        scores = np.zeros(len(self.row_ids), dtype=np.float32)
+        for term in set(extract_terms(query)):
+            term_id = self.terms.get(term)
+            if term_id is not None:
+                start, end = self.indptr[term_id], self.indptr[term_id + 1]
+                # the rows of one term are distinct, so fancy-index accumulation is exact
+                scores[self.rows[start:end]] += self.weights[start:end]
+        return scores
+
+    def top_k(self, query: str, k: int, mode_filter=None) -> List[Tuple[float, int]]:
+        """
+        Returns:
+            List[Tuple[float, int]]: (BM25 score, row) pairs with a positive score, best first
+        """
+        scores = self.scores(query)
+        ranges = row_ranges(self.mode_ranges, len(self.row_ids), mode_filter)
+        top = parallel_top_k(lambda start, end: scores[start:end], ranges, k, n_workers=1)
+        return [(score, row) for score, row in top if score > 0]
+
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int, rrf_k: int = 60) -> List[Tuple[float, int]]:
+    """
+    fuse ranked lists of entry ids: score = sum over the lists of 1 / (rrf_k + rank).
+
+    Returns:
+        List[Tuple[float, int]]: (fused score, entry id) pairs, best first
+    """
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, entry_id in enumerate(ranking, start=1):
+            fused[entry_id] = fused.get(entry_id, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(((score, entry_id) for entry_id, score in fused.items()), key=lambda x: -x[0])[:k]
@@ -4,6 +4,8 @@ from ollama import Client
 import json
 import os
 import argparse
+import threading
+from queue import Queue
 from datetime import datetime
 
 # analysis_prompt = """Identify optimization points in this slow code and explain how the transformation to the fast code improves runtime. Provide the output in the following JSON format:
@@ -51,20 +53,127 @@ def load_template(templates_path, template_name):
     with open(template_path, 'r') as file:
         return json.load(file)['prompt_no_input']
 
-def analyze_code(client, model, data, template, output_dir, temperature=0.0):
-    for idx, item in enumerate(data):
-        code_id = item['src_id']
-        
-        # check if the analysis result file already exists
-        output_file = os.path.join(output_dir, f"analysis_{idx+1}.json")
-        if os.path.exists(output_file):
-            print(f"file {output_file} already exists. skipping.")
-            continue
-            
+class WorkQueue:
+    """
+    Durable work queue for the distillation items.
+
+    Completed and failed items are appended to a JSONL journal in the output directory,
+    so an interrupted run resumes with only the unfinished items. Items whose analysis
+    file already exists (e.g. from the previous sequential runner) are treated as done.
+    """
+
+    def __init__(self, output_dir, n_items, journal_name='distill_queue.jsonl'):
+        self.output_dir = output_dir
+        self.journal_path = os.path.join(output_dir, journal_name)
+        self.lock = threading.Lock()
+        self.attempts = {}
+
+        done = set()
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # torn last line of an interrupted run
+                    if event['status'] == 'done':
+                        done.add(event['idx'])
+        for idx in range(n_items):
+            if os.path.exists(output_path(output_dir, idx)):
+                done.add(idx)
+
+        self.pending = [idx for idx in range(n_items) if idx not in done]
+        self.n_done = len(done)
+
+    def _append(self, event):
+        with self.lock:
+            with open(self.journal_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(event) + '\n')
+
+    def mark_done(self, idx, host, elapsed_time):
+        self._append({'idx': idx, 'status': 'done', 'host': host, 'elapsed_time': elapsed_time, 'time': time.time()})
+
+    def mark_failed(self, idx, host, error):
+        self._append({'idx': idx, 'status': 'failed', 'host': host, 'error': error, 'time': time.time()})
+
+
+class ProgressReporter:
+    """thread-safe throughput / ETA reporting"""
+
+    def __init__(self, total, already_done, report_every=10):
+        self.total = total
+        self.done = already_done
+        self.completed_this_run = 0
+        self.failed = 0
+        self.report_every = report_every
+        self.start_time = time.time()
+        self.lock = threading.Lock()
+
+    def update(self, success=True):
+        with self.lock:
+            if success:
+                self.done += 1
+                self.completed_this_run += 1
+            else:
+                self.failed += 1
+            if success and self.completed_this_run % self.report_every == 0:
+                self.report()
+
+    def report(self):
+        elapsed = time.time() - self.start_time
+        throughput = self.completed_this_run / elapsed if elapsed > 0 else 0.0
+        remaining = self.total - self.done
+        eta = remaining / throughput if throughput > 0 else float('inf')
+        print(f"[{self.done}/{self.total}] {throughput * 60:.1f} items/min, "
+              f"failed attempts: {self.failed}, ETA: {eta / 60:.1f} min")
+
+
+def output_path(output_dir, idx):
+    # analysis files are 1-based (analysis_1.json, ...), matching load_analysis_data / get_code_pair
+    return os.path.join(output_dir, f"analysis_{idx+1}.json")
+
+
+def save_result(output_file, result):
+    # write atomically so that a killed run never leaves a truncated analysis file
+    tmp_file = output_file + '.tmp'
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_file, output_file)
+
+
+def analyze_code(clients, model, data, template, output_dir, temperature=0.0, max_in_flight=2, max_retries=3, backoff=5.0):
+    """
+    distill the rationales of all items with a bounded pool of in-flight requests per host.
+
+    Args:
+        clients: list of (host, Client) pairs; each host gets max_in_flight concurrent requests
+        max_retries: number of retries per item (with exponential backoff) before giving up in this run
+        backoff: base backoff in seconds (doubled at every retry)
+    """
+    queue = WorkQueue(output_dir, len(data))
+    progress = ProgressReporter(len(data), queue.n_done)
+    print(f"{queue.n_done}/{len(data)} items already distilled, {len(queue.pending)} pending")
+
+    # work items are (idx, attempt); retries go back to the shared queue so that another host can pick them up
+    work = Queue()
+    for idx in queue.pending:
+        work.put((idx, 0))
+    remaining = [len(queue.pending)]
+    remaining_lock = threading.Lock()
+
+    def finish_item():
+        with remaining_lock:
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                for _ in range(len(clients) * max_in_flight):
+                    work.put(None)
+
+    def process(host, client, idx):
+        item = data[idx]
         args = {'slow_code': item['src_code'], 'fast_code': item['tgt_code']}
         prompt = template.format(**args)
 
-        start_time = time.time()  
+        start_time = time.time()
         response = call_LLM(client, model, prompt, temperature)
         elapsed_time = time.time() - start_time
 
@@ -75,13 +184,50 @@ def analyze_code(client, model, data, template, output_dir, temperature=0.0):
             "elapsed_time": elapsed_time,
             "model": model
         }
-        
-        # save the result as a separate JSON file for each prompt
-        with open(output_file, "w", encoding="utf-8") as f:
-            json.dump(result, f, ensure_ascii=False, indent=4)
-        
-        print(f"{response.message.content}")
-        print(f"Time taken: {elapsed_time} seconds")
+        save_result(output_path(output_dir, idx), result)
+        queue.mark_done(idx, host, elapsed_time)
+
+    def worker(host, client):
+        while True:
+            task = work.get()
+            if task is None:
+                return
+            idx, attempt = task
+            # the item counts as finished once it is done or given up, whatever raised,
+            # so the remaining count always reaches 0 and the workers are released
+            finished = True
+            try:
+                process(host, client, idx)
+                progress.update(success=True)
+            except Exception as e:
+                try:
+                    queue.mark_failed(idx, host, str(e))
+                except Exception as journal_error:
+                    print(f"could not journal the failure of item {idx+1}: {journal_error}")
+                progress.update(success=False)
+                if attempt < max_retries:
+                    # re-queue after the backoff without holding this host's in-flight slot
+                    threading.Timer(backoff * (2 ** attempt), work.put, args=((idx, attempt + 1),)).start()
+                    finished = False
+                else:
+                    print(f"giving up on item {idx+1} after {attempt+1} attempts: {e}")
+            finally:
+                if finished:
+                    finish_item()
+
+    if not queue.pending:
+        return
+
+    threads = []
+    for host, client in clients:
+        for _ in range(max_in_flight):
+            thread = threading.Thread(target=worker, args=(host, client), daemon=True)
+            thread.start()
+            threads.append(thread)
+    for thread in threads:
+        thread.join()
+
+    progress.report()
 
 def main():
     parser = argparse.ArgumentParser(description='code analysis execution tool')
@@ -92,6 +238,10 @@ def main():
     parser.add_argument('--output_dir', default='BRIDGE_data/distilled_rationales', help='directory to save the results')
     parser.add_argument('--temperature', type=float, default=0.0, help='LLM temperature')
     parser.add_argument('--host', default='http://localhost:11434', help='Ollama server address')
+    parser.add_argument('--hosts', default=None, help='comma-separated Ollama server addresses (overrides --host)')
+    parser.add_argument('--max_in_flight', type=int, default=2, help='maximum number of concurrent requests per host')
+    parser.add_argument('--max_retries', type=int, default=3, help='maximum number of retries per item')
+    parser.add_argument('--backoff', type=float, default=5.0, help='base retry backoff in seconds')
     
     args = parser.parse_args()
     
@@ -99,17 +249,19 @@ def main():
     if not os.path.exists(args.output_dir):
         os.makedirs(args.output_dir)
 
-    # initialize the Ollama client
-    client = Client(host=args.host)
+    # initialize the Ollama clients
+    hosts = args.hosts.split(',') if args.hosts else [args.host]
+    clients = [(host, Client(host=host)) for host in hosts]
     
     # load the template
     template = load_template(args.templates_path, args.template_name)
     
     # load the data
-    data = get_data(args.file_path)
+    data = get_data(args.input_file_path)
     
     # run the code analysis
-    analyze_code(client, args.model, data, template, args.output_dir, args.temperature)
+    analyze_code(clients, args.model, data, template, args.output_dir, args.temperature,
+                 args.max_in_flight, args.max_retries, args.backoff)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,339 @@
+"""
+MinHash-LSH index of near-duplicate source codes.
+
+Codes are normalized (comments and preprocessor lines removed, lowercased tokens)
+and split into shingles of `shingle_size` consecutive tokens. A MinHash signature
+of `num_perm` hash minima estimates the Jaccard similarity of two shingle sets
+(fraction of equal minima). LSH splits the signatures into `bands` bands; codes that
+agree on a whole band share a bucket, so a query only compares against the codes in
+its buckets (with 16 bands of 8 rows, pairs above ~0.7 Jaccard are found with high
+probability).
+
+The index of the HQ slow codes is built once from the training data and saved next
+to it (<train>.minhash.npz, keyed by the line index, which is the analysis id of the
+hq_snippet store). It is used
+- by generate_retrieval_prompt to drop retrieved examples that are near-duplicates of
+  the query (train/test leakage) or of an example already in the prompt
+- for a bulk leakage report across whole datasets (this script)
+
+Usage:
+    python detection_module_LLM_based/near_duplicates.py \
+        --reference ./BRIDGE_data/HQ_data.jsonl \
+        --datasets ./BRIDGE_data/PIE_test.jsonl,./BRIDGE_data/codeforce_test.jsonl \
+        --threshold 0.8 --output leakage_report.json
+"""
+import os
+import json
+import time
+import zlib
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import sys
+sys.path.append('.')
+from detection_module_LLM_based.prompt import remove_c_cpp_comments
+from detection_module_LLM_based.lexical_index import tokenize
+
+logger = logging.getLogger(__name__)
+
+MINHASH_VERSION = 1
+# a prime above 2^32: (a * x + b) mod p with a, x < 2^32 does not overflow uint64
+MERSENNE_PRIME = np.uint64((1 << 32) + 15)
+MAX_HASH = np.uint32(0xFFFFFFFF)
+
+
+def default_index_path(train_data_path):
+    return os.path.splitext(train_data_path)[0] + '.minhash.npz'
+
+
+def normalize_code(code: str) -> List[str]:
+    """tokens of the code without comments and preprocessor lines (#include, #define)"""
+    code = remove_c_cpp_comments(code or '')
+    code = '\n'.join(line for line in code.splitlines() if not line.lstrip().startswith('#'))
+    return tokenize(code)
+
+
+def code_shingles(code: str, shingle_size: int = 5) -> np.ndarray:
+    """distinct crc32 hashes of the token shingles"""
+    tokens = normalize_code(code)
+    if not tokens:
+        return np.zeros(0, dtype=np.uint64)
+    n = max(len(tokens) - shingle_size + 1, 1)
+    shingles = {zlib.crc32(' '.join(tokens[i:i + shingle_size]).encode('utf-8')) for i in range(n)}
+    return np.fromiter(shingles, dtype=np.uint64, count=len(shingles))
+
+
+def hash_parameters(num_perm: int, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 1 << 32, num_perm, dtype=np.uint64)
+    b = rng.integers(0, 1 << 32, num_perm, dtype=np.uint64)
+    return a, b
+
+
+def minhash_signature(shingles: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """signature of a shingle set (all MAX_HASH for an empty code)"""
+    if len(shingles) == 0:
+        return np.full(len(a), MAX_HASH, dtype=np.uint32)
+    hashes = (a[:, None] * shingles[None, :] + b[:, None]) % MERSENNE_PRIME
+    return hashes.min(axis=1).astype(np.uint32)
+
+
+def _signature_chunk(codes, num_perm, seed, shingle_size):
+    a, b = hash_parameters(num_perm, seed)
+    return np.stack([minhash_signature(code_shingles(code, shingle_size), a, b) for code in codes]) if codes else np.zeros((0, num_perm), dtype=np.uint32)
+
+
+def compute_signatures(codes: List[str], num_perm: int = 128, seed: int = 0, shingle_size: int = 5, n_workers: int = 1, chunk_size: int = 512) -> np.ndarray:
+    """signatures of many codes [len(codes), num_perm], in worker processes for n_workers > 1"""
+    if n_workers <= 1 or len(codes) <= chunk_size:
+        return _signature_chunk(codes, num_perm, seed, shingle_size)
+    chunks = [codes[i:i + chunk_size] for i in range(0, len(codes), chunk_size)]
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        parts = executor.map(_signature_chunk, chunks, [num_perm] * len(chunks), [seed] * len(chunks), [shingle_size] * len(chunks))
+        return np.concatenate(list(parts))
+
+
+class NearDuplicateIndex:
+    def __init__(self, num_perm: int = 128, bands: int = 16, shingle_size: int = 5, threshold: float = 0.8, seed: int = 0):
+        """
+        Args:
+            num_perm: number of hash functions of a signature
+            bands: LSH bands (num_perm / bands rows each)
+            shingle_size: tokens per shingle
+            threshold: estimated Jaccard similarity from which two codes are near-duplicates
+        """
+        if num_perm % bands != 0:
+            raise ValueError(f"num_perm ({num_perm}) must be divisible by bands ({bands})")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.threshold = threshold
+        self.seed = seed
+        self.a, self.b = hash_parameters(num_perm, seed)
+
+        self.keys: List[str] = []
+        self.key_rows: Dict[str, int] = {}
+        self.signatures = np.zeros((0, num_perm), dtype=np.uint32)
+        self.buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(bands)]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def signature(self, code: str) -> np.ndarray:
+        return minhash_signature(code_shingles(code, self.shingle_size), self.a, self.b)
+
+    def compute_signatures(self, codes: List[str], n_workers: int = 1) -> np.ndarray:
+        return compute_signatures(codes, self.num_perm, self.seed, self.shingle_size, n_workers)
+
+    def _band_keys(self, signature: np.ndarray):
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def add_signatures(self, keys: List[str], signatures: np.ndarray):
+        start = len(self.keys)
+        for offset, (key, signature) in enumerate(zip(keys, signatures)):
+            self.keys.append(key)
+            self.key_rows[key] = start + offset
+            # empty codes are kept for signature_of but never bucketed
+            if signature[0] == MAX_HASH and (signature == MAX_HASH).all():
+                continue
+            for band, band_key in enumerate(self._band_keys(signature)):
+                self.buckets[band].setdefault(band_key, []).append(start + offset)
+        self.signatures = np.concatenate([self.signatures, np.asarray(signatures, dtype=np.uint32).reshape(-1, self.num_perm)])
+
+    def add(self, keys: List[str], codes: List[str], n_workers: int = 1):
+        self.add_signatures(keys, self.compute_signatures(codes, n_workers))
+
+    def signature_of(self, key: str) -> Optional[np.ndarray]:
+        row = self.key_rows.get(key)
+        return None if row is None else self.signatures[row]
+
+    @staticmethod
+    def similarity(signature_a: np.ndarray, signature_b: np.ndarray) -> float:
+        """estimated Jaccard similarity of the shingle sets"""
+        return float(np.mean(signature_a == signature_b))
+
+    def query_signature(self, signature: np.ndarray, threshold: float = None) -> List[Tuple[str, float]]:
+        """
+        Returns:
+            List[Tuple[str, float]]: (key, estimated Jaccard similarity) of the indexed near-duplicates, most similar first
+        """
+        threshold = self.threshold if threshold is None else threshold
+        if (signature == MAX_HASH).all():
+            return []
+        candidates = set()
+        for band, band_key in enumerate(self._band_keys(signature)):
+            candidates.update(self.buckets[band].get(band_key, ()))
+        if not candidates:
+            return []
+        rows = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        similarities = (self.signatures[rows] == signature).mean(axis=1)
+        matches = [(self.keys[row], float(sim)) for row, sim in zip(rows, similarities) if sim >= threshold]
+        return sorted(matches, key=lambda x: -x[1])
+
+    def query(self, code: str, threshold: float = None) -> List[Tuple[str, float]]:
+        return self.query_signature(self.signature(code), threshold)
+
+    def duplicate_pairs(self, threshold: float = None) -> List[Tuple[str, str, float]]:
+        """all near-duplicate pairs within the index (candidates from the shared buckets)"""
+        threshold = self.threshold if threshold is None else threshold
+        candidates = set()
+        for buckets in self.buckets:
+            for rows in buckets.values():
+                for i in range(len(rows)):
+                    for j in range(i + 1, len(rows)):
+                        candidates.add((rows[i], rows[j]))
+        pairs = []
+        for i, j in candidates:
+            sim = self.similarity(self.signatures[i], self.signatures[j])
+            if sim >= threshold:
+                pairs.append((self.keys[i], self.keys[j], sim))
+        return sorted(pairs, key=lambda x: -x[2])
+
+    def save(self, path: str, source: dict = None):
+        header = {
+            'version': MINHASH_VERSION, 'num_perm': self.num_perm, 'bands': self.bands, 'shingle_size': self.shingle_size,
+            'seed': self.seed, 'keys': self.keys, 'source': source
+        }
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, header=np.array(json.dumps(header)), signatures=self.signatures)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, threshold: float = 0.8) -> Tuple['NearDuplicateIndex', dict]:
+        """
+        Returns:
+            tuple: (index, source signature recorded by save)
+        """
+        with np.load(path, allow_pickle=False) as data:
+            header = json.loads(str(data['header']))
+            signatures = data['signatures']
+        if header['version'] != MINHASH_VERSION:
+            raise ValueError(f"unsupported MinHash index version: {header['version']}")
+        index = cls(header['num_perm'], header['bands'], header['shingle_size'], threshold, header['seed'])
+        index.add_signatures(header['keys'], signatures)
+        return index, header['source']
+
+
+def source_signature(data_path):
+    stat = os.stat(data_path)
+    return {'version': MINHASH_VERSION, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def read_sources(data_path: str, code_field: str = 'src_code') -> Tuple[List[str], List[str]]:
+    """
+    Returns:
+        tuple: (keys, codes); the key is the src_id if present, else the line index
+    """
+    keys, codes = [], []
+    with open(data_path, 'r', encoding='utf-8') as f:
+        for idx, line in enumerate(line for line in f if line.strip()):
+            d = json.loads(line)
+            keys.append(str(d.get('src_id', idx)))
+            codes.append(d[code_field])
+    return keys, codes
+
+
+def load_near_duplicate_index(train_data_path: str, index_path: str = None, threshold: float = 0.8, n_workers: int = 1) -> NearDuplicateIndex:
+    """
+    the index of the training slow codes keyed by line index, (re)built if it is missing or older than the training data.
+    An existing index is used as is when the training data itself is not available.
+    """
+    index_path = index_path or default_index_path(train_data_path)
+    if os.path.exists(index_path):
+        index, source = NearDuplicateIndex.load(index_path, threshold)
+        if not os.path.exists(train_data_path) or source == source_signature(train_data_path):
+            return index
+        logger.info(f"MinHash index {index_path} is outdated, rebuilding")
+
+    start_time = time.time()
+    with open(train_data_path, 'r', encoding='utf-8') as f:
+        codes = [json.loads(line)['src_code'] for line in f if line.strip()]
+    index = NearDuplicateIndex(threshold=threshold)
+    index.add([str(i) for i in range(len(codes))], codes, n_workers)
+    index.save(index_path, source_signature(train_data_path))
+    logger.info(f"built the MinHash index {index_path} ({len(codes)} codes) in {time.time() - start_time:.1f}s")
+    return index
+
+
+def leakage_report(reference: NearDuplicateIndex, datasets: Dict[str, Tuple[List[str], List[str]]], n_workers: int = 1) -> dict:
+    """
+    near-duplicates of every dataset in the reference (train/test leakage), within the dataset, and across the datasets.
+
+    Args:
+        reference: index of the reference (training) codes
+        datasets: name -> (keys, codes)
+
+    Returns:
+        dict: {'datasets': {name: summary and matches}, 'cross': {'a|b': pairs}}
+    """
+    report = {'threshold': reference.threshold, 'datasets': {}, 'cross': {}}
+    indexes = {}
+    for name, (keys, codes) in datasets.items():
+        start_time = time.time()
+        signatures = reference.compute_signatures(codes, n_workers)
+        leaked = {}
+        for key, signature in zip(keys, signatures):
+            matches = reference.query_signature(signature)
+            if matches:
+                leaked[key] = matches
+
+        index = NearDuplicateIndex(reference.num_perm, reference.bands, reference.shingle_size, reference.threshold, reference.seed)
+        index.add_signatures(keys, signatures)
+        indexes[name] = index
+        internal = index.duplicate_pairs()
+        report['datasets'][name] = {
+            'items': len(keys),
+            'leaked_items': len(leaked),
+            'leaked_ratio': len(leaked) / len(keys) if keys else 0.0,
+            'duplicate_pairs': len(internal),
+            'seconds': time.time() - start_time,
+            'leaked': leaked,
+            'duplicates': internal
+        }
+
+    names = list(datasets)
+    for i, name_a in enumerate(names):
+        for name_b in names[i + 1:]:
+            pairs = []
+            for key, signature in zip(indexes[name_b].keys, indexes[name_b].signatures):
+                pairs.extend((match, key, sim) for match, sim in indexes[name_a].query_signature(signature))
+            report['cross'][f"{name_a}|{name_b}"] = pairs
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='near-duplicate / leakage report of test sets against the training codes')
+    parser.add_argument('--reference', type=str, default='./BRIDGE_data/HQ_data.jsonl', help='training data (slow codes are indexed)')
+    parser.add_argument('--datasets', type=str, required=True, help='comma-separated test data files')
+    parser.add_argument('--threshold', type=float, default=0.8, help='estimated Jaccard similarity of near-duplicates')
+    parser.add_argument('--n_workers', type=int, default=os.cpu_count() or 1, help='processes computing the signatures')
+    parser.add_argument('--output', type=str, default=None, help='JSON file for the full report (matches per item)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    start_time = time.time()
+    reference = load_near_duplicate_index(args.reference, threshold=args.threshold, n_workers=args.n_workers)
+    datasets = {os.path.basename(path): read_sources(path) for path in args.datasets.split(',')}
+    report = leakage_report(reference, datasets, args.n_workers)
+
+    print(f"reference: {args.reference} ({len(reference)} codes), threshold {args.threshold}")
+    print(f"{'dataset':<30}{'items':>8}{'leaked':>9}{'ratio':>8}{'dup pairs':>11}{'time(s)':>9}")
+    for name, summary in report['datasets'].items():
+        print(f"{name:<30}{summary['items']:>8}{summary['leaked_items']:>9}{summary['leaked_ratio']:>8.1%}{summary['duplicate_pairs']:>11}{summary['seconds']:>9.1f}")
+    for names, pairs in report['cross'].items():
+        print(f"cross {names}: {len(pairs)} near-duplicate pairs")
+    print(f"total {time.time() - start_time:.1f}s")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -17,6 +17,7 @@ import random
 sys.path.append('.')
 from detection_module_LLM_based.embedding_processor import EmbeddingProcessor, EmbeddingMode 
 from detection_module_LLM_based.vector_store import DiskBackedVectorStore
+from detection_module_LLM_based.embedding_service import load_embedder
 
 
 import re
@@ -55,7 +56,11 @@ def load_distilled_data(rag_store_path):
     data_path = os.path.join(rag_store_path, 'metadata.json')
     with open(data_path, 'r', encoding='utf-8') as file:
         data = json.load(file)
+    return distilled_data_from_metadata(data)
 
+
+def distilled_data_from_metadata(data):
+    """group the store metadata entries by analysis id and mode (an already loaded store can be reused)"""
     distill_data = {}
     for d in data:
         analysis_id = d['analysis_id'].split('.')[0]
@@ -69,16 +74,52 @@ def load_distilled_data(rag_store_path):
     return distill_data
 
 
-def get_code_pair(r, code_pair):
+def code_pair_index(r):
+    """index of the training code pair of a retrieved entry"""
     if not isinstance(r['analysis_id'], int) and '.json' in r['analysis_id'] :
-        analysis_id = int(r['analysis_id'].split('.')[0]) - 1    # 1-based
-    else:
-        analysis_id = int(r['analysis_id'])
+        return int(r['analysis_id'].split('.')[0]) - 1    # 1-based
+    return int(r['analysis_id'])
+
 
-    slow_code = code_pair[analysis_id][0]
-    fast_code = code_pair[analysis_id][1]
+def get_code_pair(r, code_pair):
+    slow_code, fast_code = code_pair[code_pair_index(r)]
     return slow_code, fast_code
 
+
+def drop_near_duplicates(retrieved, near_duplicates, query_code=None, k=None, code_pair=None):
+    """
+    keep the retrieved entries whose slow code is neither a near-duplicate of the query code
+    (train/test leakage) nor of an entry kept before it.
+
+    Args:
+        near_duplicates: NearDuplicateIndex of the training slow codes (near_duplicates.py), keyed by code pair index
+        k: maximum number of entries kept
+        code_pair: used for the signature of codes missing from the index
+
+    Returns:
+        list: the kept entries, in retrieval order
+    """
+    threshold = near_duplicates.threshold
+    query_signature = near_duplicates.signature(query_code) if query_code else None
+    kept, kept_signatures = [], []
+    for r in retrieved:
+        signature = near_duplicates.signature_of(str(code_pair_index(r)))
+        if signature is None:
+            if code_pair is None:
+                kept.append(r)
+                continue
+            signature = near_duplicates.signature(get_code_pair(r, code_pair)[0])
+        if query_signature is not None and near_duplicates.similarity(signature, query_signature) >= threshold:
+            continue
+        if any(near_duplicates.similarity(signature, s) >= threshold for s in kept_signatures):
+            continue
+        kept.append(r)
+        kept_signatures.append(signature)
+        if k is not None and len(kept) == k:
+            break
+    return kept[:k]
+
+
 def generate_retrieval_prompt(
     query: str,
     query_type: Literal['code', 'NL'],
@@ -89,7 +130,9 @@ def generate_retrieval_prompt(
     code_pair: dict = None,
     distill_data: dict = None,
     retrieve_additional_info: bool = False,
-    given_code_analysis: str = None
+    given_code_analysis: str = None,
+    near_duplicates=None,  # instance of NearDuplicateIndex
+    query_fingerprint=None
 ) -> str:
     """
     Generate prompt for optimization using retrieved bullet/code examples.
@@ -101,11 +144,15 @@ def generate_retrieval_prompt(
         fewshot_k (int): Number of examples to retrieve (default: 3)
         enable_modes (List[EmbeddingMode]): List of modes to use or None
         code_pair (dict): 
+        near_duplicates (NearDuplicateIndex): drop examples that are near-duplicates of the query code or of each other
+            (more candidates are retrieved to keep fewshot_k examples)
+        query_fingerprint (np.ndarray): bottleneck profile of the query code for the store's profile_mode (code_fingerprint.py)
 
     Returns:
         str: Formatted prompt (ready to fill in {retrieved_optimizations})
     """
 
+    query_code = query
     if query_type == 'NL':
         query = given_code_analysis
         
@@ -117,11 +164,19 @@ def generate_retrieval_prompt(
         query=query,
         embedder=embedder,
         mode_filter=enable_modes,
-        retreived_k=fewshot_k,
-        n_workers=4
+        retreived_k=fewshot_k if near_duplicates is None else 3 * fewshot_k,
+        n_workers=4,
+        query_fingerprint=query_fingerprint
     )                   # text, similarity, entry_id, mode, analysis_id, index
 
+    if near_duplicates is not None:
+        retrieved = drop_near_duplicates(retrieved, near_duplicates, query_code, fewshot_k, code_pair)
 
+    return format_retrieved_examples(retrieved, query_type, code_pair, distill_data, retrieve_additional_info)
+
+
+def format_retrieved_examples(retrieved, query_type, code_pair, distill_data=None, retrieve_additional_info=False) -> str:
+    """format the retrieved entries as slow-fast example code (and their analysis if requested)"""
     parts = []
     for idx, r in enumerate(retrieved):
         # Code pair
@@ -147,6 +202,46 @@ def generate_retrieval_prompt(
                 part = text
                 parts.append(part.strip())
     return '\n\n'.join(parts)
+
+
+def generate_diverse_retrieval_prompts(
+    query: str,
+    store,  # instance of DiskBackedVectorStore
+    embedder,  # instance of EmbeddingGenerator
+    n_sets: int,
+    fewshot_k: int = 2,
+    enable_modes: List[EmbeddingMode] = ['full'],
+    code_pair: dict = None,
+    distill_data: dict = None,
+    retrieve_additional_info: bool = False,
+    near_duplicates=None,  # instance of NearDuplicateIndex
+    query_fingerprint=None
+) -> List[str]:
+    """
+    Generate n_sets prompts with different retrieved examples for a code query (one search, see store.search_diverse).
+
+    Args:
+        query (str): The code to be optimized
+        n_sets (int): Number of prompts (e.g. the sample count of k_sample)
+        fewshot_k (int): Number of examples per prompt
+        near_duplicates (NearDuplicateIndex): drop examples that are near-duplicates of the query code or of each other
+            (the candidate pool is deduplicated before the sets are built, so every set keeps fewshot_k)
+        query_fingerprint (np.ndarray): bottleneck profile of the query code for the store's profile_mode (code_fingerprint.py)
+
+    Returns:
+        List[str]: Formatted prompts (ready to fill in {retrieved_optimizations})
+    """
+    result_sets = store.search_diverse(
+        query=query,
+        embedder=embedder,
+        mode_filter=enable_modes,
+        retreived_k=fewshot_k,
+        n_sets=n_sets,
+        query_fingerprint=query_fingerprint,
+        candidate_filter=(lambda pool: drop_near_duplicates(pool, near_duplicates, query, None, code_pair)) if near_duplicates is not None else None,
+        filter_key=f"dedup{near_duplicates.threshold:g}" if near_duplicates is not None else None
+    )
+    return [format_retrieved_examples(retrieved, 'code', code_pair, distill_data, retrieve_additional_info) for retrieved in result_sets]
     
     
 def generate_random_retrieval_prompt(
@@ -281,7 +376,7 @@ if __name__ == '__main__':
 
 
     store = DiskBackedVectorStore('./BRIDGE_data/rag_store/distilled_deepseek', model_name='Qodo/Qodo-Embed-1-1.5B')
-    embedder = EmbeddingProcessor(model_name='Qodo/Qodo-Embed-1-1.5B')
+    embedder = load_embedder('Qodo/Qodo-Embed-1-1.5B')
 
     code_pair = load_code_pair('./BRIDGE_data/HQ_data.jsonl')
 
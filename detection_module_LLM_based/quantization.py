@@ -0,0 +1,210 @@
+"""
+Compressed vector representations for the vector store.
+
+The float32 matrix of the store (vector_matrix.py, 1536 dims -> 6 KB per entry) can
+be searched through a compressed copy that is kept in RAM:
+
+    float16   2 bytes / dim                                       (2x smaller)
+    int8      1 byte / dim + one float32 scale per vector          (~4x smaller)
+    pq        product quantization, 1 byte per subspace            (e.g. 96 subspaces: 64x smaller)
+
+The compressed scores select a shortlist, which is rescored exactly with the float32
+rows read from the memory-mapped matrix.npy (only the shortlisted pages are touched),
+so the result ranking matches the float32 search unless a true top-k entry misses the
+shortlist. evaluate_recall measures how often that happens (recall@k vs float32).
+
+The compressed copy is saved as matrix_<kind>.npz next to the store and rebuilt when
+the store version changes.
+"""
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import sys
+sys.path.append('.')
+from detection_module_LLM_based.vector_matrix import VectorMatrix, normalize_rows, parallel_top_k, rescore_shortlist, row_ranges
+
+QUANTIZATION_KINDS = ['float16', 'int8', 'pq']
+
+
+def quantize_int8(matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """symmetric per-vector scalar quantization: row ~= codes * scale"""
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.round(matrix / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def train_pq(matrix: np.ndarray, n_subspaces: int, n_centroids: int = 256, n_iter: int = 15, sample_size: int = 20000, seed: int = 0) -> np.ndarray:
+    """
+    k-means codebooks of the subvectors.
+
+    Returns:
+        np.ndarray: centroids [n_subspaces, n_centroids, dim / n_subspaces]
+    """
+    n_rows, dim = matrix.shape
+    if dim % n_subspaces != 0:
+        raise ValueError(f"the dimension {dim} is not divisible by {n_subspaces} subspaces")
+    rng = np.random.default_rng(seed)
+    sample = np.asarray(matrix[np.sort(rng.choice(n_rows, min(sample_size, n_rows), replace=False))], dtype=np.float32)
+    n_centroids = min(n_centroids, len(sample))
+    sub_dim = dim // n_subspaces
+
+    centroids = np.empty((n_subspaces, n_centroids, sub_dim), dtype=np.float32)
+    for j in range(n_subspaces):
+        sub = sample[:, j * sub_dim:(j + 1) * sub_dim]
+        c = sub[rng.choice(len(sub), n_centroids, replace=False)].copy()
+        for _ in range(n_iter):
+            assign = _nearest(sub, c)
+            counts = np.bincount(assign, minlength=n_centroids)
+            sums = np.zeros_like(c)
+            np.add.at(sums, assign, sub)
+            filled = counts > 0
+            c[filled] = sums[filled] / counts[filled, None]
+            # empty clusters are re-seeded with random points
+            if not filled.all():
+                c[~filled] = sub[rng.choice(len(sub), int((~filled).sum()), replace=False)]
+        centroids[j] = c
+    return centroids
+
+
+def _nearest(sub: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    # argmin ||x - c||^2 = argmin (||c||^2 - 2 x.c)
+    distances = (centroids ** 2).sum(axis=1)[None, :] - 2 * sub @ centroids.T
+    return distances.argmin(axis=1)
+
+
+def encode_pq(matrix: np.ndarray, centroids: np.ndarray, block_rows: int = 65536) -> np.ndarray:
+    n_subspaces, n_centroids, sub_dim = centroids.shape
+    dtype = np.uint8 if n_centroids <= 256 else np.uint16
+    codes = np.empty((len(matrix), n_subspaces), dtype=dtype)
+    for start in range(0, len(matrix), block_rows):
+        block = np.asarray(matrix[start:start + block_rows], dtype=np.float32)
+        for j in range(n_subspaces):
+            codes[start:start + len(block), j] = _nearest(block[:, j * sub_dim:(j + 1) * sub_dim], centroids[j])
+    return codes
+
+
+class QuantizedMatrix:
+    def __init__(self, kind: str, arrays: Dict[str, np.ndarray], row_ids: np.ndarray, mode_ranges: Dict[str, Tuple[int, int]], version: str = None):
+        """
+        Args:
+            kind: 'float16', 'int8' or 'pq'
+            arrays: the compressed data ('codes', plus 'scales' for int8 and 'centroids' for pq)
+            row_ids, mode_ranges, version: same as the VectorMatrix it was built from
+        """
+        if kind not in QUANTIZATION_KINDS:
+            raise ValueError(f"unsupported quantization: {kind} (expected one of {QUANTIZATION_KINDS})")
+        self.kind = kind
+        self.arrays = arrays
+        self.row_ids = row_ids
+        self.mode_ranges = mode_ranges
+        self.version = version
+
+    @classmethod
+    def build(cls, vector_matrix: VectorMatrix, kind: str, n_subspaces: int = None) -> 'QuantizedMatrix':
+        matrix = vector_matrix.matrix
+        if kind == 'float16':
+            arrays = {'codes': np.asarray(matrix, dtype=np.float16)}
+        elif kind == 'int8':
+            codes, scales = quantize_int8(np.asarray(matrix, dtype=np.float32))
+            arrays = {'codes': codes, 'scales': scales}
+        elif kind == 'pq':
+            dim = matrix.shape[1]
+            # 16-dim subvectors by default (96 subspaces for 1536 dims)
+            n_subspaces = n_subspaces or max(1, dim // 16)
+            centroids = train_pq(matrix, n_subspaces)
+            arrays = {'codes': encode_pq(matrix, centroids), 'centroids': centroids}
+        else:
+            raise ValueError(f"unsupported quantization: {kind} (expected one of {QUANTIZATION_KINDS})")
+        return cls(kind, arrays, vector_matrix.row_ids, vector_matrix.mode_ranges, vector_matrix.version)
+
+    @staticmethod
+    def path(storage_path: str, kind: str) -> str:
+        return os.path.join(storage_path, f"matrix_{kind}.npz")
+
+    def save(self, storage_path: str):
+        path = self.path(storage_path, self.kind)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, version=np.array(self.version or ''), **self.arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, storage_path: str, kind: str, vector_matrix: VectorMatrix) -> Optional['QuantizedMatrix']:
+        """None if the file is missing or was built from another store version"""
+        path = cls.path(storage_path, kind)
+        if not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle=False) as data:
+            if str(data['version']) != (vector_matrix.version or ''):
+                return None
+            arrays = {name: data[name] for name in data.files if name != 'version'}
+        return cls(kind, arrays, vector_matrix.row_ids, vector_matrix.mode_ranges, vector_matrix.version)
+
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in self.arrays.values())
+
+    def _row_scorer(self, query: np.ndarray):
+        codes = self.arrays['codes']
+        if self.kind == 'float16':
+            # numpy has no BLAS kernel for float16, the block is converted to float32
+            return lambda start, end: codes[start:end].astype(np.float32) @ query
+        if self.kind == 'int8':
+            scales = self.arrays['scales']
+            return lambda start, end: (codes[start:end].astype(np.float32) @ query) * scales[start:end]
+        # pq: asymmetric distance computation with a per-query lookup table
+        centroids = self.arrays['centroids']
+        n_subspaces, _, sub_dim = centroids.shape
+        lut = np.einsum('mcd,md->mc', centroids, query.reshape(n_subspaces, sub_dim))
+        subspaces = np.arange(n_subspaces)
+        return lambda start, end: lut[subspaces, codes[start:end]].sum(axis=1)
+
+    def top_k(self, query_vec: np.ndarray, k: int, mode_filter=None, n_workers: int = None, rescore_matrix: np.ndarray = None, shortlist: int = None) -> List[Tuple[float, int]]:
+        """
+        Args:
+            rescore_matrix: the float32 matrix (memmap) used to rescore the shortlist exactly; None returns the compressed scores
+            shortlist: number of candidates rescored (default: max(10 k, 100))
+
+        Returns:
+            List[Tuple[float, int]]: (similarity, row) pairs, best first
+        """
+        query = normalize_rows(query_vec)
+        ranges = row_ranges(self.mode_ranges, len(self.row_ids), mode_filter)
+        if rescore_matrix is None:
+            return parallel_top_k(self._row_scorer(query), ranges, k, n_workers)
+
+        shortlist = shortlist or max(10 * k, 100)
+        candidates = parallel_top_k(self._row_scorer(query), ranges, shortlist, n_workers)
+        return rescore_shortlist(rescore_matrix, query, candidates, k)
+
+
+def evaluate_recall(vector_matrix: VectorMatrix, quantized, queries: np.ndarray, k: int, rescore: bool = True, shortlist: int = None) -> Dict[str, float]:
+    """
+    recall@k of the quantized search against the exact float32 search.
+    Any index with the top_k / nbytes interface of QuantizedMatrix can be evaluated (e.g. ReducedMatrix).
+
+    Returns:
+        dict: recall, mean latency (ms) of both searches, memory of both representations (MB)
+    """
+    hits, exact_time, quantized_time = 0, 0.0, 0.0
+    rescore_matrix = vector_matrix.matrix if rescore else None
+    for query in queries:
+        start = time.perf_counter()
+        expected = {row for _, row in vector_matrix.top_k(query, k, n_workers=1)}
+        exact_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        found = {row for _, row in quantized.top_k(query, k, n_workers=1, rescore_matrix=rescore_matrix, shortlist=shortlist)}
+        quantized_time += time.perf_counter() - start
+        hits += len(expected & found)
+
+    return {
+        'recall': hits / (k * len(queries)),
+        'float32_ms': exact_time / len(queries) * 1000,
+        'quantized_ms': quantized_time / len(queries) * 1000,
+        'float32_mb': vector_matrix.matrix.nbytes / 2**20,
+        'quantized_mb': quantized.nbytes() / 2**20
+    }
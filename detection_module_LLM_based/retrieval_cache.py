@@ -0,0 +1,89 @@
+"""
+Persistent cache of vector store search results (SQLite).
+
+A sweep runs the same test src_code against the same store and embedder for every
+prompt strategy and LLM. The cache stores the ranked results of a search under
+
+    (store version, embedder model, sha256 of the query, mode filter, k)
+
+so that repeated searches skip both the query embedding and the scoring. The store
+version changes whenever the store files are rewritten (see
+DiskBackedVectorStore.version), so results of an older store are never returned.
+
+The database uses WAL mode, so concurrent inference processes can share it.
+"""
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import List, Optional
+
+
+def query_hash(query: str) -> str:
+    return hashlib.sha256(query.encode('utf-8')).hexdigest()
+
+
+def normalize_mode_filter(mode_filter) -> Optional[List[str]]:
+    """None, a single mode or a list of modes -> None or a sorted list"""
+    if mode_filter is None:
+        return None
+    if isinstance(mode_filter, str):
+        return [mode_filter]
+    return sorted(mode_filter)
+
+
+class RetrievalCache:
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self.lock:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS search_results ('
+                'key TEXT PRIMARY KEY, store_version TEXT, results TEXT, created REAL)'
+            )
+            self.conn.commit()
+
+    @staticmethod
+    def make_key(store_version: str, model_name: str, query: str, mode_filter, k) -> str:
+        """k is the number of results, or a list of search parameters for other search methods"""
+        key = json.dumps([store_version, model_name, query_hash(query), normalize_mode_filter(mode_filter), k])
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[List]:
+        with self.lock:
+            row = self.conn.execute('SELECT results FROM search_results WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, store_version: str, results: List):
+        # similarities are numpy floats (default=float)
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO search_results (key, store_version, results, created) VALUES (?, ?, ?, ?)',
+                (key, store_version, json.dumps(results, ensure_ascii=False, default=float), time.time())
+            )
+            self.conn.commit()
+
+    def prune(self, store_version: str) -> int:
+        """delete the results of other store versions and return the number of deleted rows"""
+        with self.lock:
+            cursor = self.conn.execute('DELETE FROM search_results WHERE store_version != ?', (store_version,))
+            self.conn.commit()
+            return cursor.rowcount
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        return f"retrieval cache: {self.hits} hits, {self.misses} misses ({rate:.0%} hit rate)"
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
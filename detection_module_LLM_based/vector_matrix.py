@@ -0,0 +1,182 @@
+"""
+Normalized float32 vector matrix used by DiskBackedVectorStore.search_parallel.
+
+The store keeps its vectors in a dict of arrays ({entry_id: vector}, vectors.npz),
+which has to be stacked into a matrix for every search. VectorMatrix stacks them
+once, L2-normalizes the rows (cosine similarity becomes a dot product) and orders
+the rows by mode, so that every mode is a contiguous row range. The matrix is saved
+next to the store:
+
+    matrix.npy          float32 [n_rows, dim], memory-mapped when loaded
+    matrix_index.json   store version, entry id per row, row range per mode
+
+A search splits the row ranges of the requested modes into blocks, scores the
+blocks in a thread pool (numpy releases the GIL in the matrix-vector products),
+keeps the top-k of every block (argpartition) and merges them with a heap.
+"""
+import os
+import json
+import heapq
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+MATRIX_FILE = 'matrix.npy'
+MATRIX_INDEX_FILE = 'matrix_index.json'
+
+_executors: Dict[int, ThreadPoolExecutor] = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(n_workers: int) -> ThreadPoolExecutor:
+    """thread pools are shared by all matrices of the process (one per worker count)"""
+    with _executors_lock:
+        if n_workers not in _executors:
+            _executors[n_workers] = ThreadPoolExecutor(max_workers=n_workers)
+        return _executors[n_workers]
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class VectorMatrix:
+    def __init__(self, matrix: np.ndarray, row_ids: np.ndarray, mode_ranges: Dict[str, Tuple[int, int]], version: str = None):
+        """
+        Args:
+            matrix: L2-normalized float32 rows (an array or a read-only memmap)
+            row_ids: entry id of every row
+            mode_ranges: mode -> (start row, end row)
+            version: the store version the matrix was built from
+        """
+        self.matrix = matrix
+        self.row_ids = row_ids
+        self.mode_ranges = mode_ranges
+        self.version = version
+
+    @classmethod
+    def build(cls, metadata: List[Dict], vectors: Dict[str, np.ndarray], version: str = None) -> 'VectorMatrix':
+        """stack the store vectors, grouped by mode"""
+        by_mode: Dict[str, List[int]] = {}
+        for meta in metadata:
+            if str(meta['entry_id']) in vectors:
+                by_mode.setdefault(meta['mode'], []).append(meta['entry_id'])
+
+        row_ids, mode_ranges = [], {}
+        for mode in sorted(by_mode):
+            mode_ranges[mode] = (len(row_ids), len(row_ids) + len(by_mode[mode]))
+            row_ids.extend(by_mode[mode])
+
+        if row_ids:
+            matrix = normalize_rows(np.stack([vectors[str(eid)] for eid in row_ids]))
+        else:
+            matrix = np.zeros((0, 0), dtype=np.float32)
+        return cls(matrix, np.asarray(row_ids, dtype=np.int64), mode_ranges, version)
+
+    def save(self, storage_path: str):
+        tmp_path = os.path.join(storage_path, f"{MATRIX_FILE}.{os.getpid()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            np.save(f, self.matrix)
+        os.replace(tmp_path, os.path.join(storage_path, MATRIX_FILE))
+
+        index = {'version': self.version, 'row_ids': self.row_ids.tolist(), 'mode_ranges': self.mode_ranges}
+        tmp_path = os.path.join(storage_path, f"{MATRIX_INDEX_FILE}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, os.path.join(storage_path, MATRIX_INDEX_FILE))
+
+    @classmethod
+    def load(cls, storage_path: str, version: str = None) -> Optional['VectorMatrix']:
+        """memory-map a saved matrix; None if it is missing or was built from another store version"""
+        index_path = os.path.join(storage_path, MATRIX_INDEX_FILE)
+        matrix_path = os.path.join(storage_path, MATRIX_FILE)
+        if not (os.path.exists(index_path) and os.path.exists(matrix_path)):
+            return None
+        with open(index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        if version is not None and index['version'] != version:
+            return None
+        matrix = np.load(matrix_path, mmap_mode='r')
+        mode_ranges = {mode: tuple(r) for mode, r in index['mode_ranges'].items()}
+        return cls(matrix, np.asarray(index['row_ids'], dtype=np.int64), mode_ranges, index['version'])
+
+    def ranges(self, mode_filter=None) -> List[Tuple[int, int]]:
+        return row_ranges(self.mode_ranges, len(self.row_ids), mode_filter)
+
+    def score_rows(self, start: int, end: int, query: np.ndarray) -> np.ndarray:
+        return self.matrix[start:end] @ query
+
+    def top_k(self, query_vec: np.ndarray, k: int, mode_filter=None, n_workers: int = None, block_rows: int = None) -> List[Tuple[float, int]]:
+        """
+        Args:
+            query_vec: the (unnormalized) query embedding
+            k: number of results
+            mode_filter: modes to search (None for all)
+            n_workers: number of scoring threads
+            block_rows: rows per scoring task (default: about 4 blocks per worker, 4k-64k rows)
+
+        Returns:
+            List[Tuple[float, int]]: (cosine similarity, row) pairs, best first
+        """
+        query = normalize_rows(query_vec)
+        return parallel_top_k(lambda start, end: self.score_rows(start, end, query), self.ranges(mode_filter), k, n_workers, block_rows)
+
+
+def rescore_shortlist(rescore_matrix: np.ndarray, query: np.ndarray, candidates: List[Tuple[float, int]], k: int) -> List[Tuple[float, int]]:
+    """exact scores of the candidate rows from the float32 matrix (rows are read in order, so a memmap touches only their pages)"""
+    rows = np.sort(np.array([row for _, row in candidates], dtype=np.int64))
+    if len(rows) == 0:
+        return []
+    exact = np.asarray(rescore_matrix[rows], dtype=np.float32) @ query
+    order = np.argsort(-exact)[:k]
+    return [(float(exact[i]), int(rows[i])) for i in order]
+
+
+def row_ranges(mode_ranges: Dict[str, Tuple[int, int]], n_rows: int, mode_filter=None) -> List[Tuple[int, int]]:
+    """the row ranges of the modes in mode_filter (all rows if None)"""
+    if mode_filter is None:
+        return [(0, n_rows)] if n_rows else []
+    if isinstance(mode_filter, str):
+        mode_filter = [mode_filter]
+    return [mode_ranges[mode] for mode in mode_filter if mode in mode_ranges]
+
+
+def parallel_top_k(score_rows, ranges: List[Tuple[int, int]], k: int, n_workers: int = None, block_rows: int = None) -> List[Tuple[float, int]]:
+    """
+    score the row ranges block by block in the shared thread pool and merge the per-block top-k.
+
+    Args:
+        score_rows: function (start, end) -> scores of the rows start..end
+        ranges: (start, end) row ranges to search
+
+    Returns:
+        List[Tuple[float, int]]: (score, row) pairs, best first
+    """
+    n_rows = sum(end - start for start, end in ranges)
+    if n_rows == 0 or k <= 0:
+        return []
+    n_workers = n_workers or (os.cpu_count() or 4)
+
+    if block_rows is None:
+        block_rows = min(max(-(-n_rows // (4 * n_workers)), 4096), 65536)
+    blocks = [(s, min(s + block_rows, end)) for start, end in ranges for s in range(start, end, block_rows)]
+
+    def score_block(block):
+        start, end = block
+        scores = score_rows(start, end)
+        if len(scores) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(scores))
+        return [(float(scores[i]), start + int(i)) for i in top]
+
+    if n_workers <= 1 or len(blocks) == 1:
+        partial = [score_block(block) for block in blocks]
+    else:
+        partial = list(get_executor(n_workers).map(score_block, blocks))
+    return heapq.nlargest(k, (item for block in partial for item in block))
@@ -4,49 +4,160 @@ Disk-backed vector store that stores:
 - embeddings in .npz
 
 Supports: insert from response, query by similarity, and persistent reload.
+Search results can be cached persistently across runs (retrieval_cache.py).
+search_parallel can also rank with a BM25 index of the entry texts (lexical_index.py),
+alone or fused with the cosine ranking, and restrict or boost the candidates by their
+structural bottleneck profile (code_fingerprint.py).
+With a tracer (the caller's, e.g. inference_module/tracing.py), searches are traced as
+'retrieval' spans with the retrieved ids, similarities and cache hit.
 """
 import os
 import json
 import numpy as np
 import glob
-import concurrent.futures
-from typing import List, Dict, Literal, Optional
+import hashlib
+import threading
+from contextlib import nullcontext
+from typing import Callable, List, Dict, Literal, Optional
 from sklearn.metrics.pairwise import cosine_similarity
 
 import sys
 sys.path.append('.')
 from detection_module_LLM_based.embedding_processor import EmbeddingProcessor, EmbeddingMode
+from detection_module_LLM_based.embedding_service import load_embedder
+from detection_module_LLM_based.retrieval_cache import RetrievalCache
+from detection_module_LLM_based.vector_matrix import VectorMatrix
+from detection_module_LLM_based.quantization import QuantizedMatrix, QUANTIZATION_KINDS
+from detection_module_LLM_based.dim_reduction import ReducedMatrix, REDUCTION_METHODS
+from detection_module_LLM_based.lexical_index import LexicalIndex, reciprocal_rank_fusion
+from detection_module_LLM_based.code_fingerprint import FingerprintMatrix, fingerprint_bits
+from detection_module_LLM_based.vector_matrix import normalize_rows, parallel_top_k, rescore_shortlist
 
+RETRIEVAL_MODES = ['dense', 'hybrid', 'lexical']
+PROFILE_MODES = ['filter', 'boost']
 
 
+class _NoSpan:
+    def set(self, **attributes):
+        pass
+
+
+class NoTracer:
+    """tracer of a store created without one: spans and counters are dropped"""
+
+    def span(self, name: str, **attributes):
+        return nullcontext(_NoSpan())
+
+    def count(self, metric: str, value: float = 1, **labels):
+        pass
+
 
 class DiskBackedVectorStore:
-    def __init__(self, storage_path: str, model_name: str):
+    def __init__(self, storage_path: str, model_name: str, result_cache: bool = False, quantization: Optional[str] = None,
+                 reduced_dim: Optional[int] = None, reduction: str = 'pca', retrieval_mode: str = 'dense', hybrid_candidates: int = 100,
+                 profile_mode: Optional[str] = None, profile_boost: float = 0.1, tracer=None):
+        """
+        Args:
+            storage_path: the store directory (metadata.json, vectors.npz)
+            model_name: the embedding model of the stored vectors
+            result_cache: cache the search results in <storage_path>/retrieval_cache.sqlite
+            quantization: search_parallel scores a compressed copy ('float16', 'int8' or 'pq', see quantization.py)
+                          and rescores the shortlist with the float32 matrix
+            reduced_dim: search_parallel shortlists on a reduced copy of this dimension and reranks with the full vectors
+            reduction: 'pca' or 'truncate' (see dim_reduction.py)
+            retrieval_mode: ranking of search_parallel
+                            'dense'    cosine similarity of the embeddings
+                            'hybrid'   reciprocal rank fusion of the cosine and BM25 rankings
+                            'lexical'  BM25 only (no query embedding; also used whenever no embedder is given)
+            hybrid_candidates: length of both rankings fused in hybrid mode
+            profile_mode: use the bottleneck profile of code queries (code_fingerprint.py) in the cosine ranking
+                          'filter'  only entries sharing a rule category with the query are scored (bitmap pre-filter,
+                                    unfiltered if fewer than k entries match)
+                          'boost'   profile_boost * Jaccard similarity of the category bitmaps is added to the cosine similarity
+            tracer: receives the 'retrieval' / 'embedding' spans and the cache counter (span(name, **attributes),
+                    count(metric, value, **labels)); not traced without one
+        """
+        if quantization is not None and quantization not in QUANTIZATION_KINDS:
+            raise ValueError(f"unsupported quantization: {quantization} (expected one of {QUANTIZATION_KINDS})")
+        if quantization is not None and reduced_dim is not None:
+            raise ValueError("quantization and reduced_dim cannot be combined")
+        if reduction not in REDUCTION_METHODS:
+            raise ValueError(f"unsupported reduction: {reduction} (expected one of {REDUCTION_METHODS})")
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"unsupported retrieval mode: {retrieval_mode} (expected one of {RETRIEVAL_MODES})")
+        if profile_mode is not None and profile_mode not in PROFILE_MODES:
+            raise ValueError(f"unsupported profile mode: {profile_mode} (expected one of {PROFILE_MODES})")
         os.makedirs(storage_path, exist_ok=True)
+        self.storage_path = storage_path
         self.meta_path = os.path.join(storage_path, 'metadata.json')
         self.vec_path = os.path.join(storage_path, 'vectors.npz')
         self.model_name = model_name
+        self.tracer = tracer or NoTracer()
 
         self.metadata: List[Dict] = []
-        self.vectors: Dict[str, np.ndarray] = {}
+        self._vectors: Optional[Dict[str, np.ndarray]] = None
         self.next_id = 0
+        self.version = None
+        self._meta_by_id: Dict[int, Dict] = {}
+        self._vector_matrix = None
+        self.quantization = quantization
+        self._quantized_matrix = None
+        self.reduced_dim = reduced_dim
+        self.reduction = reduction
+        self._reduced_matrix = None
+        self.retrieval_mode = retrieval_mode
+        self.hybrid_candidates = hybrid_candidates
+        self._lexical_index = None
+        self.profile_mode = profile_mode
+        self.profile_boost = profile_boost
+        self._fingerprint_matrix = None
+        self._row_order = None  # (matrix version, rows sorted by entry id, sorted entry ids)
+        self._matrix_lock = threading.Lock()
 
         self._load()
 
+        self.result_cache = None
+        if result_cache:
+            self.result_cache = RetrievalCache(os.path.join(storage_path, 'retrieval_cache.sqlite'))
+            self.result_cache.prune(self.version)
+
+    def _update_version(self):
+        """the store version changes whenever the store files are rewritten (used to invalidate cached results)"""
+        parts = [str(len(self.metadata))]
+        for path in (self.meta_path, self.vec_path):
+            if os.path.exists(path):
+                stat = os.stat(path)
+                parts.append(f"{stat.st_size}:{stat.st_mtime_ns}")
+        self.version = hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+
     def _load(self):
         if os.path.exists(self.meta_path):
             with open(self.meta_path, 'r', encoding='utf-8') as f:
                 self.metadata = json.load(f)
             self.next_id = max([m['entry_id'] for m in self.metadata], default=-1) + 1
-        if os.path.exists(self.vec_path):
-            self.vectors = dict(np.load(self.vec_path, allow_pickle=False))
+        # vectors.npz is read on first use; searches through an up-to-date matrix.npy never need it
+        self._vectors = None
+        self._update_version()
+        self._meta_by_id = {m['entry_id']: m for m in self.metadata}
             
             
 
+    @property
+    def vectors(self) -> Dict[str, np.ndarray]:
+        if self._vectors is None:
+            self._vectors = dict(np.load(self.vec_path, allow_pickle=False)) if os.path.exists(self.vec_path) else {}
+        return self._vectors
+
+    @vectors.setter
+    def vectors(self, vectors: Dict[str, np.ndarray]):
+        self._vectors = vectors
+
     def _save(self):
         with open(self.meta_path, 'w', encoding='utf-8') as f:
             json.dump(self.metadata, f, ensure_ascii=False, indent=2)
         np.savez_compressed(self.vec_path, **self.vectors)
+        self._update_version()
+        self._meta_by_id = {m['entry_id']: m for m in self.metadata}
 
     def add_encoded_segments(self, segments: List[Dict], analysis_id: str):
         """add encoded segments to the store"""
@@ -74,41 +185,142 @@ class DiskBackedVectorStore:
         segments = embedder.encode_segments(response, modes[0], analysis_id)
         self.add_encoded_segments(segments, analysis_id)
 
-    def _process_chunk(self, chunk, mode_filter):
-        """process the metadata chunk and return the filtered metadata and vectors"""
-        local_metas, local_vecs = [], []
-        for meta in chunk:
-            if mode_filter is None or meta['mode'] in mode_filter:
-                eid = str(meta['entry_id'])
-                if eid in self.vectors:
-                    local_metas.append(meta)
-                    local_vecs.append(self.vectors[eid])
-        return local_metas, local_vecs
-
-    def search_parallel(self, query: str, embedder: EmbeddingProcessor, mode_filter: List[EmbeddingMode] = None, retreived_k: int = 3, n_workers: int = None) -> List[Dict]:
-        query_vec = embedder.model.encode([query])[0]
-        
-        # define the number of workers and the chunk size
-        n_workers = n_workers or (os.cpu_count() or 4)
-        chunk_size = max(100, len(self.metadata) // n_workers)
-        chunks = [self.metadata[i:i+chunk_size] for i in range(0, len(self.metadata), chunk_size)]
-        
-        # directly process (instead of multiprocessing)
-        metas, vecs = [], []
-        for chunk in chunks:
-            local_metas, local_vecs = self._process_chunk(chunk, mode_filter)
-            metas.extend(local_metas)
-            vecs.extend(local_vecs)
-        
-        # the rest of the logic is the same
-        if not vecs:
-            return []
-        
-        vec_matrix = np.stack(vecs)
-        sims = cosine_similarity([query_vec], vec_matrix)[0]
-        
-        ranked = sorted(zip(metas, sims), key=lambda x: x[1], reverse=True)[:retreived_k]
-        return [
+    def vector_matrix(self) -> VectorMatrix:
+        """the normalized vector matrix of the store (memory-mapped from matrix.npy, rebuilt when the store changes)"""
+        with self._matrix_lock:
+            if self._vector_matrix is None or self._vector_matrix.version != self.version:
+                matrix = VectorMatrix.load(self.storage_path, self.version)
+                if matrix is None:
+                    matrix = VectorMatrix.build(self.metadata, self.vectors, self.version)
+                    try:
+                        matrix.save(self.storage_path)
+                    except OSError as e:
+                        print(f"warning: failed to save the vector matrix: {e}")
+                self._vector_matrix = matrix
+            return self._vector_matrix
+
+    def quantized_matrix(self) -> QuantizedMatrix:
+        """the compressed copy of the vector matrix (matrix_<kind>.npz, rebuilt when the store changes)"""
+        matrix = self.vector_matrix()
+        with self._matrix_lock:
+            if self._quantized_matrix is None or self._quantized_matrix.version != matrix.version:
+                quantized = QuantizedMatrix.load(self.storage_path, self.quantization, matrix)
+                if quantized is None:
+                    quantized = QuantizedMatrix.build(matrix, self.quantization)
+                    try:
+                        quantized.save(self.storage_path)
+                    except OSError as e:
+                        print(f"warning: failed to save the {self.quantization} matrix: {e}")
+                self._quantized_matrix = quantized
+            return self._quantized_matrix
+
+    def fit_reduction(self, dim: int, method: str = 'pca') -> ReducedMatrix:
+        """fit and save the reduced copy of the vectors (part of building the store, see populate_vector_store)"""
+        reduced = ReducedMatrix.fit(self.vector_matrix(), dim, method)
+        reduced.save(self.storage_path)
+        if (dim, method) == (self.reduced_dim, self.reduction):
+            self._reduced_matrix = reduced
+        return reduced
+
+    def reduced_matrix(self) -> ReducedMatrix:
+        """the reduced copy of the vector matrix (matrix_<method><dim>.npz, refitted when the store changes)"""
+        matrix = self.vector_matrix()
+        with self._matrix_lock:
+            if self._reduced_matrix is None or self._reduced_matrix.version != matrix.version:
+                reduced = ReducedMatrix.load(self.storage_path, self.reduction, self.reduced_dim, matrix)
+                if reduced is None:
+                    reduced = ReducedMatrix.fit(matrix, self.reduced_dim, self.reduction)
+                    try:
+                        reduced.save(self.storage_path)
+                    except OSError as e:
+                        print(f"warning: failed to save the reduced matrix: {e}")
+                self._reduced_matrix = reduced
+            return self._reduced_matrix
+
+    def lexical_index(self) -> LexicalIndex:
+        """the BM25 index of the entry texts (lexical_index.npz, rebuilt when the store changes)"""
+        with self._matrix_lock:
+            if self._lexical_index is None or self._lexical_index.version != self.version:
+                index = LexicalIndex.load(self.storage_path, self.version)
+                if index is None:
+                    index = LexicalIndex.build(self.metadata, self.version)
+                    try:
+                        index.save(self.storage_path)
+                    except OSError as e:
+                        print(f"warning: failed to save the lexical index: {e}")
+                self._lexical_index = index
+            return self._lexical_index
+
+    def fingerprint_matrix(self) -> FingerprintMatrix:
+        """the structural fingerprints of the entries in the row order of the vector matrix (fingerprints.npz)"""
+        matrix = self.vector_matrix()
+        with self._matrix_lock:
+            if self._fingerprint_matrix is None or self._fingerprint_matrix.version != matrix.version:
+                fingerprints = FingerprintMatrix.load(self.storage_path, matrix.version)
+                if fingerprints is None:
+                    fingerprints = FingerprintMatrix.build(matrix, self._meta_by_id)
+                    try:
+                        fingerprints.save(self.storage_path)
+                    except OSError as e:
+                        print(f"warning: failed to save the fingerprints: {e}")
+                self._fingerprint_matrix = fingerprints
+            return self._fingerprint_matrix
+
+    def _cache_key(self, query, embedder, mode_filter, retreived_k, query_bits=None, exact=False):
+        """
+        key of the cached results; exact: the float32 cosine ranking of search, independent of the store's
+        retrieval mode, quantization, reduction and profile (the ranking of search_parallel / search_diverse)
+        """
+        if self.result_cache is None:
+            return None
+        if not exact and (embedder is None or self.retrieval_mode == 'lexical'):
+            return RetrievalCache.make_key(self.version, 'bm25', query, mode_filter, retreived_k)
+        model_name = getattr(embedder, 'model_name', self.model_name)
+        if getattr(embedder, 'backend', 'torch') != 'torch':
+            model_name = f"{model_name}|{embedder.backend}"
+        if exact:
+            return RetrievalCache.make_key(self.version, f"{model_name}|exact", query, mode_filter, retreived_k)
+        if self.quantization:
+            model_name = f"{model_name}|{self.quantization}"
+        elif self.reduced_dim:
+            model_name = f"{model_name}|{self.reduction}{self.reduced_dim}"
+        if self.retrieval_mode == 'hybrid':
+            model_name = f"{model_name}|hybrid{self.hybrid_candidates}"
+        if query_bits:
+            model_name = f"{model_name}|{self.profile_mode}{self.profile_boost if self.profile_mode == 'boost' else ''}:{query_bits}"
+        return RetrievalCache.make_key(self.version, model_name, query, mode_filter, retreived_k)
+
+    def search_parallel(self, query: str, embedder: EmbeddingProcessor, mode_filter: List[EmbeddingMode] = None, retreived_k: int = 3, n_workers: int = None,
+                        query_fingerprint: Optional[np.ndarray] = None) -> List[Dict]:
+        """
+        Args:
+            query_fingerprint: bottleneck profile of the query code for profile_mode; the profile is only
+                               used with a fingerprint (code queries), never for natural-language queries
+        """
+        tracer = self.tracer
+        store_name = os.path.basename(os.path.normpath(self.storage_path))
+        with tracer.span('retrieval', store=store_name, retrieval_mode=self.retrieval_mode, k=retreived_k) as span:
+            results, cache_hit = self._search_parallel(query, embedder, mode_filter, retreived_k, n_workers, query_fingerprint)
+            span.set(cache_hit=cache_hit, retrieved_ids=[r['entry_id'] for r in results],
+                     similarities=[round(float(r['similarity']), 4) for r in results])
+            if cache_hit is not None:
+                tracer.count('eco_retrieval_cache_total', store=store_name, result='hit' if cache_hit else 'miss')
+            return results
+
+    def _search_parallel(self, query, embedder, mode_filter, retreived_k, n_workers, query_fingerprint):
+        """(results, cache hit or None without a result cache)"""
+        query_bits = None
+        if self.profile_mode and query_fingerprint is not None and embedder is not None and self.retrieval_mode != 'lexical':
+            query_bits = fingerprint_bits(query_fingerprint)
+        cache_key = self._cache_key(query, embedder, mode_filter, retreived_k, query_bits)
+        if cache_key is not None:
+            cached = self.result_cache.get(cache_key)
+            if cached is not None:
+                return cached, True
+
+        top = self._rank(query, embedder, retreived_k, mode_filter, n_workers, query_bits)
+        ranked = [(self._meta_by_id[entry_id], score) for score, entry_id in top]
+        results = [
             {
                 'text': m['text'],
                 'similarity': score,
@@ -119,9 +331,78 @@ class DiskBackedVectorStore:
             }
             for m, score in ranked
         ]
+        if cache_key is not None:
+            self.result_cache.put(cache_key, self.version, results)
+        return results, (False if cache_key is not None else None)
+
+    def _rank(self, query: str, embedder, k: int, mode_filter, n_workers: int = None, query_bits: int = None) -> List[tuple]:
+        """(score, entry id) pairs of the k best entries in the store's retrieval mode"""
+        if embedder is None or self.retrieval_mode == 'lexical':
+            # lexical fast path: BM25 scores of the query terms, no embedding
+            index = self.lexical_index()
+            return [(score, int(index.row_ids[row])) for score, row in index.top_k(query, k, mode_filter)]
+        if self.retrieval_mode == 'hybrid':
+            # the similarity of a result is its fused score
+            dense = self._dense_top_k(self._embed_query(embedder, query), self.hybrid_candidates, mode_filter, n_workers, query_bits)
+            index = self.lexical_index()
+            lexical = [int(index.row_ids[row]) for _, row in index.top_k(query, self.hybrid_candidates, mode_filter)]
+            return reciprocal_rank_fusion([[entry_id for _, entry_id in dense], lexical], k)
+        return self._dense_top_k(self._embed_query(embedder, query), k, mode_filter, n_workers, query_bits)
+
+    def _embed_query(self, embedder, query: str) -> np.ndarray:
+        with self.tracer.span('embedding'):
+            return embedder.encode_batch([query], truncate=False)[0]
+
+    def _dense_top_k(self, query_vec: np.ndarray, k: int, mode_filter, n_workers: int = None, query_bits: int = None) -> List[tuple]:
+        """(cosine similarity, entry id) pairs of the k nearest entries"""
+        # blocks of the normalized matrix are scored in a thread pool and the per-block top-k are merged
+        matrix = self.vector_matrix()
+        top = self._profile_top_k(matrix, query_vec, k, mode_filter, n_workers, query_bits) if query_bits else None
+        if top is None and self.quantization:
+            # compressed scores select a shortlist that is rescored with the float32 rows
+            top = self.quantized_matrix().top_k(query_vec, k, mode_filter, n_workers, rescore_matrix=matrix.matrix)
+        elif top is None and self.reduced_dim:
+            # two-stage search: shortlist on the reduced vectors, rerank with the full vectors
+            top = self.reduced_matrix().top_k(query_vec, k, mode_filter, n_workers, rescore_matrix=matrix.matrix)
+        elif top is None:
+            top = matrix.top_k(query_vec, k, mode_filter, n_workers)
+        return [(score, int(matrix.row_ids[row])) for score, row in top]
+
+    def _matrix_rows(self, matrix: VectorMatrix, entry_ids: List[int]) -> np.ndarray:
+        """the rows of the entries in the vector matrix (-1 for entries without a row)"""
+        with self._matrix_lock:
+            if self._row_order is None or self._row_order[0] != matrix.version:
+                order = np.argsort(matrix.row_ids, kind='stable')
+                self._row_order = (matrix.version, order, np.asarray(matrix.row_ids)[order])
+            _, order, sorted_ids = self._row_order
+        ids = np.asarray(entry_ids, dtype=np.int64)
+        if len(ids) == 0 or len(order) == 0:
+            return np.full(len(ids), -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(sorted_ids, ids), len(order) - 1)
+        rows = order[positions]
+        return np.where(matrix.row_ids[rows] == ids, rows, -1)
+
+    def _profile_top_k(self, matrix: VectorMatrix, query_vec: np.ndarray, k: int, mode_filter, n_workers: int, query_bits: int):
+        """top-k rows using the bottleneck profile (exact float32 scores); None if the filter leaves fewer than k rows"""
+        fingerprints = self.fingerprint_matrix()
+        query = normalize_rows(query_vec)
+        if self.profile_mode == 'filter':
+            # only the rows sharing a bottleneck category are read and scored
+            rows = fingerprints.candidate_rows(query_bits, matrix.ranges(mode_filter))
+            if len(rows) < k:
+                return None
+            return rescore_shortlist(matrix.matrix, query, [(0.0, row) for row in rows], k)
+        boost = self.profile_boost * fingerprints.overlap(query_bits)
+        return parallel_top_k(lambda start, end: matrix.score_rows(start, end, query) + boost[start:end], matrix.ranges(mode_filter), k, n_workers)
 
     def search(self, query: str, embedder: EmbeddingProcessor, mode_filter: List[EmbeddingMode] = None, retreived_k: int = 3) -> List[Dict]:
-        query_vec = embedder.model.encode([query])[0]
+        cache_key = self._cache_key(query, embedder, mode_filter, retreived_k, exact=True)
+        if cache_key is not None:
+            cached = self.result_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        query_vec = self._embed_query(embedder, query)
 
         metas, vecs = [], []
         for meta in self.metadata:
@@ -138,7 +419,7 @@ class DiskBackedVectorStore:
         sims = cosine_similarity([query_vec], vec_matrix)[0]
 
         ranked = sorted(zip(metas, sims), key=lambda x: x[1], reverse=True)[:retreived_k]
-        return [
+        results = [
             {
                 'text': m['text'],
                 'similarity': score,
@@ -149,6 +430,104 @@ class DiskBackedVectorStore:
             }
             for m, score in ranked
         ]
+        if cache_key is not None:
+            self.result_cache.put(cache_key, self.version, results)
+        return results
+
+    def search_diverse(self, query: str, embedder: EmbeddingProcessor, mode_filter: List[EmbeddingMode] = None, retreived_k: int = 3,
+                       n_sets: int = 1, candidates_m: int = 20, mmr_lambda: float = 0.7, novelty: float = 0.3,
+                       query_fingerprint: Optional[np.ndarray] = None, candidate_filter: Optional[Callable[[List[Dict]], List[Dict]]] = None,
+                       filter_key: Optional[str] = None) -> List[List[Dict]]:
+        """
+        return n_sets diverse top-k result sets from one query embedding and one scoring pass (maximal marginal relevance).
+
+        The top-M candidates are selected once, ranked as in search_parallel (retrieval mode, quantization or
+        reduced shortlist, profile_mode with a query_fingerprint); each set is then built greedily with
+        score = lambda * relevance - (1 - lambda) * max similarity to the set - novelty * times already used by earlier sets,
+        so later sets explore other examples. Even the first set can differ from the plain top-k, as redundant
+        candidates are traded for less similar ones (mmr_lambda=1 and novelty=0 give the top-k in every set).
+        Entries of the same analysis_id are never selected twice in one set.
+
+        Args:
+            n_sets: number of result sets (e.g. the sample count of k_sample)
+            candidates_m: size of the candidate pool (top-M of the store's ranking)
+            mmr_lambda: relevance / redundancy trade-off within a set
+            novelty: penalty per earlier use of a candidate
+            query_fingerprint: bottleneck profile of the query code for profile_mode (no profile without it)
+            candidate_filter: applied to the candidate pool (results in the format of search, in ranking order) before
+                              the sets are built, returns the candidates to keep (e.g. without near-duplicates)
+            filter_key: identifies the candidate_filter in the result cache key (not cached with a filter but no key)
+
+        Returns:
+            List[List[Dict]]: n_sets result lists in the format of search
+        """
+        query_bits = None
+        if self.profile_mode and query_fingerprint is not None and embedder is not None and self.retrieval_mode != 'lexical':
+            query_bits = fingerprint_bits(query_fingerprint)
+        cache_key = None
+        if candidate_filter is None or filter_key is not None:
+            cache_key = self._cache_key(query, embedder, mode_filter, ['diverse', retreived_k, n_sets, candidates_m, mmr_lambda, novelty, filter_key],
+                                        query_bits)
+        if cache_key is not None:
+            cached = self.result_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        # candidate pool: top-M of the store's ranking (entries without a vector row are dropped), relevance rescaled to [0, 1]
+        matrix = self.vector_matrix()
+        top = self._rank(query, embedder, max(candidates_m, retreived_k), mode_filter, None, query_bits)
+        top_rows = self._matrix_rows(matrix, [entry_id for _, entry_id in top])
+        top = [(score, entry_id, row) for (score, entry_id), row in zip(top, top_rows) if row >= 0]
+        if candidate_filter is not None:
+            pool = [self._result(self._meta_by_id[entry_id], score) for score, entry_id, _ in top]
+            kept = {id(r) for r in candidate_filter(pool)}
+            top = [candidate for candidate, r in zip(top, pool) if id(r) in kept]
+        if not top:
+            return [[] for _ in range(n_sets)]
+        m = len(top)
+        rows = np.array([row for _, _, row in top], dtype=np.int64)
+        sims = np.array([score for score, _, _ in top])
+        metas = [self._meta_by_id[entry_id] for _, entry_id, _ in top]
+        relevance = sims
+        spread = relevance.max() - relevance.min()
+        relevance = (relevance - relevance.min()) / spread if spread > 0 else np.ones(m)
+        # only the candidate rows are read; the rows are normalized, so their dot products are the cosine similarities
+        candidate_vecs = np.asarray(matrix.matrix[np.sort(rows)], dtype=np.float32)[np.argsort(np.argsort(rows))]
+        pairwise = candidate_vecs @ candidate_vecs.T
+        analysis_ids = np.array([str(meta['analysis_id']) for meta in metas])
+
+        usage = np.zeros(m)
+        result_sets = []
+        for _ in range(n_sets):
+            selected = []
+            redundancy = np.zeros(m)
+            available = np.ones(m, dtype=bool)
+            for _ in range(min(retreived_k, m)):
+                scores = mmr_lambda * relevance - (1 - mmr_lambda) * redundancy - novelty * usage
+                scores[~available] = -np.inf
+                best = int(np.argmax(scores))
+                if not np.isfinite(scores[best]):
+                    break
+                selected.append(best)
+                available &= analysis_ids != analysis_ids[best]
+                redundancy = np.maximum(redundancy, pairwise[best])
+            usage[selected] += 1
+            result_sets.append([self._result(metas[i], float(sims[i])) for i in selected])
+
+        if cache_key is not None:
+            self.result_cache.put(cache_key, self.version, result_sets)
+        return result_sets
+
+    @staticmethod
+    def _result(meta: Dict, similarity: float) -> Dict:
+        return {
+            'text': meta['text'],
+            'similarity': similarity,
+            'entry_id': meta['entry_id'],
+            'mode': meta['mode'],
+            'analysis_id': meta['analysis_id'],
+            'index': meta['index']
+        }
 
     def has_analysis_id(self, analysis_id: str) -> bool:
         """check if the specified analysis_id is already in the store"""
@@ -203,7 +582,8 @@ def load_snippet_data(snippet_data_path: str) -> List[tuple]:
     return result_data
     
 
-def populate_vector_store(analysis_data_path: str, store_dir: str, model_name: str, data_type: Literal['analysis', 'snippet']) -> DiskBackedVectorStore:
+def populate_vector_store(analysis_data_path: str, store_dir: str, model_name: str, data_type: Literal['analysis', 'snippet'],
+                          reduced_dim: Optional[int] = None, reduction: str = 'pca') -> DiskBackedVectorStore:
     """
     read the analysis result files and add them to the vector store.
     
@@ -211,6 +591,9 @@ def populate_vector_store(analysis_data_path: str, store_dir: str, model_name: s
         analysis_data_path: the path to the analysis result JSON files
         store_dir: the path to the vector store data
         model_name: the name of the embedding model to use
+        reduced_dim: also fit the reduced copy used by the two-stage search (e.g. 128)
+        reduction: 'pca' or 'truncate'
+        (the segments are encoded by the embedding service if EMBEDDING_SERVICE_URL is set)
     
     Returns:
         DiskBackedVectorStore: the populated vector store instance
@@ -218,7 +601,7 @@ def populate_vector_store(analysis_data_path: str, store_dir: str, model_name: s
     if not os.path.exists(store_dir):
         os.makedirs(store_dir)
 
-    embedder = EmbeddingProcessor(model_name=model_name)
+    embedder = load_embedder(model_name)
     storage = DiskBackedVectorStore(storage_path=store_dir, model_name=model_name)
     
     if data_type == 'analysis': 
@@ -244,6 +627,9 @@ def populate_vector_store(analysis_data_path: str, store_dir: str, model_name: s
             
 
         storage.add_encoded_segments(segments, analysis_id)
+
+    if reduced_dim:
+        storage.fit_reduction(reduced_dim, reduction)
     
     return storage
 
@@ -264,7 +650,7 @@ if __name__ == '__main__':
     analysis_data_path = './BRIDGE_data/distilled_rationales'  
     store_dir = './BRIDGE_data/rag_store/distilled_deepseek'
     model_name = 'Qodo/Qodo-Embed-1-1.5B'
-    storage = populate_vector_store(analysis_data_path, store_dir, model_name, data_type='analysis')
+    storage = populate_vector_store(analysis_data_path, store_dir, model_name, data_type='analysis', reduced_dim=128)
 
 
     # # Example 2: Populate vector store from snippet data
@@ -273,7 +659,7 @@ if __name__ == '__main__':
     # model_name = 'Qodo/Qodo-Embed-1-1.5B'
     # storage = populate_vector_store(snippet_data_path, store_dir, model_name, data_type='snippet')
 
-    embedder = EmbeddingProcessor(model_name='Qodo/Qodo-Embed-1-1.5B')
+    embedder = load_embedder('Qodo/Qodo-Embed-1-1.5B')
     
     example_code = """#include <iostream>
     using namespace std;
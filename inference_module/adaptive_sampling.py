@@ -0,0 +1,200 @@
+"""
+Adaptive early stopping of k_sample generation.
+
+k_sample requests sample_num completions per item even when the first samples
+already repeat each other or contain a working optimization. With --early_stop,
+process_locked_item extracts the code of every response as it arrives
+(CodeExtractor), normalizes it (comments and whitespace removed) and stops
+requesting samples once the criterion is met:
+
+    distinct    the last --stop_patience samples produced no new code (the sampling
+                has saturated)
+    passing     --target_passing distinct candidates compile and reproduce the expected
+                output of the problem's first test case (--test_cases_dir); without a
+                test case only compilation is checked. Saturation also stops.
+
+--min_samples samples are always generated. The samples already generated are saved
+as usual, so output_format.py and the evaluation read early-stopped items unchanged.
+The prompts (and the analysis calls of retrieve_LLM_NLsim) are still built for all
+sample_num samples beforehand; only the generation calls are saved.
+
+Every item is recorded in <run>/early_stop.csv:
+
+    src_id, planned, calls, saved, distinct, passing, reason
+
+and on the item span (llm_calls, llm_calls_saved, stop_reason) and the
+eco_llm_calls_saved_total counter of the tracer.
+"""
+import os
+import re
+import csv
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+import subprocess
+from typing import Dict, List, Optional
+
+import sys
+sys.path.append('.')
+from inference_module.output_format import CodeExtractor
+from inference_module.instruction_count import compile_source, load_test_cases, outputs_match
+
+logger = logging.getLogger(__name__)
+
+EARLY_STOP_CRITERIA = ['distinct', 'passing']
+LOG_FIELDS = ['src_id', 'planned', 'calls', 'saved', 'distinct', 'passing', 'reason']
+
+_COMMENTS = re.compile(r"//[^\n]*|/\*.*?\*/", re.DOTALL)
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_code(code: str) -> str:
+    """the code without comments and whitespace, so formatting-only variants of a sample compare equal"""
+    return _WHITESPACE.sub('', _COMMENTS.sub('', code))
+
+
+def smoke_test(code: str, test_case: Optional[tuple], work_dir: str, name: str, timeout: float = 5.0) -> bool:
+    """
+    compile the code and run it on one test case.
+
+    Args:
+        test_case: (input_path, output_path); None checks the compilation only
+    Returns:
+        bool: compiled and (with a test case) printed the expected output, ignoring whitespace
+    """
+    binary = compile_source(code, work_dir, name)
+    if binary is None:
+        return False
+    if test_case is None:
+        return True
+    input_path, output_path = test_case
+    with open(input_path, 'r') as stdin:
+        try:
+            # generated programs may print invalid UTF-8
+            proc = subprocess.run([binary], stdin=stdin, capture_output=True, text=True, errors='replace', timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return False
+    with open(output_path, 'r') as f:
+        expected = f.read()
+    return proc.returncode == 0 and outputs_match(proc.stdout, expected)
+
+
+class AdaptiveSampler:
+    def __init__(self, planned: int, criterion: str, min_samples: int = 2, patience: int = 2, target_passing: int = 1,
+                 test_case: Optional[tuple] = None, timeout: float = 5.0):
+        """
+        Args:
+            planned: the number of samples of the item (sample_num)
+            criterion: 'distinct' or 'passing' (see the module docstring)
+            min_samples: samples generated before the criterion is checked
+            patience: consecutive samples without new code that end the sampling
+            target_passing: distinct passing candidates that end the sampling ('passing')
+            test_case: (input_path, output_path) of the smoke test ('passing')
+            timeout: seconds of the smoke test run
+        """
+        if criterion not in EARLY_STOP_CRITERIA:
+            raise ValueError(f"unsupported early stop criterion: {criterion}")
+        self.planned = planned
+        self.criterion = criterion
+        self.min_samples = min_samples
+        self.patience = patience
+        self.target_passing = target_passing
+        self.test_case = test_case
+        self.timeout = timeout
+        self.calls = 0
+        self.seen: Dict[str, bool] = {}  # normalized code hash -> passed the smoke test
+        self.stale = 0  # consecutive samples without new code
+        self.reason = None
+
+    @property
+    def passing(self) -> int:
+        return sum(self.seen.values())
+
+    def add(self, response: str):
+        """record a response; the smoke test runs once per distinct code ('passing')"""
+        self.calls += 1
+        code = CodeExtractor.extract_code_or_main_function(response)
+        key = hashlib.sha1(normalize_code(code).encode('utf-8')).hexdigest() if code and code.strip() else None
+        if key is None or key in self.seen:
+            self.stale += 1
+            return
+        self.stale = 0
+        self.seen[key] = False
+        if self.criterion == 'passing':
+            work_dir = tempfile.mkdtemp(prefix='eco_smoke_')
+            try:
+                self.seen[key] = smoke_test(code, self.test_case, work_dir, 'candidate', self.timeout)
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+    def should_stop(self) -> bool:
+        if self.calls >= self.planned or self.calls < self.min_samples:
+            return False
+        if self.criterion == 'passing' and self.passing >= self.target_passing:
+            self.reason = 'passing'
+        elif self.stale >= self.patience:
+            self.reason = 'saturated'
+        return self.reason is not None
+
+    def stats(self) -> Dict:
+        return {
+            'planned': self.planned,
+            'calls': self.calls,
+            'saved': self.planned - self.calls,
+            'distinct': len(self.seen),
+            'passing': self.passing if self.criterion == 'passing' else None,
+            'reason': self.reason or 'completed'
+        }
+
+
+def create_sampler(args, item: Dict, planned: int) -> Optional[AdaptiveSampler]:
+    """the sampler of an item, None unless --early_stop is set for k_sample"""
+    if not getattr(args, 'early_stop', None) or args.sampling != 'k_sample' or planned <= 1:
+        return None
+    test_case = None
+    if args.early_stop == 'passing' and args.test_cases_dir and item.get('problem_id'):
+        test_cases = load_test_cases(args.test_cases_dir, item['problem_id'])
+        test_case = test_cases[0] if test_cases else None
+        if test_case is None:
+            logger.warning(f"no test cases found for {item['src_id']} ({item['problem_id']}), checking compilation only")
+    return AdaptiveSampler(planned, args.early_stop, args.min_samples, args.stop_patience, args.target_passing, test_case)
+
+
+class EarlyStopLog:
+    """per-item early stopping records of the runs (<run>/early_stop.csv) and the calls saved in this process"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # output_dir -> [planned calls, saved calls]
+        self.totals: Dict[str, List[int]] = {}
+
+    def record(self, output_dir: str, src_id: str, stats: Dict):
+        path = os.path.join(output_dir, 'early_stop.csv')
+        with self.lock:
+            totals = self.totals.setdefault(output_dir, [0, 0])
+            totals[0] += stats['planned']
+            totals[1] += stats['saved']
+            new_file = not os.path.exists(path)
+            with open(path, 'a', newline='') as f:
+                writer = csv.writer(f)
+                if new_file:
+                    writer.writerow(LOG_FIELDS)
+                writer.writerow([src_id] + [stats[field] for field in LOG_FIELDS[1:]])
+
+    def summary(self, output_dir: str) -> Optional[str]:
+        """the saved calls of the run in this process (None if no item of the run was sampled adaptively)"""
+        with self.lock:
+            if output_dir not in self.totals:
+                return None
+            planned, saved = self.totals[output_dir]
+        return f"early stopping saved {saved} of {planned} LLM calls ({saved / planned * 100 if planned else 0.0:.1f}%)"
+
+
+_early_stop_log = EarlyStopLog()
+
+
+def get_early_stop_log() -> EarlyStopLog:
+    """the process-wide early stopping log"""
+    return _early_stop_log
@@ -0,0 +1,305 @@
+"""
+Pool of LLM backend endpoints (Ollama servers) used by the inference runner.
+
+- dispatch: least-outstanding-requests balancing across the healthy backends
+- health checks: a backend is marked unhealthy after consecutive failures and
+  re-checked (Client.list) after `health_check_interval` seconds
+- failover: a failed request is retried on the next best backend
+- waiting: when no backend is healthy, a request re-checks them and waits for one to
+  recover (up to `max_wait` seconds) instead of failing without contacting any server
+- affinity: requests with the same affinity key (the src_id of an item, set for a
+  thread with `item_affinity`) go to the backend that served the previous one while it
+  is healthy, so the samples of an item reuse that server's prompt prefix cache
+  (--prompt_layout prefix_cache)
+
+BackendPool exposes the same `chat` method as ollama.Client, so it can be passed
+wherever a client is expected (call_LLM, generate_prompt, process_item).
+
+The module also provides per-item output locks (flock on '<output_file>.lock'), so
+several workers (threads or processes) sharing an output directory never process the
+same src_id twice.
+"""
+import os
+import time
+import fcntl
+import socket
+import logging
+import threading
+import contextlib
+from collections import OrderedDict
+from typing import List, Optional
+
+from ollama import Client
+
+import sys
+sys.path.append('.')
+from inference_module.tracing import get_tracer, current_span
+
+logger = logging.getLogger(__name__)
+
+# affinity keys remembered by a pool (least recently used ones are forgotten first)
+MAX_AFFINITY_KEYS = 4096
+
+
+def normalize_host(host: str) -> str:
+    """accept 'port', 'host:port' or full URLs"""
+    host = host.strip()
+    if host.isdigit():
+        host = f"localhost:{host}"
+    if not host.startswith(('http://', 'https://')):
+        host = f"http://{host}"
+    return host
+
+
+class Backend:
+    def __init__(self, host: str, client):
+        self.host = host
+        self.client = client
+        self.outstanding = 0
+        self.healthy = True
+        self.consecutive_failures = 0
+        self.unhealthy_since = 0.0
+        self.completed = 0
+
+
+class BackendPool:
+    def __init__(self, hosts: List[str], health_check_interval: float = 30.0, max_failures: int = 2, client_factory=Client, keep_alive=None,
+                 max_wait: float = 600.0):
+        """
+        Args:
+            hosts: backend addresses ('11434', 'gpu1:11434' or 'http://gpu1:11434')
+            health_check_interval: seconds before an unhealthy backend is checked again
+            max_failures: consecutive failures before a backend is marked unhealthy
+            keep_alive: Ollama keep_alive sent with every request (e.g. '30m' keeps the model resident)
+            max_wait: seconds a request waits for an unhealthy backend to recover when none is healthy
+        """
+        if not hosts:
+            raise ValueError("at least one backend host is required")
+        self.backends = [Backend(normalize_host(h), client_factory(host=normalize_host(h))) for h in hosts]
+        self.health_check_interval = health_check_interval
+        self.max_failures = max_failures
+        self.keep_alive = keep_alive
+        self.max_wait = max_wait
+        self.lock = threading.Lock()
+        # model -> [number of loads, total load seconds] reported by the servers (load_duration)
+        self.load_stats = {}
+        # affinity key -> backend that served its last request
+        self.affinity = OrderedDict()
+        # affinity key of the requests of the current thread (item_affinity)
+        self._local = threading.local()
+
+    def check_health(self, backend: Backend) -> bool:
+        """ping the backend (list the local models) and update its health state"""
+        try:
+            backend.client.list()
+        except Exception as e:
+            logger.warning(f"backend {backend.host} failed the health check: {e}")
+            with self.lock:
+                backend.healthy = False
+                backend.unhealthy_since = time.time()
+            return False
+        with self.lock:
+            backend.healthy = True
+            backend.consecutive_failures = 0
+        return True
+
+    def check_all(self) -> int:
+        """check every backend and return the number of healthy ones"""
+        return sum(self.check_health(b) for b in self.backends)
+
+    def _recheck_unhealthy(self):
+        now = time.time()
+        for backend in self.backends:
+            if not backend.healthy and now - backend.unhealthy_since >= self.health_check_interval:
+                if self.check_health(backend):
+                    logger.info(f"backend {backend.host} is healthy again")
+
+    def _wait_for_backend(self) -> bool:
+        """
+        re-check the unhealthy backends right away, then at every health check interval,
+        until one is healthy (True) or max_wait has passed (False)
+        """
+        deadline = time.time() + self.max_wait
+        while True:
+            if any([self.check_health(b) for b in self.backends if not b.healthy]) or any(b.healthy for b in self.backends):
+                return True
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            logger.warning(f"no healthy backend, checking again in {min(self.health_check_interval, remaining):.0f}s")
+            time.sleep(min(self.health_check_interval, remaining))
+
+    def _acquire(self, exclude, affinity=None) -> Optional[Backend]:
+        """select the backend of the affinity key if it is healthy, else the healthy backend with the least outstanding requests"""
+        self._recheck_unhealthy()
+        with self.lock:
+            candidates = [b for b in self.backends if b.healthy and b not in exclude]
+            if not candidates:
+                return None
+            backend = self.affinity.get(affinity) if affinity is not None else None
+            if backend not in candidates:
+                backend = min(candidates, key=lambda b: b.outstanding)
+            backend.outstanding += 1
+            return backend
+
+    def _remember(self, affinity, backend: Backend):
+        with self.lock:
+            self.affinity[affinity] = backend
+            self.affinity.move_to_end(affinity)
+            if len(self.affinity) > MAX_AFFINITY_KEYS:
+                self.affinity.popitem(last=False)
+
+    def _release(self, backend: Backend, success: bool):
+        with self.lock:
+            backend.outstanding -= 1
+            if success:
+                backend.consecutive_failures = 0
+                backend.completed += 1
+                return
+            backend.consecutive_failures += 1
+            if backend.consecutive_failures >= self.max_failures and backend.healthy:
+                backend.healthy = False
+                backend.unhealthy_since = time.time()
+                logger.warning(f"backend {backend.host} marked unhealthy after {backend.consecutive_failures} failures")
+
+    def _record_load(self, model, response):
+        # Ollama reports the model load time in nanoseconds
+        try:
+            load_duration = response['load_duration']
+        except (KeyError, TypeError):
+            load_duration = getattr(response, 'load_duration', None)
+        if not load_duration or load_duration < 1e8:  # < 0.1s: the model was already loaded
+            return
+        with self.lock:
+            stats = self.load_stats.setdefault(model, [0, 0.0])
+            stats[0] += 1
+            stats[1] += load_duration / 1e9
+
+    @contextlib.contextmanager
+    def pinned(self, key):
+        """requests of this thread inside the block prefer the backend that served the key's previous request"""
+        previous = getattr(self._local, 'affinity', None)
+        self._local.affinity = key
+        try:
+            yield
+        finally:
+            self._local.affinity = previous
+
+    def chat(self, **kwargs):
+        """same interface as ollama.Client.chat, with balancing, failover and affinity (pinned)"""
+        affinity = getattr(self._local, 'affinity', None)
+        if self.keep_alive is not None:
+            kwargs.setdefault('keep_alive', self.keep_alive)
+        tried = []
+        last_error = None
+        while len(tried) < len(self.backends):
+            backend = self._acquire(exclude=tried, affinity=affinity)
+            if backend is None and not tried and self._wait_for_backend():
+                # every backend was down: wait for one to recover rather than failing the request unsent
+                backend = self._acquire(exclude=tried, affinity=affinity)
+            if backend is None:
+                break
+            tried.append(backend)
+            try:
+                response = backend.client.chat(**kwargs)
+            except Exception as e:
+                last_error = e
+                self._release(backend, success=False)
+                get_tracer().count('eco_backend_requests_total', backend=backend.host, result='error')
+                logger.warning(f"request to {backend.host} failed, failing over: {e}")
+                continue
+            self._release(backend, success=True)
+            if affinity is not None:
+                self._remember(affinity, backend)
+            get_tracer().count('eco_backend_requests_total', backend=backend.host, result='ok')
+            current_span().set(backend=backend.host, attempts=len(tried))
+            self._record_load(kwargs.get('model'), response)
+            return response
+
+        if not tried:
+            raise RuntimeError(f"no healthy backend after waiting {self.max_wait:.0f}s: {self.status()}")
+        raise RuntimeError(f"no backend could serve the request (tried {[b.host for b in tried]}): {last_error}")
+
+    def preload(self, model: str):
+        """load the model on every healthy backend (a chat request without messages only loads the model)"""
+        for backend in self.backends:
+            if backend.healthy:
+                try:
+                    response = backend.client.chat(model=model, messages=[], keep_alive=self.keep_alive)
+                except Exception as e:
+                    logger.warning(f"failed to preload {model} on {backend.host}: {e}")
+                    continue
+                self._record_load(model, response)
+
+    def unload(self, model: str):
+        """unload the model from every healthy backend to free the GPU memory for the next model"""
+        for backend in self.backends:
+            if backend.healthy:
+                try:
+                    backend.client.chat(model=model, messages=[], keep_alive=0)
+                except Exception as e:
+                    logger.warning(f"failed to unload {model} from {backend.host}: {e}")
+
+    def status(self) -> str:
+        with self.lock:
+            return ", ".join(
+                f"{b.host}[{'up' if b.healthy else 'down'}, outstanding={b.outstanding}, completed={b.completed}]"
+                for b in self.backends
+            )
+
+
+def item_affinity(client, key):
+    """context in which the requests of this thread share a backend (BackendPool only; other clients are unaffected)"""
+    if isinstance(client, BackendPool):
+        return client.pinned(key)
+    return contextlib.nullcontext()
+
+
+# output file -> descriptor of its lock file, flock'ed while this process works on the item
+_held_locks = {}
+_held_locks_guard = threading.Lock()
+
+
+def acquire_item_lock(output_file: str) -> bool:
+    """
+    claim an output file by holding an exclusive flock on '<output_file>.lock'.
+    The kernel drops the flock when the owning process dies, so the lock of a crashed
+    worker is taken over atomically by the next claim (no stale-owner check).
+
+    Returns:
+        bool: True if the lock was acquired
+    """
+    lock_file = output_file + '.lock'
+    while True:
+        fd = os.open(lock_file, os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        # the previous owner removes the file before unlocking it: a lock on a removed file is not a claim
+        try:
+            claimed = os.stat(lock_file).st_ino == os.fstat(fd).st_ino
+        except FileNotFoundError:
+            claimed = False
+        if claimed:
+            break
+        os.close(fd)
+    os.ftruncate(fd, 0)
+    os.write(fd, f"{socket.gethostname()}:{os.getpid()}".encode())
+    with _held_locks_guard:
+        _held_locks[output_file] = fd
+    return True
+
+
+def release_item_lock(output_file: str):
+    with _held_locks_guard:
+        fd = _held_locks.pop(output_file, None)
+    if fd is None:
+        return
+    # remove the file while still holding the flock, then unlock it by closing the descriptor
+    try:
+        os.remove(output_file + '.lock')
+    except FileNotFoundError:
+        pass
+    os.close(fd)
@@ -0,0 +1,271 @@
+"""
+Deterministic speedup metric based on retired instruction counts.
+
+HQ_data speedups are measured in gem5 cycles, while wall-clock timing of the
+generated code depends on the machine and its load. This module compiles each
+solution, runs it on the problem's test cases and counts the retired
+(user-space) instructions, so that speedups are reproducible across machines.
+
+Supported backends:
+- perf: hardware counters through `perf stat -e instructions:u` (perf_event)
+- valgrind: userspace instrumentation through `valgrind --tool=callgrind`
+  (used as a fallback when perf counters are unavailable, e.g. in containers)
+
+The wall-clock time of every run is reported next to the instruction counts.
+"""
+import os
+import re
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import subprocess
+from typing import Dict, List, Optional
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+BACKENDS = ['auto', 'perf', 'valgrind']
+COMPILE_FLAGS = ['-std=c++17', '-O3']
+
+_CALLGRIND_PATTERN = re.compile(r"Collected\s*:\s*(\d+)")
+
+
+def _perf_available() -> bool:
+    """check if perf can read the user-space instruction counter"""
+    if shutil.which('perf') is None:
+        return False
+    try:
+        proc = subprocess.run(
+            ['perf', 'stat', '-x,', '-e', 'instructions:u', 'true'],
+            capture_output=True, text=True, timeout=10
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+    return _parse_perf_output(proc.stderr) is not None
+
+
+def detect_backend(preferred: str = 'auto') -> Optional[str]:
+    """return the instruction counting backend to use, or None if the preferred one (any one for 'auto') is not available"""
+    if preferred in ('perf', 'auto') and _perf_available():
+        return 'perf'
+    if preferred in ('valgrind', 'auto') and shutil.which('valgrind') is not None:
+        return 'valgrind'
+    return None
+
+
+def _parse_perf_output(text: str) -> Optional[int]:
+    """parse the CSV output of `perf stat -x,` (e.g. '123456,,instructions:u,...')"""
+    for line in text.splitlines():
+        fields = line.split(',')
+        if len(fields) > 2 and fields[2].startswith('instructions') and fields[0].strip().isdigit():
+            return int(fields[0])
+    return None
+
+
+def _parse_callgrind_output(text: str) -> Optional[int]:
+    """parse the 'Collected : N' summary line printed by callgrind"""
+    match = _CALLGRIND_PATTERN.search(text)
+    return int(match.group(1)) if match else None
+
+
+def compile_source(code: str, work_dir: str, name: str, compiler: str = 'g++', flags: List[str] = COMPILE_FLAGS,
+                   timeout: float = 60.0) -> Optional[str]:
+    """compile the C++ source code and return the binary path (None if compilation fails or exceeds timeout seconds)"""
+    src_path = os.path.join(work_dir, f"{name}.cpp")
+    bin_path = os.path.join(work_dir, name)
+    with open(src_path, 'w', encoding='utf-8') as f:
+        f.write(code)
+
+    try:
+        proc = subprocess.run(
+            [compiler, *flags, src_path, '-o', bin_path],
+            capture_output=True, text=True, timeout=timeout
+        )
+    except subprocess.TimeoutExpired:
+        logger.info(f"compilation of {name} timed out after {timeout:g}s")
+        return None
+    if proc.returncode != 0:
+        logger.info(f"compilation failed for {name}: {proc.stderr[:200]}")
+        return None
+    return bin_path
+
+
+def count_instructions(binary: str, input_path: str, backend: str, timeout: float = 10.0) -> Dict:
+    """
+    run the binary on the input file and count the retired instructions.
+
+    Returns:
+        dict: instructions (None on failure), wall_time, stdout, returncode
+    """
+    if backend == 'perf':
+        cmd = ['perf', 'stat', '-x,', '-e', 'instructions:u', '--', binary]
+    elif backend == 'valgrind':
+        cmd = ['valgrind', '--tool=callgrind', '--callgrind-out-file=/dev/null', binary]
+    else:
+        raise ValueError(f"unsupported backend: {backend}")
+
+    with open(input_path, 'r') as stdin:
+        start_time = time.perf_counter()
+        try:
+            proc = subprocess.run(cmd, stdin=stdin, capture_output=True, text=True, errors='replace', timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return {'instructions': None, 'wall_time': timeout, 'stdout': '', 'returncode': None}
+        wall_time = time.perf_counter() - start_time
+
+    if backend == 'perf':
+        instructions = _parse_perf_output(proc.stderr)
+    else:
+        instructions = _parse_callgrind_output(proc.stderr)
+
+    return {
+        'instructions': instructions,
+        'wall_time': wall_time,
+        'stdout': proc.stdout,
+        'returncode': proc.returncode
+    }
+
+
+def load_test_cases(test_cases_dir: str, problem_id: str) -> List[tuple]:
+    """return the (input_path, output_path) pairs of the problem ('input.{i}.txt', 'output.{i}.txt')"""
+    problem_dir = os.path.join(test_cases_dir, problem_id)
+    if not os.path.isdir(problem_dir):
+        return []
+
+    test_cases = []
+    for file_name in sorted(os.listdir(problem_dir)):
+        match = re.fullmatch(r"input\.(\d+)\.txt", file_name)
+        if match:
+            output_path = os.path.join(problem_dir, f"output.{match.group(1)}.txt")
+            if os.path.exists(output_path):
+                test_cases.append((int(match.group(1)), os.path.join(problem_dir, file_name), output_path))
+    return [(inp, out) for _, inp, out in sorted(test_cases)]
+
+
+def outputs_match(actual: str, expected: str) -> bool:
+    """compare the outputs ignoring whitespace differences"""
+    return actual.split() == expected.split()
+
+
+def evaluate_solution(code: str, test_cases: List[tuple], backend: str, work_dir: str, name: str, timeout: float = 10.0) -> Dict:
+    """
+    compile the solution and measure it on all test cases.
+
+    Returns:
+        dict: compiled, accepted, instructions (sum over test cases), wall_time (sum over test cases)
+    """
+    binary = compile_source(code, work_dir, name)
+    if binary is None:
+        return {'compiled': False, 'accepted': False, 'instructions': None, 'wall_time': None}
+
+    total_instructions, total_wall_time, accepted = 0, 0.0, True
+    for input_path, output_path in test_cases:
+        run = count_instructions(binary, input_path, backend, timeout)
+        with open(output_path, 'r') as f:
+            expected = f.read()
+
+        if run['returncode'] != 0 or run['instructions'] is None or not outputs_match(run['stdout'], expected):
+            accepted = False
+            break
+        total_instructions += run['instructions']
+        total_wall_time += run['wall_time']
+
+    return {
+        'compiled': True,
+        'accepted': accepted,
+        'instructions': total_instructions if accepted else None,
+        'wall_time': total_wall_time if accepted else None
+    }
+
+
+def _speedup(reference, candidate):
+    if reference is None or not candidate:
+        return None
+    return reference / candidate
+
+
+def evaluate_results(results_file: str, test_cases_dir: str, output_file: str, backend: str = 'auto', timeout: float = 10.0) -> int:
+    """
+    measure the instruction-count and wall-clock speedups of the formatted results.
+
+    Args:
+        results_file: the formatted results (sampled_results.jsonl from output_format.py)
+        test_cases_dir: the test case directory of the dataset (e.g. PIE_test_cases, codeforce_test_cases)
+        output_file: the JSONL file to write the per-solution metrics to
+        backend: the instruction counting backend ('auto', 'perf' or 'valgrind')
+
+    Returns:
+        int: the number of evaluated items
+    """
+    resolved_backend = detect_backend(backend)
+    if resolved_backend is None:
+        if backend == 'auto':
+            raise RuntimeError("no instruction counting backend available (install perf or valgrind)")
+        raise RuntimeError(f"instruction counting backend {backend} is not available (not installed, or perf_event access is restricted)")
+    logger.info(f"instruction counting backend: {resolved_backend}")
+
+    n_items = 0
+    with open(results_file, 'r', encoding='utf-8') as fin, open(output_file, 'w', encoding='utf-8') as fout:
+        for line in fin:
+            item = json.loads(line)
+            test_cases = load_test_cases(test_cases_dir, item['problem_id'])
+            if not test_cases:
+                logger.warning(f"no test cases found for {item['src_id']} ({item['problem_id']})")
+                continue
+
+            with tempfile.TemporaryDirectory() as work_dir:
+                reference = evaluate_solution(item['src_code'], test_cases, resolved_backend, work_dir, 'src', timeout)
+
+                solutions = []
+                for sample_idx, code in enumerate(item['generated_answers']):
+                    measured = evaluate_solution(code, test_cases, resolved_backend, work_dir, f"gen_{sample_idx}", timeout)
+                    measured['sample_id'] = sample_idx + 1
+                    measured['instruction_speedup'] = _speedup(reference['instructions'], measured['instructions'])
+                    measured['wall_time_speedup'] = _speedup(reference['wall_time'], measured['wall_time'])
+                    solutions.append(measured)
+
+            instruction_speedups = [s['instruction_speedup'] for s in solutions if s['instruction_speedup'] is not None]
+            wall_time_speedups = [s['wall_time_speedup'] for s in solutions if s['wall_time_speedup'] is not None]
+            record = {
+                'src_id': item['src_id'],
+                'problem_id': item['problem_id'],
+                'backend': resolved_backend,
+                'src_instructions': reference['instructions'],
+                'src_wall_time': reference['wall_time'],
+                'solutions': solutions,
+                'best_instruction_speedup': max(instruction_speedups, default=None),
+                'best_wall_time_speedup': max(wall_time_speedups, default=None)
+            }
+            fout.write(json.dumps(record, ensure_ascii=False) + '\n')
+            fout.flush()
+
+            n_items += 1
+            logger.info(f"{item['src_id']}: best instruction speedup {record['best_instruction_speedup']}, best wall-time speedup {record['best_wall_time_speedup']}")
+
+    logger.info(f"Evaluation complete: {n_items} items saved to {output_file}")
+    return n_items
+
+
+def main():
+    # python3 inference_module/instruction_count.py \
+    #     --results_file results/inference_results/PIE/hybrid/qwen2.5-coder_7b_greedy/sampled_results.jsonl \
+    #     --test_cases_dir BRIDGE_data/PIE_test_cases \
+    #     --output_file results/inference_results/PIE/hybrid/qwen2.5-coder_7b_greedy/instruction_counts.jsonl
+    parser = argparse.ArgumentParser(description='instruction-count based speedup evaluation')
+    parser.add_argument('--results_file', type=str, required=True, help='formatted results file (sampled_results.jsonl)')
+    parser.add_argument('--test_cases_dir', type=str, required=True, help='test case directory (e.g. BRIDGE_data/PIE_test_cases)')
+    parser.add_argument('--output_file', type=str, required=True, help='output JSONL file for the per-solution metrics')
+    parser.add_argument('--backend', type=str, choices=BACKENDS, default='auto', help='instruction counting backend')
+    parser.add_argument('--timeout', type=float, default=10.0, help='timeout per test case run (seconds)')
+
+    args = parser.parse_args()
+    evaluate_results(args.results_file, args.test_cases_dir, args.output_file, args.backend, args.timeout)
+
+
+if __name__ == "__main__":
+    main()
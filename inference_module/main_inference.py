@@ -4,18 +4,24 @@ import random
 import json
 import os
 from datetime import datetime
-from ollama import Client
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import argparse
 from transformers import AutoTokenizer
 
 # import the modules
 sys.path.append('.')
-from inference_module.utils import get_prompt_template
+from inference_module.utils import get_prompt_template, PROMPT_LAYOUTS
 from detection_module_rule_based.prompt_utils import generate_rule_prompt
-from detection_module_LLM_based.prompt import generate_LLM_prompt, generate_basic_retrieval_prompt, generate_retrieval_prompt, generate_random_retrieval_prompt, load_code_pair, load_distilled_data
-from detection_module_LLM_based.vector_store import DiskBackedVectorStore
-from detection_module_LLM_based.embedding_processor import EmbeddingProcessor
+from detection_module_LLM_based.prompt import generate_LLM_prompt, generate_basic_retrieval_prompt, generate_retrieval_prompt, generate_random_retrieval_prompt, generate_diverse_retrieval_prompts
+from detection_module_LLM_based.code_fingerprint import code_fingerprint
+from inference_module.retrieval_resources import get_shared_resources, STRATEGY_COMPONENTS, CODE_STORES
+from inference_module.backend_pool import BackendPool, acquire_item_lock, release_item_lock, item_affinity
+from inference_module.run_manifest import RunManifest, parse_shard, shard_of
+from inference_module.profiling import stage
+from inference_module.tracing import get_tracer, current_span
+from inference_module.result_store import get_result_store
+from inference_module.adaptive_sampling import EARLY_STOP_CRITERIA, create_sampler, get_early_stop_log
 
 # list of supported prompt strategies
 PROMPT_STRATEGIES = [
@@ -31,10 +37,8 @@ PROMPT_STRATEGIES = [
     "retrieve_random_strategy"
 ]
 
-RAG_STORE_PATH_CODE      = "./BRIDGE_data/rag_store/hq_snippet"
-RAG_STORE_PATH_STRATEGE  = "./BRIDGE_data/rag_store/distilled_deepseek"
-EMBEDDER_MODEL_NAME = "Qodo/Qodo-Embed-1-1.5B"
-TRAIN_DATA_PATH = './BRIDGE_data/HQ_data.jsonl'
+# strategies whose k_sample retrieval can draw a diverse example set per sample (--diverse_retrieval)
+DIVERSE_STRATEGIES = ["retrieve_basic", "retrieve_LLM_codesim"]
 
 
 # logging setup
@@ -61,44 +65,31 @@ def call_LLM(client, model, prompt, temperature=0, system_prompt=None):
         messages.append({'role': 'system', 'content': system_prompt})
     messages.append({'role': 'user', 'content': prompt})
 
-    response = client.chat(
-        model=model,
-        messages=messages,
-        options = {
-            "temperature": temperature,
-            "num_ctx": 8192  # set the context length to 4096
-        }
-    )
+    with stage('llm_call') as span:
+        response = client.chat(
+            model=model,
+            messages=messages,
+            options = {
+                "temperature": temperature,
+                "num_ctx": 8192  # set the context length to 4096
+            }
+        )
+        # token counts and server-side durations (nanoseconds) reported by Ollama
+        prompt_tokens = getattr(response, 'prompt_eval_count', None)
+        completion_tokens = getattr(response, 'eval_count', None)
+        span.set(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            **{f"{name}_seconds": getattr(response, f"{name}_duration", None) / 1e9
+               for name in ('load', 'prompt_eval', 'eval') if getattr(response, f"{name}_duration", None)}
+        )
+        get_tracer().count('eco_llm_tokens_total', prompt_tokens or 0, kind='prompt')
+        get_tracer().count('eco_llm_tokens_total', completion_tokens or 0, kind='completion')
     return response
 
 def setup_retrieval_resources(prompt_strategy):
-    """function to setup the resources needed for the retrieval-based prompt"""
-    if prompt_strategy == 'retrieve_basic' or prompt_strategy == 'retrieve_LLM_codesim' or prompt_strategy == 'retrieve_random_strategy':
-        store = DiskBackedVectorStore(RAG_STORE_PATH_CODE, model_name=EMBEDDER_MODEL_NAME)
-        embedder = EmbeddingProcessor(model_name=EMBEDDER_MODEL_NAME)
-        code_pair = load_code_pair(TRAIN_DATA_PATH)
-        distilled_data = load_distilled_data(RAG_STORE_PATH_STRATEGE)
-        logger.info(f"Rag storage: {RAG_STORE_PATH_CODE}, {EMBEDDER_MODEL_NAME}")
-        logger.info(f"Embedder model: {EMBEDDER_MODEL_NAME}")
-    elif prompt_strategy == 'retrieve_LLM_NLsim' or prompt_strategy == 'hybrid' or prompt_strategy == 'hybrid_after_rules':
-        store = DiskBackedVectorStore(RAG_STORE_PATH_STRATEGE, model_name=EMBEDDER_MODEL_NAME)
-        embedder = EmbeddingProcessor(model_name=EMBEDDER_MODEL_NAME)
-        code_pair = load_code_pair(TRAIN_DATA_PATH)
-        distilled_data = load_distilled_data(RAG_STORE_PATH_STRATEGE)
-        logger.info(f"Rag storage: {RAG_STORE_PATH_STRATEGE}, {EMBEDDER_MODEL_NAME}")
-        logger.info(f"Embedder model: {EMBEDDER_MODEL_NAME}")
-    elif prompt_strategy == 'ICL':
-        store = None
-        embedder = None
-        code_pair = load_code_pair(TRAIN_DATA_PATH)
-        logger.info(f"Code pair length: {len(code_pair)}")
-        distilled_data = None
-    else:
-        return None, None, None, None
-    
-    
-    
-    return store, embedder, code_pair, distilled_data
+    """function to setup the resources needed for the retrieval-based prompt (only the components the strategy uses)"""
+    return get_shared_resources().get(prompt_strategy)
 
 def count_tokens(text, model_name):
     """function to count the number of tokens in the text"""
@@ -126,6 +117,7 @@ def trim_retrieved_examples(retrieved_examples, max_tokens, template, args, mode
     
     # tokenize the retrieved_examples
     tokens = _tokenizer.encode(retrieved_examples)
+    current_span().set(base_tokens=base_tokens, example_tokens=len(tokens), trimmed_tokens=max(0, len(tokens) - available_tokens))
     
     if len(tokens) <= available_tokens:
         return retrieved_examples
@@ -145,16 +137,17 @@ def adjust_args_for_max_tokens(args, template, model_name, MAX_TOKENS=4096):
     # only process if retrieved_code_examples is in the arguments
     if 'retrieved_code_examples' in args:
         # use the existing trim_retrieved_examples logic
-        args['retrieved_code_examples'] = trim_retrieved_examples(
-            args['retrieved_code_examples'],
-            MAX_TOKENS,
-            template,
-            args,
-            model_name
-        )
+        with stage('token_trim'):
+            args['retrieved_code_examples'] = trim_retrieved_examples(
+                args['retrieved_code_examples'],
+                MAX_TOKENS,
+                template,
+                args,
+                model_name
+            )
     return args
 
-def generate_prompt(item, prompt_strategy, sampling='greedy', sample_count=1, store=None, embedder=None, code_pair=None, distilled_data=None, client=None, temperature=None, model_name=None):
+def generate_prompt(item, prompt_strategy, sampling='greedy', sample_count=1, store=None, embedder=None, code_pair=None, distilled_data=None, near_duplicates=None, client=None, temperature=None, model_name=None, prompt_layout='default', diverse_retrieval=False):
     """function to generate the prompt based on the prompt strategy
     
     Args:
@@ -166,6 +159,9 @@ def generate_prompt(item, prompt_strategy, sampling='greedy', sample_count=1, st
         embedder: the embedding processor object
         code_pair: the code pair data
         distilled_data: the code analysis data
+        near_duplicates: MinHash index of the training slow codes (drops near-duplicate retrieved examples)
+        prompt_layout: 'default' or 'prefix_cache' (the content shared by the samples first, see utils.PROMPT_LAYOUTS)
+        diverse_retrieval: k_sample with DIVERSE_STRATEGIES: retrieve a different example set per sample in one search (MMR)
     Returns:
         prompts_list: the list of prompts [(prompt, prompt_after_immediate_response), ...]
     """
@@ -180,19 +176,20 @@ def generate_prompt(item, prompt_strategy, sampling='greedy', sample_count=1, st
     if prompt_strategy in ['base', 'rules', 'CoT']:
         if prompt_strategy == 'base':
             args = {'src_code': src_code}
-            template = get_prompt_template(prompt_strategy)
+            template = get_prompt_template(prompt_strategy, prompt_layout)
             args = adjust_args_for_max_tokens(args, template, model_name)
             
         elif prompt_strategy == 'rules':
-            detect_prompts = generate_rule_prompt(code_id=code_id, categories=categories)
+            with stage('rule_prompt'):
+                detect_prompts = generate_rule_prompt(code_id=code_id, categories=categories)
             logger.info(f"detect_prompts: {detect_prompts}")
             args = {'src_code': src_code, 'detect_prompts': detect_prompts}
-            template = get_prompt_template('rules')
+            template = get_prompt_template('rules', prompt_layout)
             args = adjust_args_for_max_tokens(args, template, model_name)
         
         elif prompt_strategy == 'CoT':
             args = {'src_code': src_code}
-            template = get_prompt_template(prompt_strategy)
+            template = get_prompt_template(prompt_strategy, prompt_layout)
             args = adjust_args_for_max_tokens(args, template, model_name)
         
         
@@ -217,7 +214,7 @@ def generate_prompt(item, prompt_strategy, sampling='greedy', sample_count=1, st
                 retrieved_code_examples += part
             
             args = {'src_code': src_code, 'retrieved_code_examples': retrieved_code_examples}
-            template = get_prompt_template(prompt_strategy)
+            template = get_prompt_template(prompt_strategy, prompt_layout)
             args = adjust_args_for_max_tokens(args, template, model_name)
             prompt = template['prompt'].format(**args)
 
@@ -230,87 +227,112 @@ def generate_prompt(item, prompt_strategy, sampling='greedy', sample_count=1, st
 
     # retrieval-based strategies can generate various prompts based on the sampling method
     elif prompt_strategy in ['retrieve_basic', 'retrieve_LLM_codesim', 'retrieve_LLM_NLsim', 'retrieve_random_strategy']:
-        # set the diversity parameter (higher diversity for k_sample)
-        # diversity_factor = 0.7 if sampling == 'k_sample' else 0.0
-        
-        for _ in range(sample_count):
+        # code queries are the same for every sample, so with diverse_retrieval k_sample retrieves sample_count diverse
+        # example sets in one search (the diverse search needs the query embedding, lexical retrieval runs one search per sample)
+        diverse_examples = None
+        # bottleneck profile of the source code for the store's profile_mode, from the lexical rules as the store
+        # entries (the Joern detection results of the item would not be comparable to them)
+        query_fingerprint = code_fingerprint(src_code) if store is not None and store.profile_mode else None
+        if diverse_retrieval and sampling == 'k_sample' and sample_count > 1 and prompt_strategy in DIVERSE_STRATEGIES and embedder is not None:
             start_time = time.time()
-            
-            if prompt_strategy == 'retrieve_basic':
-                retrieved_code_examples = generate_retrieval_prompt(
+            with stage('search'):
+                diverse_examples = generate_diverse_retrieval_prompts(
                     query=src_code,
-                    query_type='code',
                     store=store,
                     embedder=embedder,
+                    n_sets=sample_count,
                     fewshot_k=2,
                     enable_modes=['full'],
                     code_pair=code_pair,
-                    distill_data=None,
-                    retrieve_additional_info=False,
-                    given_code_analysis=None
-                    # diversity_factor=diversity_factor  # add the diversity parameter
-                )
-            elif prompt_strategy == 'retrieve_LLM_codesim':
-                retrieved_code_examples = generate_retrieval_prompt(
-                    query=src_code,
-                    query_type='code',
-                    store=store,
-                    embedder=embedder,
-                    fewshot_k=2,
-                    enable_modes=['full'],  ## query가 src_code 이므로 full mode로 설정
-                    code_pair=code_pair,
                     distill_data=distilled_data,
-                    retrieve_additional_info=True,
-                    given_code_analysis=None
-                    # diversity_factor=diversity_factor  # add the diversity parameter
+                    retrieve_additional_info=(prompt_strategy == 'retrieve_LLM_codesim'),
+                    near_duplicates=near_duplicates,
+                    query_fingerprint=query_fingerprint
                 )
-
-            elif prompt_strategy == 'retrieve_LLM_NLsim':
+            logger.info(f"diverse code example search time: {time.time() - start_time:.2f}s ({sample_count} sets)")
+        
+        for sample_idx in range(sample_count):
+            start_time = time.time()
+            
+            with stage('search'):
+                if diverse_examples is not None:
+                    retrieved_code_examples = diverse_examples[sample_idx]
+                elif prompt_strategy == 'retrieve_basic':
+                    retrieved_code_examples = generate_retrieval_prompt(
+                        query=src_code,
+                        query_type='code',
+                        store=store,
+                        embedder=embedder,
+                        fewshot_k=2,
+                        enable_modes=['full'],
+                        code_pair=code_pair,
+                        distill_data=None,
+                        retrieve_additional_info=False,
+                        given_code_analysis=None,
+                        near_duplicates=near_duplicates,
+                        query_fingerprint=query_fingerprint
+                        # diversity_factor=diversity_factor  # add the diversity parameter
+                    )
+                elif prompt_strategy == 'retrieve_LLM_codesim':
+                    retrieved_code_examples = generate_retrieval_prompt(
+                        query=src_code,
+                        query_type='code',
+                        store=store,
+                        embedder=embedder,
+                        fewshot_k=2,
+                        enable_modes=['full'],  ## query가 src_code 이므로 full mode로 설정
+                        code_pair=code_pair,
+                        distill_data=distilled_data,
+                        retrieve_additional_info=True,
+                        given_code_analysis=None,
+                        near_duplicates=near_duplicates,
+                        query_fingerprint=query_fingerprint
+                        # diversity_factor=diversity_factor  # add the diversity parameter
+                    )
+
+                elif prompt_strategy == 'retrieve_LLM_NLsim':
                 
-                with open('detection_module_LLM_based/get_runtime_bottleneck.txt', 'r') as file:
-                    initial_prompt = file.read()
-                given_code_analysis = call_LLM(client, model_name, prompt=src_code, system_prompt=initial_prompt, temperature=temperature).message.content
-
-                retrieved_code_examples = generate_retrieval_prompt(
-                    query=src_code,
-                    query_type='NL',
-                    store=store,
-                    embedder=embedder,
-                    fewshot_k=2,
-                    enable_modes=['think_tail'],
-                    code_pair=code_pair,
-                    distill_data=distilled_data,
-                    retrieve_additional_info=True,
-                    given_code_analysis=given_code_analysis
-                    # diversity_factor=diversity_factor  # add the diversity parameter
-                )
-            elif prompt_strategy == 'retrieve_random_strategy':
-                retrieved_code_examples = generate_random_retrieval_prompt(
-                    fewshot_k=2,
-                    code_pair=code_pair,
-                    distill_data=distilled_data,
-                    retrieve_additional_info=True,
-                )
+                    with open('detection_module_LLM_based/get_runtime_bottleneck.txt', 'r') as file:
+                        initial_prompt = file.read()
+                    given_code_analysis = call_LLM(client, model_name, prompt=src_code, system_prompt=initial_prompt, temperature=temperature).message.content
+
+                    retrieved_code_examples = generate_retrieval_prompt(
+                        query=src_code,
+                        query_type='NL',
+                        store=store,
+                        embedder=embedder,
+                        fewshot_k=2,
+                        enable_modes=['think_tail'],
+                        code_pair=code_pair,
+                        distill_data=distilled_data,
+                        retrieve_additional_info=True,
+                        given_code_analysis=given_code_analysis,
+                        near_duplicates=near_duplicates
+                        # diversity_factor=diversity_factor  # add the diversity parameter
+                    )
+                elif prompt_strategy == 'retrieve_random_strategy':
+                    retrieved_code_examples = generate_random_retrieval_prompt(
+                        fewshot_k=2,
+                        code_pair=code_pair,
+                        distill_data=distilled_data,
+                        retrieve_additional_info=True,
+                    )
                 
             elapsed_time = time.time() - start_time
             logger.info(f"code example search time: {elapsed_time:.2f}s")
             
             args = {'src_code': src_code, 'retrieved_code_examples': retrieved_code_examples}
-            template = get_prompt_template('retrieve')
+            template = get_prompt_template('retrieve', prompt_layout)
             args = adjust_args_for_max_tokens(args, template, model_name)
             prompt = template['prompt'].format(**args)
             system_prompt = template['system_prompt'] if 'system_prompt' in template else None
             prompts_list.append({'prompt': prompt, 'system_prompt': system_prompt})
-            
-            # # use different seeds for diversity (only for k_sample)
-            # if sampling == 'k_sample':
-            #     # increase diversity by searching different examples in the next iteration
-            #     diversity_factor = min(diversity_factor + 0.1, 0.9)
     
     elif prompt_strategy == 'hybrid':
 
         # which is same as rules prompt
-        detect_prompts = generate_rule_prompt(code_id=code_id, categories=categories)
+        with stage('rule_prompt'):
+            detect_prompts = generate_rule_prompt(code_id=code_id, categories=categories)
         logger.info(f"detect_prompts: {detect_prompts}")
         args = {'src_code': src_code, 'detect_prompts': detect_prompts}
 
@@ -322,25 +344,27 @@ def generate_prompt(item, prompt_strategy, sampling='greedy', sample_count=1, st
                 initial_prompt = file.read()
             
             given_code_analysis = call_LLM(client, model_name, prompt=src_code, system_prompt=initial_prompt, temperature=temperature).message.content
-            retrieved_code_examples = generate_retrieval_prompt(
-                query=src_code,  # use given_code_analysis instead of src_code
-                query_type='NL',
-                store=store,
-                embedder=embedder,
-                fewshot_k=2,
-                enable_modes=['think_tail'],
-                code_pair=code_pair,
-                distill_data=distilled_data,
-                retrieve_additional_info=True,
-                given_code_analysis=given_code_analysis
-                # diversity_factor=diversity_factor  # add the diversity parameter
-            )
+            with stage('search'):
+                retrieved_code_examples = generate_retrieval_prompt(
+                    query=src_code,  # use given_code_analysis instead of src_code
+                    query_type='NL',
+                    store=store,
+                    embedder=embedder,
+                    fewshot_k=2,
+                    enable_modes=['think_tail'],
+                    code_pair=code_pair,
+                    distill_data=distilled_data,
+                    retrieve_additional_info=True,
+                    given_code_analysis=given_code_analysis,
+                    near_duplicates=near_duplicates
+                    # diversity_factor=diversity_factor  # add the diversity parameter
+                )
             elapsed_time = time.time() - start_time
             logger.info(f"code example search time: {elapsed_time:.2f}s")
             args['retrieved_code_examples'] = retrieved_code_examples
 
             # Hybrid prompt
-            template = get_prompt_template('hybrid')
+            template = get_prompt_template('hybrid', prompt_layout)
             args = adjust_args_for_max_tokens(args, template, model_name)
             prompt = template['prompt'].format(**args)
             system_prompt = template['system_prompt'] if 'system_prompt' in template else None
@@ -357,26 +381,28 @@ def generate_prompt(item, prompt_strategy, sampling='greedy', sample_count=1, st
                 initial_prompt = file.read()
             given_code_analysis = call_LLM(client, model_name, prompt=generated_answer, system_prompt=initial_prompt, temperature=temperature).message.content
 
-            retrieved_code_examples = generate_retrieval_prompt(
-                query=src_code, ## It will replaced by given_code_analsyis
-                query_type='NL',
-                store=store,
-                embedder=embedder,
-                fewshot_k=2,
-                enable_modes=['think_tail'],
-                code_pair=code_pair,
-                distill_data=distilled_data,
-                retrieve_additional_info=True,
-                given_code_analysis=given_code_analysis
-                # diversity_factor=diversity_factor  # add the diversity parameter
-            )
+            with stage('search'):
+                retrieved_code_examples = generate_retrieval_prompt(
+                    query=src_code, ## It will replaced by given_code_analsyis
+                    query_type='NL',
+                    store=store,
+                    embedder=embedder,
+                    fewshot_k=2,
+                    enable_modes=['think_tail'],
+                    code_pair=code_pair,
+                    distill_data=distilled_data,
+                    retrieve_additional_info=True,
+                    given_code_analysis=given_code_analysis,
+                    near_duplicates=near_duplicates
+                    # diversity_factor=diversity_factor  # add the diversity parameter
+                )
 
             args = {
                 'src_code': original_src_code,  # the original src code
                 'rules_optimization': generated_answer,  # the rules optimization result
                 'retrieved_code_examples': retrieved_code_examples
             }
-            template = get_prompt_template('hybrid_after_rules')  # use the dedicated template
+            template = get_prompt_template('hybrid_after_rules', prompt_layout)  # use the dedicated template
             args = adjust_args_for_max_tokens(args, template, model_name)
             prompt = template['prompt'].format(**args)
             system_prompt = template['system_prompt'] if 'system_prompt' in template else None
@@ -385,64 +411,171 @@ def generate_prompt(item, prompt_strategy, sampling='greedy', sample_count=1, st
     return prompts_list
 
 
-def process_item(client, item, args, output_dir, retrieval_resources):
+def item_done(args, code_id, output_file):
+    """whether the item already has results (its result file, or a completed item in the result store)"""
+    if args.result_store:
+        return get_result_store(args.result_store).is_done(get_run_name(args), code_id)
+    return os.path.exists(output_file)
+
+
+def process_item(client, item, args, output_dir, retrieval_resources, manifest=None):
     """function to process each data item"""
     code_id = item['src_id']
     
     
     # create the output file path (different based on the sampling method)
+    # (with a result store, only the lock file of the item is created next to it)
     output_file = os.path.join(output_dir, f"{code_id}.jsonl")
     
     # check if the file already exists
-    if os.path.exists(output_file):
-        logger.info(f"File {output_file} already exists. Skipping.")
+    if item_done(args, code_id, output_file):
+        logger.info(f"Results of {code_id} already exist. Skipping.")
+        current_span().set(status='exists')
+        return
+
+    # claim the item so that no other worker processes the same src_id
+    if not acquire_item_lock(output_file):
+        logger.info(f"File {output_file} is being processed by another worker. Skipping.")
+        current_span().set(status='locked')
+        return
+    try:
+        if manifest is None:
+            process_locked_item(client, item, args, output_file, retrieval_resources)
+            return
+
+        # claim the item in the shared run manifest so that no other node processes it
+        run_name = get_run_name(args)
+        if not manifest.claim(run_name, code_id):
+            logger.info(f"{code_id} is completed or claimed by another node in the manifest. Skipping.")
+            current_span().set(status='claimed')
+            return
+        try:
+            process_locked_item(client, item, args, output_file, retrieval_resources)
+        except BaseException:
+            manifest.release(run_name, code_id)
+            raise
+        if item_done(args, code_id, output_file):
+            manifest.complete(run_name, code_id, os.path.abspath(args.result_store or output_file))
+    finally:
+        release_item_lock(output_file)
+
+
+def process_locked_item(client, item, args, output_file, retrieval_resources):
+    """function to generate and save the results of an item claimed by this worker"""
+    # another worker may have finished the item between the existence check and the claim
+    if item_done(args, item['src_id'], output_file):
+        logger.info(f"Results of {item['src_id']} already exist. Skipping.")
+        current_span().set(status='exists')
         return
 
-    # generate the prompt
-    prompts_list = generate_prompt(
-        item, args.prompt_strategy, args.sampling, args.sample_count, *retrieval_resources, client=client, temperature=args.temperature, model_name=args.model_name
-    )
+    # the prompts (analysis calls) and samples of the item prefer one backend, which keeps its prompt prefix cache
+    with item_affinity(client, item['src_id']):
+        # generate the prompt
+        prompts_list = generate_prompt(
+            item, args.prompt_strategy, args.sampling, args.sample_count, *retrieval_resources, client=client, temperature=args.temperature, model_name=args.model_name,
+            prompt_layout=args.prompt_layout, diverse_retrieval=args.diverse_retrieval
+        )
     
 
-    all_results = []  # the list to save all the results
+        all_results = []  # the list to save all the results
+        # with --early_stop, the samples stop once the criterion is met (None: all samples)
+        sampler = create_sampler(args, item, len(prompts_list))
 
-    for sample_idx, dics in enumerate(prompts_list):
-        prompt = dics['prompt']
-        system_prompt = dics['system_prompt']
+        for sample_idx, dics in enumerate(prompts_list):
+            prompt = dics['prompt']
+            system_prompt = dics['system_prompt']
 
-        # call the LLM
-        start_time = time.time()
-        response = call_LLM(client, args.model_name, prompt, args.temperature, system_prompt)
-        elapsed_time = time.time() - start_time
+            # call the LLM
+            start_time = time.time()
+            response = call_LLM(client, args.model_name, prompt, args.temperature, system_prompt)
+            elapsed_time = time.time() - start_time
         
-        # print the result
-        logger.info(f"time for sample {sample_idx+1}: {elapsed_time:.2f}s")
+            # print the result
+            logger.info(f"time for sample {sample_idx+1}: {elapsed_time:.2f}s")
         
-        # save the result
-        result = {
-            "prompt": prompt,
-            "response": response.message.content,
-            "elapsed_time": elapsed_time,
-            "model": args.model_name,
-            "sample_id": sample_idx + 1,
-            "input_length": len(prompt),
-        }
-        all_results.append(result)
-
-    # save all the results to a JSONL file
-    with open(output_file, "w", encoding="utf-8") as f:
-        for result in all_results:
-            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+            # save the result
+            result = {
+                "prompt": prompt,
+                "response": response.message.content,
+                "elapsed_time": elapsed_time,
+                "model": args.model_name,
+                "sample_id": sample_idx + 1,
+                "input_length": len(prompt),
+            }
+            all_results.append(result)
+
+            if sampler is not None:
+                with stage('early_stop'):
+                    sampler.add(result['response'])
+                if sampler.should_stop():
+                    break
+
+    if sampler is not None:
+        stats = sampler.stats()
+        logger.info(f"{item['src_id']}: {stats['calls']}/{stats['planned']} samples ({stats['reason']}, {stats['distinct']} distinct)")
+        get_early_stop_log().record(os.path.dirname(output_file), item['src_id'], stats)
+        current_span().set(llm_calls=stats['calls'], llm_calls_saved=stats['saved'], stop_reason=stats['reason'])
+        get_tracer().count('eco_llm_calls_saved_total', stats['saved'], strategy=args.prompt_strategy)
+
+    if args.result_store:
+        # one transaction per item in the shared result store, prompts deduplicated by hash
+        with stage('write'):
+            get_result_store(args.result_store).write_item(
+                get_run_name(args), item['src_id'], all_results, [dics['system_prompt'] for dics in prompts_list[:len(all_results)]]
+            )
+        logger.info(f"Results of {item['src_id']} saved to {args.result_store}")
+        current_span().set(status='done', samples=len(all_results))
+        return
+
+    # save all the results to a JSONL file (written atomically, since the file's existence marks the item as done)
+    with stage('write'):
+        tmp_file = output_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            for result in all_results:
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+        os.replace(tmp_file, output_file)
     
     logger.info(f"File {output_file} created")
+    current_span().set(status='done', samples=len(all_results))
 
-def create_output_directory(args):
-    """Output directory creation function"""
+def get_run_name(args):
+    """Run name (relative output folder) of the configuration: <dataset>/<strategy>/<model>_<sampling>"""
     model_name = args.model_name.replace(":", "_")
     test_name = args.test_data_path.split("/")[-1].replace("_test.jsonl", "")
     # folder_name = f"{args.prompt_strategy}/{model_name}_{args.sampling}"
-    folder_name = f"{test_name}/{args.prompt_strategy}/{model_name}_{args.sampling}"
-    output_dir = f"results/inference_results/{folder_name}"
+    # non-default retrieval options retrieve other examples, so they are separate runs of the store-based strategies
+    retrieval = ""
+    store_path = STRATEGY_COMPONENTS.get(args.prompt_strategy, (None,))[0]
+    if store_path:
+        options = [
+            getattr(args, 'retrieval_mode', 'dense') if getattr(args, 'retrieval_mode', 'dense') != 'dense' else None,
+            f"dedup{args.dedup_threshold:g}" if getattr(args, 'dedup_threshold', None) is not None else None,
+            f"profile-{args.profile_mode}" if getattr(args, 'profile_mode', None) and store_path in CODE_STORES else None,
+            getattr(args, 'store_quantization', None),
+            f"dim{args.store_reduced_dim}" if getattr(args, 'store_reduced_dim', None) else None,
+            args.embedder_backend if getattr(args, 'embedder_backend', 'torch') != 'torch' else None,
+            'diverse' if getattr(args, 'diverse_retrieval', False) and args.sampling == 'k_sample' and args.prompt_strategy in DIVERSE_STRATEGIES else None
+        ]
+        retrieval = "".join(f"_{option}" for option in options if option)
+    # prompts of another layout are a separate run
+    layout = f"_{args.prompt_layout}" if getattr(args, 'prompt_layout', 'default') != 'default' else ""
+    # as do early-stopped samplings (fewer samples per item), with their non-default stopping settings
+    early_stop = ""
+    if getattr(args, 'early_stop', None) and args.sampling == 'k_sample':
+        settings = [
+            f"min{args.min_samples}" if args.min_samples != 2 else None,
+            f"patience{args.stop_patience}" if args.stop_patience != 2 else None,
+            f"target{args.target_passing}" if args.early_stop == 'passing' and args.target_passing != 1 else None
+        ]
+        early_stop = f"_early_stop_{args.early_stop}" + "".join(f"_{setting}" for setting in settings if setting)
+    return f"{test_name}/{args.prompt_strategy}/{model_name}_{args.sampling}{retrieval}{layout}{early_stop}"
+
+
+def create_output_directory(args):
+    """Output directory creation function"""
+    folder_name = get_run_name(args)
+    output_root = getattr(args, 'output_root', None) or "results/inference_results"
+    output_dir = f"{output_root}/{folder_name}"
     
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
@@ -451,8 +584,7 @@ def create_output_directory(args):
     return output_dir
 
 
-def main():
-    
+def build_parser():
     parser = argparse.ArgumentParser(description='LLM inference for code optimization')
     parser.add_argument('--model_name', type=str, help='model name (e.g. qwen2.5-coder:7b)')
     parser.add_argument('--test_data_path', type=str, help='input data file path (e.g. BRIDGE_data/PIE_test.jsonl)')
@@ -462,68 +594,151 @@ def main():
                         help='sampling method (greedy or k_sample)')
     parser.add_argument('--sample_num', type=int, default=10, help='number of samples to generate')
     parser.add_argument('--port', type=str, help='Ollama server port')
+    parser.add_argument('--hosts', type=str, default=None, help='comma-separated Ollama backends (e.g. gpu1:11434,gpu2:11434); overrides --port')
+    parser.add_argument('--num_workers', type=int, default=1, help='number of items processed concurrently')
+    parser.add_argument('--health_check_interval', type=float, default=30.0, help='seconds before an unhealthy backend is checked again')
+    parser.add_argument('--shard', type=str, default=None, help='process only the i-th of N shards of the data (e.g. 0/4)')
+    parser.add_argument('--manifest', type=str, default=None, help='shared run manifest file recording claimed / completed src_ids')
+    parser.add_argument('--output_root', type=str, default='results/inference_results', help='root directory of the output folders')
+    parser.add_argument('--prompt_layout', type=str, choices=PROMPT_LAYOUTS, default='default',
+                        help='prefix_cache: stable content (instructions, src_code) first and the retrieved examples last, so the server reuses the KV cache across samples')
+    parser.add_argument('--early_stop', type=str, choices=EARLY_STOP_CRITERIA, default=None,
+                        help='k_sample: stop generating samples of an item once no new code appears (distinct) or enough candidates pass a smoke test (passing)')
+    parser.add_argument('--min_samples', type=int, default=2, help='samples generated before early stopping is checked')
+    parser.add_argument('--stop_patience', type=int, default=2, help='consecutive samples without new (normalized) code that stop the sampling')
+    parser.add_argument('--target_passing', type=int, default=1, help='distinct candidates passing the smoke test that stop the sampling (--early_stop passing)')
+    parser.add_argument('--test_cases_dir', type=str, default=None,
+                        help='test cases of the smoke test (first test case of the item\'s problem_id, e.g. BRIDGE_data/PIE_test_cases); compilation only without')
+    parser.add_argument('--result_store', type=str, default=None,
+                        help='save the results in this SQLite result store (result_store.py) instead of one JSONL file per src_id')
+    parser.add_argument('--no_retrieval_cache', action='store_true', help='do not use the persistent cache of retrieval results')
+    parser.add_argument('--store_quantization', type=str, choices=['float16', 'int8', 'pq'], default=None,
+                        help='search a compressed copy of the store vectors and rescore the shortlist with float32')
+    parser.add_argument('--store_reduced_dim', type=int, default=None,
+                        help='two-stage search: shortlist on PCA-reduced vectors of this dimension, rerank with the full vectors')
+    parser.add_argument('--embedder_backend', type=str, choices=['torch', 'onnx-int8'], default='torch',
+                        help='runtime of the query embedding model (onnx-int8: quantized ONNX model on CPU)')
+    parser.add_argument('--embedding_service_url', type=str, default=None,
+                        help='shared embedding service (embedding_service.py) used instead of a local model; default: $EMBEDDING_SERVICE_URL')
+    parser.add_argument('--dedup_threshold', type=float, default=None,
+                        help='drop retrieved examples whose MinHash Jaccard similarity to the query or to another example reaches this value (e.g. 0.8)')
+    parser.add_argument('--retrieval_mode', type=str, choices=['dense', 'hybrid', 'lexical'], default='dense',
+                        help='ranking of the retrieved examples: embeddings, embeddings fused with BM25, or BM25 only (no embedding model)')
+    parser.add_argument('--profile_mode', type=str, choices=['filter', 'boost'], default=None,
+                        help='use the bottleneck profile of code queries (rule categories, loop depth) to pre-filter or boost the retrieved examples')
+    parser.add_argument('--diverse_retrieval', action='store_true',
+                        help='k_sample with retrieve_basic / retrieve_LLM_codesim: a different (MMR) example set per sample from one search')
+    parser.add_argument('--trace_file', type=str, default=None,
+                        help='append a JSONL span per item and stage (strategy, tokens, retrieved ids, similarities, cache hits) to this file')
+    parser.add_argument('--metrics_port', type=int, default=None, help='serve Prometheus metrics of the spans on this port (/metrics)')
     parser.add_argument('--start_half', action='store_true', help='start index')
     parser.add_argument('--start_idx', type=int, help='start index')
+    return parser
 
-    
-    args = parser.parse_args()
-    
-    
+
+def finalize_args(args):
+    """set the derived arguments (sample_count, temperature) from the sampling method"""
     # if the sampling method is not k_sample, set the sample_count to 1
     if args.sampling == 'k_sample':
         args.sample_count = args.sample_num
+    else:
+        args.sample_count = 1
 
     if args.sampling == 'greedy':
         args.temperature = 0.0
     elif args.sampling == 'k_sample':
         args.temperature = 0.7
-    
-    # log the input parameters
-    logger.info(f"model_name: {args.model_name}")
-    logger.info(f"test_data_path: {args.test_data_path}")
-    logger.info(f"prompt_strategy: {args.prompt_strategy}")
-    logger.info(f"sampling: {args.sampling}")
-    logger.info(f"sample_count: {args.sample_count}")
-    logger.info(f"temperature: {args.temperature}")
-    logger.info(f"port: {args.port}")
-    
-    
+    return args
+
+
+def run_inference(args, client, retrieval_resources, manifest=None):
+    """run one (model, dataset, prompt strategy, sampling) configuration with the given client and resources"""
     # create the output directory
     output_dir = create_output_directory(args)
-    
-    # Ollama client initialization
-    client = Client(host=f'http://localhost:{args.port}')
-    
-    # set the resources for the retrieval-based prompt
-    store, embedder, code_pair, distilled_data = setup_retrieval_resources(args.prompt_strategy)
-    retrieval_resources = store, embedder, code_pair, distilled_data
-    
+
     # load the data
-    data = get_data(args.test_data_path)
-    
-    # process each item
-    for idx, item in enumerate(data):
-        if args.start_idx and idx < args.start_idx:
-            continue
+    with stage('data_load'):
+        data = get_data(args.test_data_path)
 
-        if args.start_half and idx < len(data) / 2:
-            continue
+    # shard selection for distributed runs
+    shard = parse_shard(args.shard) if args.shard else None
 
+    def run_item(idx, item):
         logger.info(f"processing item {idx+1}/{len(data)}...")
         try:
-            process_item(client, item, args, output_dir, retrieval_resources)
+            with get_tracer().span('item', src_id=item['src_id'], strategy=args.prompt_strategy, model=args.model_name, sampling=args.sampling,
+                                   prompt_layout=args.prompt_layout):
+                process_item(client, item, args, output_dir, retrieval_resources, manifest)
         except Exception as e:
             logger.error(f"error occurred while processing item {idx+1}: {e}")
+
+    # process each item
+    items = []
+    for idx, item in enumerate(data):
+        if args.start_idx and idx < args.start_idx:
             continue
 
-if __name__ == "__main__":
-    main()
+        if args.start_half and idx < len(data) / 2:
+            continue
 
+        if shard and shard_of(item['src_id'], shard[1]) != shard[0]:
+            continue
 
+        items.append((idx, item))
 
+    if args.num_workers <= 1:
+        for idx, item in items:
+            run_item(idx, item)
+    else:
+        with ThreadPoolExecutor(max_workers=args.num_workers) as executor:
+            for idx, item in items:
+                executor.submit(run_item, idx, item)
 
+    summary = get_early_stop_log().summary(output_dir)
+    if summary:
+        logger.info(summary)
+    return output_dir
 
 
+def main():
     
+    parser = build_parser()
+    args = finalize_args(parser.parse_args())
     
+    # log the input parameters
+    logger.info(f"model_name: {args.model_name}")
+    logger.info(f"test_data_path: {args.test_data_path}")
+    logger.info(f"prompt_strategy: {args.prompt_strategy}")
+    logger.info(f"sampling: {args.sampling}")
+    logger.info(f"sample_count: {args.sample_count}")
+    logger.info(f"temperature: {args.temperature}")
+    logger.info(f"port: {args.port}")
+    logger.info(f"hosts: {args.hosts}")
+    logger.info(f"num_workers: {args.num_workers}")
+    logger.info(f"shard: {args.shard}")
+    logger.info(f"manifest: {args.manifest}")
     
+    # structured traces and metrics of the run
+    if args.trace_file or args.metrics_port:
+        get_tracer().configure(args.trace_file, args.metrics_port)
+
+    # Ollama backend pool initialization (a single localhost backend unless --hosts is given)
+    hosts = args.hosts.split(',') if args.hosts else [args.port]
+    client = BackendPool(hosts, health_check_interval=args.health_check_interval)
+    logger.info(f"healthy backends: {client.check_all()}/{len(hosts)}")
+    
+    # set the resources for the retrieval-based prompt
+    get_shared_resources().configure(args)
+    retrieval_resources = setup_retrieval_resources(args.prompt_strategy)
+    
+    # shared run manifest for distributed runs
+    manifest = RunManifest(args.manifest) if args.manifest else None
+
+    run_inference(args, client, retrieval_resources, manifest)
+
+    logger.info(f"backend status: {client.status()}")
+    for stats in get_shared_resources().cache_stats():
+        logger.info(stats)
+
+if __name__ == "__main__":
+    main()
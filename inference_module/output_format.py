@@ -4,68 +4,166 @@ import pandas as pd
 import glob
 import re
 import sys
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append('.')
+from inference_module.result_store import ResultStore
+
+
+# manifest written next to the formatted output, used to skip unchanged directories in bulk mode
+MANIFEST_NAME = ".format_manifest.json"
+# bump when the extraction logic changes so that bulk mode re-formats every directory
+EXTRACTOR_VERSION = 4
 
 
 class CodeExtractor:
     """Class for extracting code blocks from text"""
-    
+
+    # Opening fence: '```' at the start of a line, or followed by an info string and a line break
+    # (so a '```' quoted inside prose does not open a block); the closing fence is the next '```'
+    _OPEN_FENCE = re.compile(r"^[ \t]*```|```(?=[\w+#.\-]*[ \t]*\r?\n)", re.MULTILINE)
+    _FENCE = "```"
+    # info string (language) of the opening fence: a word on the fence line, or a known language
+    # tag followed by code on the same line (one-line fences such as '```cpp int main(){}```')
+    _FENCE_INFO = re.compile(r"[\w+#.\-]*[ \t]*\r?\n|(?:cpp|c\+\+|cxx|cc|c|python|java)(?![\w+])[ \t]*")
+    _MAIN_DECL = re.compile(r"\b(?:int\s+)?main\s*\(")
+
+    # Single-pass C++ lexer: comments, raw/string/char literals and 'main(' are matched as whole tokens,
+    # so braces inside them are never counted. The leading lookahead lets the regex engine skip
+    # to the next possible token start in C, so the scan is linear in the length of the text.
+    _CPP_TOKENS = re.compile(
+        r"""
+        (?=[/RuUL"'m{}])(?:
+          (?P<comment>//[^\n]*|/\*.*?(?:\*/|\Z))
+        | (?P<raw>(?:u8|[uUL])?R"(?P<delim>[^()\\\s]{0,16})\(.*?(?:\)(?P=delim)"|\Z))
+        | (?P<string>"(?:[^"\\\n]|\\.)*"?)
+        | (?P<char>'(?:[^'\\\n]|\\.){1,10}')
+        | (?P<main>m(?<!\wm)ain\s*\()
+        | (?P<open>\{)
+        | (?P<close>\})
+        )
+        """,
+        re.DOTALL | re.VERBOSE
+    )
+
+    @staticmethod
+    def strip_reasoning(text):
+        """
+        Drop the reasoning part of reasoning-model responses (everything up to the last '</think>')
+        """
+        think_end = text.rfind("</think>")
+        if think_end == -1:
+            return text
+        return text[think_end + len("</think>"):]
+
+    @staticmethod
+    def find_code_blocks(text):
+        """
+        Split the text into fenced code blocks in a single pass.
+
+        Returns:
+            list of (content, complete) tuples in order of appearance; the last block is
+            incomplete (complete=False) when its closing fence is missing
+        """
+        blocks = []
+        pos = 0
+        while True:
+            opening = CodeExtractor._OPEN_FENCE.search(text, pos)
+            if opening is None:
+                break
+            content_start = opening.end()
+            info = CodeExtractor._FENCE_INFO.match(text, content_start)
+            if info:
+                content_start = info.end()
+
+            closing = text.find(CodeExtractor._FENCE, content_start)
+            if closing == -1:
+                blocks.append((text[content_start:].strip(), False))
+                break
+            blocks.append((text[content_start:closing].strip(), True))
+            pos = closing + len(CodeExtractor._FENCE)
+        return blocks
+
     @staticmethod
     def extract_code_from_markdown(text):
         """
-        1) Find the first code block that starts with '```' (including language) and ends with '```'
-        2) Return the content if found, None otherwise
+        1) Find the fenced code blocks ('```' with an optional language) after the reasoning part
+        2) Return the best block: the last complete block containing 'main', then an unterminated
+           block containing 'main', then the longest complete block, then an unterminated block
+        3) Return None if there is no code block
         """
-        pattern = r"```(?:cpp|c|python|java|\w*)\s*(.*?)```"
-        match = re.search(pattern, text, re.DOTALL)
-        if match:
-            return match.group(1).strip()  # Text inside the code block
-        return None
+        return CodeExtractor._best_block(CodeExtractor.find_code_blocks(CodeExtractor.strip_reasoning(text)))
+
+    @staticmethod
+    def _best_block(blocks):
+        """the best non-empty block of find_code_blocks (see extract_code_from_markdown), None if there is none"""
+        blocks = [b for b in blocks if b[0]]
+        if not blocks:
+            return None
+
+        complete = [content for content, is_complete in blocks if is_complete]
+        incomplete = [content for content, is_complete in blocks if not is_complete]
+
+        for content in reversed(complete):
+            if CodeExtractor._MAIN_DECL.search(content):
+                return content
+        for content in incomplete:
+            if CodeExtractor._MAIN_DECL.search(content):
+                return content
+        if complete:
+            return max(complete, key=len)
+        return incomplete[0]
 
     @staticmethod
     def extract_c_style_main_function(text):
         """
-        Extract just the 'main' function block from the given text
+        Extract the text up to the end of the 'main' function block.
+        String/char literals and comments are skipped, so braces inside them are not counted.
         """
-        main_start = re.search(r"\b(?:int\s+)?main\s*\(", text)
-        if not main_start:
-            return text  # Return original if not found
-
         open_braces = 0
-        closing_brace_position = -1
+        main_found = False
         main_function_started = False
 
-        char_pos = main_start.end()
-        while char_pos < len(text):
-            if text[char_pos] == "{":
+        for token in CodeExtractor._CPP_TOKENS.finditer(text):
+            kind = token.lastgroup
+            if kind == 'main':
+                main_found = True
+            elif not main_found:
+                continue
+            elif kind == 'open':
                 open_braces += 1
-                if not main_function_started:
-                    main_function_started = True
-            elif text[char_pos] == "}":
+                main_function_started = True
+            elif kind == 'close' and main_function_started:
                 open_braces -= 1
-                if open_braces == 0 and main_function_started:
-                    closing_brace_position = char_pos
-                    break
-            char_pos += 1
-
-        if closing_brace_position != -1:
-            return text[: closing_brace_position + 1]
-        else:
-            return text
+                if open_braces == 0:
+                    return text[: token.end()]
+
+        return text  # Return original if main or its closing brace is not found
 
     @staticmethod
     def extract_code_or_main_function(text):
         """
-        (1) First, extract the first code block wrapped in ```cpp ... ``` from the LLM response
+        (1) First, extract the best code block wrapped in ```cpp ... ``` from the LLM response
         (2) If code block exists, return it entirely (recommended) or extract just the main function
+        (3) If the answer after the reasoning has neither, use the code blocks inside the reasoning
         """
         code_block = CodeExtractor.extract_code_from_markdown(text)
-        if code_block is None:
-            # fallback: search for main using existing logic
-            return CodeExtractor.extract_c_style_main_function(text)
-        else:
+        if code_block is not None:
             # Return the entire code block (recommended)
             return code_block
 
+        answer = CodeExtractor.strip_reasoning(text)
+        reasoning = text[:len(text) - len(answer)]
+        if reasoning and not CodeExtractor._MAIN_DECL.search(answer):
+            # reasoning-model answers whose only code is inside <think>
+            code_block = CodeExtractor._best_block(CodeExtractor.find_code_blocks(reasoning))
+            if code_block is not None:
+                return code_block
+        # fallback: search for main using the lexer
+        return CodeExtractor.extract_c_style_main_function(answer)
+
 
 class ResultProcessor:
     """Class for processing and formatting inference results"""
@@ -73,9 +171,7 @@ class ResultProcessor:
     @staticmethod
     def process_and_save_results(reference_file_path, input_dir, output_file):
         # Find all prompt_*.json* files
-        result_json_files = []
-        result_json_files += glob.glob(os.path.join(input_dir, "s[0-9]*.json*"))
-        result_json_files += glob.glob(os.path.join(input_dir, "cf_[0-9]*_[0-9]*.json*"))
+        result_json_files = ResultProcessor._find_result_files(input_dir)
 
         # Load reference data file
         reference_df = pd.read_json(reference_file_path, lines=True, orient="records")
@@ -91,78 +187,239 @@ class ResultProcessor:
         
         print(f"Conversion complete: {len(results_data)} files saved to {output_file}")
         return len(results_data)
+
+    @staticmethod
+    def process_directories(dir_pattern, reference_dir, output_name="sampled_results.jsonl", workers=None, force=False):
+        """
+        Format every result directory matching the glob pattern in one run.
+
+        The directories are expected to follow the layout of main_inference.py
+        (results/inference_results/<dataset>/<strategy>/<model>_<sampling>) and the
+        reference file of each directory is <reference_dir>/<dataset>_test.jsonl.
+        Code extraction runs in a process pool over the files of all directories, and
+        each directory is written as soon as its last file is extracted. Directories
+        whose result files are unchanged since the last run (see MANIFEST_NAME) are skipped.
+        """
+        input_dirs = sorted(d for d in glob.glob(dir_pattern) if os.path.isdir(d))
+
+        jobs = []  # (input_dir, result_files, file_stats)
+        for input_dir in input_dirs:
+            result_files = ResultProcessor._find_result_files(input_dir)
+            file_stats = ResultProcessor._stat_files(result_files)
+            output_file = os.path.join(input_dir, output_name)
+            if not force and ResultProcessor._is_up_to_date(input_dir, output_file, file_stats):
+                print(f"Skipping unchanged directory: {input_dir}")
+                continue
+            jobs.append((input_dir, result_files, file_stats))
+
+        if not jobs:
+            print(f"No directories to format for pattern: {dir_pattern}")
+            return 0
+
+        reference_dfs = {}
+        all_files = [file_path for _, result_files, _ in jobs for file_path in result_files]
+        formatted_dirs = 0
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            extracted = executor.map(ResultProcessor._extract_result_from_file, all_files, chunksize=32)
+            for input_dir, result_files, file_stats in jobs:
+                # map() yields in submission order, so the next len(result_files) results belong to this directory
+                results_data = [next(extracted) for _ in result_files]
+
+                dataset = os.path.basename(os.path.dirname(os.path.dirname(os.path.normpath(input_dir))))
+                reference_file_path = os.path.join(reference_dir, f"{dataset}_test.jsonl")
+                if not os.path.exists(reference_file_path):
+                    print(f"Reference file not found for {input_dir}: {reference_file_path}")
+                    continue
+                if reference_file_path not in reference_dfs:
+                    reference_dfs[reference_file_path] = pd.read_json(reference_file_path, lines=True, orient="records")
+
+                output_file = os.path.join(input_dir, output_name)
+                merged_df = ResultProcessor._merge_results_with_reference_data(reference_dfs[reference_file_path], results_data)
+                ResultProcessor._save_results_to_jsonl(merged_df, output_file)
+                ResultProcessor._write_manifest(input_dir, output_file, file_stats)
+
+                formatted_dirs += 1
+                print(f"Conversion complete: {len(results_data)} files saved to {output_file}")
+
+        return formatted_dirs
+
+    @staticmethod
+    def process_result_store(store_path, reference_dir, output_root, run_pattern=None, output_name="sampled_results.jsonl", workers=None):
+        """
+        Format the runs of a result store (result_store.py) without per-item result files.
+
+        Every run <dataset>/<strategy>/<model>_<sampling> matching the glob pattern is
+        written to <output_root>/<run>/<output_name>, merged with the reference file
+        <reference_dir>/<dataset>_test.jsonl. Code extraction runs in a process pool.
+        """
+        if not os.path.exists(store_path):
+            print(f"Result store not found: {store_path}")
+            return 0
+        store = ResultStore(store_path)
+        runs = store.runs(run_pattern)
+        if not runs:
+            print(f"No runs in {store_path} for pattern: {run_pattern}")
+            return 0
+
+        reference_dfs = {}
+        formatted_runs = 0
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for run in runs:
+                reference_file_path = os.path.join(reference_dir, f"{run.split('/')[0]}_test.jsonl")
+                if not os.path.exists(reference_file_path):
+                    print(f"Reference file not found for {run}: {reference_file_path}")
+                    continue
+                if reference_file_path not in reference_dfs:
+                    reference_dfs[reference_file_path] = pd.read_json(reference_file_path, lines=True, orient="records")
+
+                results_data = list(executor.map(ResultProcessor._extract_result_from_responses, store.responses(run).items(), chunksize=32))
+                output_dir = os.path.join(output_root, run)
+                os.makedirs(output_dir, exist_ok=True)
+                output_file = os.path.join(output_dir, output_name)
+                merged_df = ResultProcessor._merge_results_with_reference_data(reference_dfs[reference_file_path], results_data)
+                ResultProcessor._save_results_to_jsonl(merged_df, output_file)
+
+                formatted_runs += 1
+                print(f"Conversion complete: {len(results_data)} items of {run} saved to {output_file}")
+
+        store.close()
+        return formatted_runs
+
+    @staticmethod
+    def _find_result_files(input_dir):
+        result_json_files = []
+        result_json_files += glob.glob(os.path.join(input_dir, "s[0-9]*.json*"))
+        result_json_files += glob.glob(os.path.join(input_dir, "cf_[0-9]*_[0-9]*.json*"))
+        # skip in-progress files of running workers ({src_id}.jsonl.lock / {src_id}.jsonl.tmp)
+        return sorted(f for f in result_json_files if f.endswith(('.json', '.jsonl')))
+
+    @staticmethod
+    def _stat_files(file_paths):
+        # mtime/size fingerprint of the result files, used to detect unchanged directories
+        file_stats = {}
+        for file_path in file_paths:
+            stat = os.stat(file_path)
+            file_stats[os.path.basename(file_path)] = [stat.st_mtime_ns, stat.st_size]
+        return file_stats
+
+    @staticmethod
+    def _hash_file(file_path):
+        sha = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+        return sha.hexdigest()
+
+    @staticmethod
+    def _is_up_to_date(input_dir, output_file, file_stats):
+        manifest_path = os.path.join(input_dir, MANIFEST_NAME)
+        if not os.path.exists(manifest_path) or not os.path.exists(output_file):
+            return False
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        if manifest.get("extractor_version") != EXTRACTOR_VERSION or manifest.get("inputs") != file_stats:
+            return False
+        # the output must not have been modified or replaced after the last run
+        return manifest.get("output_sha256") == ResultProcessor._hash_file(output_file)
+
+    @staticmethod
+    def _write_manifest(input_dir, output_file, file_stats):
+        manifest = {
+            "extractor_version": EXTRACTOR_VERSION,
+            "inputs": file_stats,
+            "output": os.path.basename(output_file),
+            "output_sha256": ResultProcessor._hash_file(output_file)
+        }
+        manifest_path = os.path.join(input_dir, MANIFEST_NAME)
+        with open(manifest_path + ".tmp", 'w') as f:
+            json.dump(manifest, f)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+    @staticmethod
+    def _read_json_records(file_path):
+        # Stream the records of a .json / .jsonl result file
+        if file_path.endswith('.json'):
+            with open(file_path, 'r') as f:
+                yield json.load(f)
+        elif file_path.endswith('.jsonl'):
+            with open(file_path, 'r') as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+
+    @staticmethod
+    def _extract_result_from_file(file_path):
+        # Extract src_id from filename
+        file_name = os.path.basename(file_path)
+        src_id = file_name.split('.')[0]
+
+        generated_answers = []
+        for json_record in ResultProcessor._read_json_records(file_path):
+            # Extract and process generated code
+            try:
+                generated_code = json_record["response"]
+            except Exception as e:
+                print(f"Error processing {file_path}: {e}")
+                generated_code = "int main() { return 0; }"
+
+            processed_code = CodeExtractor.extract_code_or_main_function(generated_code)
+            generated_answers.append(processed_code)
+
+        return {
+            "src_id": src_id,
+            "generated_answers": generated_answers
+        }
     
+    @staticmethod
+    def _extract_result_from_responses(item):
+        # (src_id, responses) of a result store item
+        src_id, responses = item
+        return {
+            "src_id": src_id,
+            "generated_answers": [CodeExtractor.extract_code_or_main_function(response) for response in responses]
+        }
+
     @staticmethod
     def _extract_results_from_json_files(json_files):
         results_data = []
         for file_path in json_files:
             print(f"Processing file: {file_path}")
-            # Extract data from JSON file
-            if file_path.endswith('.json'):
-                with open(file_path, 'r') as f:
-                    json_contents = [json.load(f)]
-            elif file_path.endswith('.jsonl'):
-                with open(file_path, 'r') as f:
-                    json_contents = [json.loads(line) for line in f]
-            
-            # Extract src_id from filename
-            file_name = os.path.basename(file_path)
-            src_id = file_name.split('.')[0]
-            
-            generated_answers = []
-            for json_record in json_contents:
-                # Extract and process generated code
-                try:
-                    generated_code = json_record["response"]
-                except Exception as e:
-                    print(f"Error processing {file_path}: {e}")
-                    generated_code = "int main() { return 0; }"
-
-                processed_code = CodeExtractor.extract_code_or_main_function(generated_code)
-                generated_answers.append(processed_code)
-            
-            # Add to results data
-            results_data.append({
-                "src_id": src_id,
-                "generated_answers": generated_answers  
-            })
+            results_data.append(ResultProcessor._extract_result_from_file(file_path))
             
         return results_data
     
     @staticmethod
-    def _merge_results_with_reference_data(test_df, results_data):
-        # Create a copy of test_df with all columns preserved
-        merged_df = test_df.copy()
-        # Initialize with empty lists
-        merged_df["generated_answers"] = merged_df.apply(lambda x: [], axis=1)
-        
-        # Convert results_data to DataFrame for easy merging
-        results_df = pd.DataFrame(results_data)
-        
-        # Update generated_answers where src_id matches
-        missing_src_ids = []
-        for _, row in results_df.iterrows():
-            matching_indices = merged_df[merged_df["src_id"] == row["src_id"]].index
-            if len(matching_indices) > 0:
-                merged_df.at[matching_indices[0], "generated_answers"] = row["generated_answers"]
-        
-        # Find missing src_ids
-        for _, row in merged_df.iterrows():
-            if len(row["generated_answers"]) == 0:
-                missing_src_ids.append(row["src_id"])
-        
+    def _merge_results_with_reference_data(test_df, results_data, key="src_id"):
+        # Index the generated answers by src_id (the last result wins on duplicates)
+        results_df = pd.DataFrame(results_data, columns=[key, "generated_answers"])
+        results_df = results_df.drop_duplicates(subset=key, keep="last").set_index(key)
+
+        # Indexed (hash) join on src_id, preserving all reference columns and row order
+        merged_df = test_df.drop(columns=["generated_answers"], errors="ignore").join(results_df, on=key)
+
+        # Rows without results (or with an empty answer list) get an empty list
+        missing_mask = ~(merged_df["generated_answers"].str.len() > 0)
+        merged_df.loc[missing_mask, "generated_answers"] = pd.Series(
+            [[] for _ in range(int(missing_mask.sum()))],
+            index=merged_df.index[missing_mask],
+            dtype=object
+        )
+
         # Output missing src_ids
+        missing_src_ids = merged_df.loc[missing_mask, key].tolist()
         if missing_src_ids:
             print(f"No generated answers for the following src_ids: {missing_src_ids}")
-            
+
         return merged_df
-    
+
     @staticmethod
-    def _save_results_to_jsonl(merged_df, output_file):
+    def _save_results_to_jsonl(merged_df, output_file, chunk_size=10000):
+        # Stream the rows with generated answers in chunks instead of materializing every record
+        answered_df = merged_df[merged_df["generated_answers"].str.len() > 0]
         with open(output_file, 'w', encoding='utf-8') as f:
-            for _, row in merged_df.iterrows():
-                if len(row["generated_answers"]) > 0:
-                    f.write(json.dumps(row.to_dict(), ensure_ascii=False) + '\n')
+            for start in range(0, len(answered_df), chunk_size):
+                for record in answered_df.iloc[start:start + chunk_size].to_dict(orient="records"):
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
 
 
 if __name__ == "__main__":
@@ -182,12 +439,53 @@ if __name__ == "__main__":
     # results/inference_results/codeforce/base/gpt-4o \
     # results/inference_results/codeforce/base/gpt-4o/sampled_results.jsonl
 
+    # Bulk mode (every dataset / strategy / model directory at once):
+    # python3 inference_module/output_format.py bulk \
+    # "results/inference_results/*/*/*" \
+    # --reference_dir BRIDGE_data --workers 16
+
+    # Result store mode (runs saved with main_inference.py --result_store):
+    # python3 inference_module/output_format.py store \
+    # results/inference_results/results.sqlite --runs "PIE/*/*" \
+    # --reference_dir BRIDGE_data --output_root results/inference_results
+
+    if len(sys.argv) > 1 and sys.argv[1] == "bulk":
+        parser = argparse.ArgumentParser(description="Format many result directories in parallel")
+        parser.add_argument("dir_pattern", type=str, help="glob of results/inference_results/<dataset>/<strategy>/<model>_<sampling> directories")
+        parser.add_argument("--reference_dir", type=str, default="BRIDGE_data", help="directory containing <dataset>_test.jsonl reference files")
+        parser.add_argument("--output_name", type=str, default="sampled_results.jsonl", help="name of the formatted output file in each directory")
+        parser.add_argument("--workers", type=int, default=None, help="number of extraction processes (default: CPU count)")
+        parser.add_argument("--force", action="store_true", help="re-format directories even if their inputs are unchanged")
+        bulk_args = parser.parse_args(sys.argv[2:])
+
+        ResultProcessor.process_directories(
+            bulk_args.dir_pattern, bulk_args.reference_dir, bulk_args.output_name, bulk_args.workers, bulk_args.force
+        )
+        sys.exit(0)
+
+    if len(sys.argv) > 1 and sys.argv[1] == "store":
+        parser = argparse.ArgumentParser(description="Format the runs of a result store")
+        parser.add_argument("store_path", type=str, help="SQLite result store written by main_inference.py --result_store")
+        parser.add_argument("--runs", type=str, default=None, help="glob of the <dataset>/<strategy>/<model>_<sampling> runs to format (default: all)")
+        parser.add_argument("--reference_dir", type=str, default="BRIDGE_data", help="directory containing <dataset>_test.jsonl reference files")
+        parser.add_argument("--output_root", type=str, default="results/inference_results", help="root of the <run>/<output_name> outputs")
+        parser.add_argument("--output_name", type=str, default="sampled_results.jsonl", help="name of the formatted output file of each run")
+        parser.add_argument("--workers", type=int, default=None, help="number of extraction processes (default: CPU count)")
+        store_args = parser.parse_args(sys.argv[2:])
+
+        ResultProcessor.process_result_store(
+            store_args.store_path, store_args.reference_dir, store_args.output_root, store_args.runs, store_args.output_name, store_args.workers
+        )
+        sys.exit(0)
+
     if len(sys.argv) != 4:
         print("Usage: python output_format.py <reference_file_path> <input_dir> <output_file>")
+        print("       python output_format.py bulk <dir_glob> [--reference_dir DIR] [--workers N] [--force]")
+        print("       python output_format.py store <result_store> [--runs GLOB] [--reference_dir DIR] [--output_root DIR] [--workers N]")
         sys.exit(1)
         
     reference_file_path = sys.argv[1]
     input_dir = sys.argv[2]
     output_file = sys.argv[3]
     
-    ResultProcessor.process_and_save_results(reference_file_path, input_dir, output_file)
\ No newline at end of file
+    ResultProcessor.process_and_save_results(reference_file_path, input_dir, output_file)
@@ -0,0 +1,139 @@
+"""
+Per-stage timings of the inference pipeline.
+
+The stages of an item are wrapped in `stage(name)`:
+
+    data_load     reading the test data (run_inference)
+    rule_prompt   detection results -> rule directives (generate_rule_prompt)
+    embedding     query embedding (timed_embedder)
+    search        vector / BM25 search and assembly of the retrieved examples
+    token_trim    token counting and trimming of the examples (adjust_args_for_max_tokens)
+    llm_call      LLM requests, including the analysis calls of the NL strategies
+    early_stop    code extraction, deduplication and smoke test of the samples (--early_stop)
+    write         writing the result file of the item
+    formatting    code extraction from the responses (output_format.py)
+
+Timing is disabled by default, so the wrapped stages cost two attribute checks.
+Stages nest: a stage records its own (exclusive) time, e.g. the embedding inside a
+search is counted only as embedding. benchmarks/bench_pipeline.py enables the
+profiler and reports the distribution of every stage.
+
+Every stage is also a span of the tracer (tracing.py) when tracing is configured;
+`with stage(name) as span` gives the span for attributes.
+"""
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List
+
+import numpy as np
+
+import sys
+sys.path.append('.')
+from inference_module.tracing import get_tracer, NO_SPAN
+
+STAGES = ['data_load', 'rule_prompt', 'embedding', 'search', 'token_trim', 'llm_call', 'early_stop', 'write', 'formatting']
+
+
+class StageProfiler:
+    def __init__(self):
+        self.enabled = False
+        self.samples: Dict[str, List[float]] = {}
+        self.lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def stage(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        # the elapsed time of nested stages is subtracted from the enclosing one
+        stack = self._local.__dict__.setdefault('stack', [])
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            with self.lock:
+                self.samples.setdefault(name, []).append(elapsed - nested)
+
+    def reset(self):
+        with self.lock:
+            self.samples = {}
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """
+        Returns:
+            dict: stage -> {'count', 'total', 'mean', 'p50', 'p90', 'p99', 'max'} in seconds, in pipeline order
+        """
+        with self.lock:
+            samples = {name: np.asarray(values) for name, values in self.samples.items()}
+        order = STAGES + sorted(set(samples) - set(STAGES))
+        summary = {}
+        for name in order:
+            if name not in samples:
+                continue
+            values = samples[name]
+            p50, p90, p99 = np.percentile(values, [50, 90, 99])
+            summary[name] = {
+                'count': len(values),
+                'total': float(values.sum()),
+                'mean': float(values.mean()),
+                'p50': float(p50),
+                'p90': float(p90),
+                'p99': float(p99),
+                'max': float(values.max())
+            }
+        return summary
+
+
+class TimedEmbedder:
+    """embedder wrapper that times the query embeddings as the 'embedding' stage"""
+
+    def __init__(self, embedder, profiler: StageProfiler):
+        self.embedder = embedder
+        self.profiler = profiler
+
+    def __getattr__(self, name):
+        return getattr(self.embedder, name)
+
+    def encode_batch(self, *args, **kwargs):
+        with self.profiler.stage('embedding'):
+            return self.embedder.encode_batch(*args, **kwargs)
+
+    def encode(self, *args, **kwargs):
+        with self.profiler.stage('embedding'):
+            return self.embedder.encode(*args, **kwargs)
+
+
+_profiler = StageProfiler()
+
+
+def get_profiler() -> StageProfiler:
+    """the process-wide profiler used by the pipeline stages"""
+    return _profiler
+
+
+def stage(name: str, **attributes):
+    """time a pipeline stage (profiler) and trace it as a span (tracer), whichever is enabled"""
+    tracer = get_tracer()
+    if not _profiler.enabled and not tracer.enabled:
+        return nullcontext(NO_SPAN)
+    return _traced_stage(tracer, name, attributes)
+
+
+@contextmanager
+def _traced_stage(tracer, name, attributes):
+    with _profiler.stage(name), tracer.span(name, **attributes) as span:
+        yield span
+
+
+def timed_embedder(embedder):
+    """the embedder with its calls timed as the 'embedding' stage (unchanged when profiling is off or there is no embedder)"""
+    if embedder is None or not _profiler.enabled:
+        return embedder
+    return TimedEmbedder(embedder, _profiler)
@@ -0,0 +1,183 @@
+"""
+Consolidated result store (SQLite) for inference runs.
+
+Without it, main_inference.py writes one <run>/<src_id>.jsonl file per item, and every
+sample repeats the full prompt, so a sweep produces hundreds of thousands of small files.
+The result store keeps all runs in one database file:
+
+    prompts   hash (sha256 of system prompt + prompt) -> prompt, system_prompt   each distinct prompt once
+    samples   (run, src_id, sample_id) -> prompt hash, response, elapsed_time, model, input_length
+    items     (run, src_id) -> number of samples, completion time                 the resume marker
+
+run is the run name of main_inference.py (<dataset>/<strategy>/<model>_<sampling>). The
+samples and the items row of an item are written in one transaction, so an item is either
+completed with all its samples or absent, like the atomically written JSONL file.
+
+The view `results` joins the samples with their prompts in the JSONL record layout, so
+analysis notebooks can read a run directly:
+
+    pd.read_sql("SELECT * FROM results WHERE run LIKE 'PIE/hybrid/%'", sqlite3.connect(path))
+
+output_format.py formats runs straight from the store (`output_format.py store`), and
+export_item writes an item back as a <src_id>.jsonl file.
+
+The database uses WAL mode, so the workers and processes of a node can share it. Nodes
+on a shared filesystem should use one store per node (SQLite locking over NFS is unreliable)
+and the run manifest (run_manifest.py) to merge.
+"""
+import os
+import json
+import time
+import sqlite3
+import fnmatch
+import hashlib
+import threading
+from typing import Dict, Iterator, List, Optional, Set
+
+SQLITE_HEADER = b'SQLite format 3\x00'
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS prompts (hash TEXT PRIMARY KEY, prompt TEXT, system_prompt TEXT)',
+    'CREATE TABLE IF NOT EXISTS samples ('
+    'run TEXT, src_id TEXT, sample_id INTEGER, prompt_hash TEXT, response TEXT, elapsed_time REAL, model TEXT, input_length INTEGER, '
+    'PRIMARY KEY (run, src_id, sample_id))',
+    'CREATE TABLE IF NOT EXISTS items (run TEXT, src_id TEXT, samples INTEGER, completed REAL, PRIMARY KEY (run, src_id))',
+    'CREATE VIEW IF NOT EXISTS results AS '
+    'SELECT s.run, s.src_id, s.sample_id, p.prompt, p.system_prompt, s.response, s.elapsed_time, s.model, s.input_length '
+    'FROM samples s JOIN prompts p ON p.hash = s.prompt_hash'
+]
+
+# fields of a result record in the per-item JSONL files
+RECORD_FIELDS = ['prompt', 'response', 'elapsed_time', 'model', 'sample_id', 'input_length']
+
+
+def prompt_hash(prompt: str, system_prompt: Optional[str] = None) -> str:
+    return hashlib.sha256(f"{system_prompt or ''}\x00{prompt}".encode('utf-8')).hexdigest()
+
+
+def is_result_store(path: str) -> bool:
+    """whether the file is a SQLite database (a result store) rather than a JSONL result file"""
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(SQLITE_HEADER)) == SQLITE_HEADER
+    except OSError:
+        return False
+
+
+class ResultStore:
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        with self.lock:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            for statement in SCHEMA:
+                self.conn.execute(statement)
+            self.conn.commit()
+
+    def is_done(self, run: str, src_id: str) -> bool:
+        with self.lock:
+            row = self.conn.execute('SELECT 1 FROM items WHERE run = ? AND src_id = ?', (run, src_id)).fetchone()
+        return row is not None
+
+    def completed(self, run: str) -> Set[str]:
+        """src_ids of the completed items of the run"""
+        with self.lock:
+            return {row[0] for row in self.conn.execute('SELECT src_id FROM items WHERE run = ?', (run,))}
+
+    def write_item(self, run: str, src_id: str, results: List[Dict], system_prompts: List[Optional[str]] = None):
+        """
+        store the samples of an item and mark it completed (one transaction).
+
+        Args:
+            results: result records of main_inference.py (prompt, response, elapsed_time, model, sample_id, input_length)
+            system_prompts: the system prompt of each record (part of the prompt hash)
+        """
+        system_prompts = system_prompts or [None] * len(results)
+        prompts = {}
+        samples = []
+        for result, system_prompt in zip(results, system_prompts):
+            key = prompt_hash(result['prompt'], system_prompt)
+            prompts[key] = (key, result['prompt'], system_prompt)
+            samples.append((run, src_id, result['sample_id'], key, result['response'], result['elapsed_time'],
+                            result['model'], result['input_length']))
+        with self.lock:
+            with self.conn:
+                self.conn.executemany('INSERT OR IGNORE INTO prompts (hash, prompt, system_prompt) VALUES (?, ?, ?)', prompts.values())
+                self.conn.execute('DELETE FROM samples WHERE run = ? AND src_id = ?', (run, src_id))
+                self.conn.executemany(
+                    'INSERT INTO samples (run, src_id, sample_id, prompt_hash, response, elapsed_time, model, input_length) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', samples
+                )
+                self.conn.execute('INSERT OR REPLACE INTO items (run, src_id, samples, completed) VALUES (?, ?, ?, ?)',
+                                  (run, src_id, len(samples), time.time()))
+
+    def runs(self, pattern: Optional[str] = None) -> List[str]:
+        """run names with completed items, optionally filtered by a glob pattern (e.g. 'PIE/*/*_greedy')"""
+        with self.lock:
+            runs = [row[0] for row in self.conn.execute('SELECT DISTINCT run FROM items ORDER BY run')]
+        return [run for run in runs if pattern is None or fnmatch.fnmatchcase(run, pattern)]
+
+    def read_results(self, run: str, src_id: Optional[str] = None) -> Iterator[Dict]:
+        """result records of the completed items of a run (in the JSONL layout plus src_id), ordered by src_id and sample_id"""
+        query = ('SELECT r.src_id, r.prompt, r.response, r.elapsed_time, r.model, r.sample_id, r.input_length '
+                 'FROM results r JOIN items i ON i.run = r.run AND i.src_id = r.src_id WHERE r.run = ?')
+        params = [run]
+        if src_id is not None:
+            query += ' AND r.src_id = ?'
+            params.append(src_id)
+        with self.lock:
+            rows = self.conn.execute(query + ' ORDER BY r.src_id, r.sample_id', params).fetchall()
+        for row in rows:
+            yield {'src_id': row[0], **dict(zip(RECORD_FIELDS, row[1:]))}
+
+    def responses(self, run: str) -> Dict[str, List[str]]:
+        """src_id -> responses ordered by sample_id, for the completed items of a run"""
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT s.src_id, s.response FROM samples s JOIN items i ON i.run = s.run AND i.src_id = s.src_id '
+                'WHERE s.run = ? ORDER BY s.src_id, s.sample_id', (run,)
+            ).fetchall()
+        responses: Dict[str, List[str]] = {}
+        for src_id, response in rows:
+            responses.setdefault(src_id, []).append(response)
+        return responses
+
+    def export_item(self, run: str, src_id: str, output_file: str) -> bool:
+        """write an item as a <src_id>.jsonl result file; False if the item is not completed"""
+        records = [{field: r[field] for field in RECORD_FIELDS} for r in self.read_results(run, src_id)]
+        if not records:
+            return False
+        with open(output_file + '.tmp', 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        os.replace(output_file + '.tmp', output_file)
+        return True
+
+    def stats(self) -> str:
+        with self.lock:
+            items, = self.conn.execute('SELECT COUNT(*) FROM items').fetchone()
+            samples, referenced = self.conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(LENGTH(p.prompt)), 0) FROM samples s JOIN prompts p ON p.hash = s.prompt_hash'
+            ).fetchone()
+            prompts, stored = self.conn.execute('SELECT COUNT(*), COALESCE(SUM(LENGTH(prompt)), 0) FROM prompts').fetchone()
+        return (f"result store: {items} items, {samples} samples, {prompts} distinct prompts "
+                f"({stored / 1e6:.1f} MB stored for {referenced / 1e6:.1f} MB of sample prompts)")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+_stores: Dict[str, ResultStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_result_store(path: str) -> ResultStore:
+    """one shared ResultStore per database file in this process"""
+    key = os.path.abspath(path)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = ResultStore(path)
+        return _stores[key]
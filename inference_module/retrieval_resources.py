@@ -0,0 +1,210 @@
+"""
+Retrieval resources (vector store, embedder, code pairs, distilled analyses) for the prompt strategies.
+
+The resources are loaded lazily and only when the strategy uses them:
+
+    strategy                                         store            embedder  code_pair  distilled_data
+    ICL                                              -                -         yes        -
+    retrieve_random_strategy                         -                -         yes        yes
+    retrieve_basic                                   hq_snippet       yes       yes        -
+    retrieve_LLM_codesim                             hq_snippet       yes       yes        yes
+    retrieve_LLM_NLsim, hybrid, hybrid_after_rules   distilled        yes       yes        yes (from the store)
+
+Every component is loaded at most once per RetrievalResources instance, so one
+instance (e.g. get_shared_resources()) can serve all jobs of a sweep; configure()
+applies the retrieval options of a job, and the stores and the embedder are keyed
+on the options they are built with. The embedder is shared by both stores; with an embedding service (embedding_service.py) it is a
+client and the model is shared by all worker processes. With retrieval_mode='lexical'
+the stores rank with their BM25 index and the embedder is never loaded.
+
+The comment-stripped code pairs are read on demand from the precomputed corpus
+(code_pair_corpus.py), which is rebuilt when the training data changes.
+
+With dedup_threshold set, the retrieval strategies also get the MinHash index of the
+training slow codes (near_duplicates.py), used to drop retrieved examples that are
+near-duplicates of the query or of each other.
+
+With profile_mode set, the code store also uses the structural bottleneck profile of
+code queries (code_fingerprint.py) to pre-filter or boost the candidates. The distilled
+store holds analysis prose and is queried with it, so it never uses the profile.
+"""
+import time
+import logging
+import threading
+
+import sys
+sys.path.append('.')
+from detection_module_LLM_based.prompt import load_distilled_data, distilled_data_from_metadata
+from detection_module_LLM_based.code_pair_corpus import load_code_pair_corpus
+from detection_module_LLM_based.vector_store import DiskBackedVectorStore
+from detection_module_LLM_based.embedding_service import load_embedder
+from detection_module_LLM_based.near_duplicates import load_near_duplicate_index
+from inference_module.tracing import get_tracer
+
+logger = logging.getLogger(__name__)
+
+RAG_STORE_PATH_CODE      = "./BRIDGE_data/rag_store/hq_snippet"
+RAG_STORE_PATH_STRATEGE  = "./BRIDGE_data/rag_store/distilled_deepseek"
+EMBEDDER_MODEL_NAME = "Qodo/Qodo-Embed-1-1.5B"
+TRAIN_DATA_PATH = './BRIDGE_data/HQ_data.jsonl'
+
+# stores of code entries searched with code queries (the only ones using profile_mode)
+CODE_STORES = [RAG_STORE_PATH_CODE]
+
+# strategy -> (store path or None, components besides the store)
+STRATEGY_COMPONENTS = {
+    'ICL': (None, ('code_pair',)),
+    'retrieve_random_strategy': (None, ('code_pair', 'distilled_data')),
+    'retrieve_basic': (RAG_STORE_PATH_CODE, ('embedder', 'code_pair')),
+    'retrieve_LLM_codesim': (RAG_STORE_PATH_CODE, ('embedder', 'code_pair', 'distilled_data')),
+    'retrieve_LLM_NLsim': (RAG_STORE_PATH_STRATEGE, ('embedder', 'code_pair', 'distilled_data')),
+    'hybrid': (RAG_STORE_PATH_STRATEGE, ('embedder', 'code_pair', 'distilled_data')),
+    'hybrid_after_rules': (RAG_STORE_PATH_STRATEGE, ('embedder', 'code_pair', 'distilled_data')),
+}
+
+
+class RetrievalResources:
+    def __init__(self, embedder_model_name=EMBEDDER_MODEL_NAME, train_data_path=TRAIN_DATA_PATH, distilled_store_path=RAG_STORE_PATH_STRATEGE, result_cache=True, quantization=None, reduced_dim=None, embedder_backend='torch', embedding_service_url=None, retrieval_mode='dense', dedup_threshold=None, profile_mode=None):
+        """
+        Args:
+            result_cache: let the stores cache their search results across runs (retrieval_cache.sqlite in the store directory)
+            quantization: compressed vector representation searched by the stores ('float16', 'int8', 'pq' or None)
+            reduced_dim: two-stage search with a PCA-reduced copy of this dimension (None for the full vectors only)
+            embedder_backend: 'torch' or 'onnx-int8' (quantized ONNX model for nodes without a GPU)
+            embedding_service_url: use the embedding service at this address instead of a local model
+                (default: the EMBEDDING_SERVICE_URL environment variable)
+            retrieval_mode: 'dense', 'hybrid' (cosine and BM25 ranks fused) or 'lexical' (BM25 only, no embedder)
+            dedup_threshold: estimated Jaccard similarity above which retrieved examples count as near-duplicates (None: no dedup)
+            profile_mode: 'filter' or 'boost' the code-query candidates by their bottleneck profile (None: embeddings only)
+        """
+        self.embedder_model_name = embedder_model_name
+        self.train_data_path = train_data_path
+        self.distilled_store_path = distilled_store_path
+        self.result_cache = result_cache
+        self.quantization = quantization
+        self.reduced_dim = reduced_dim
+        self.embedder_backend = embedder_backend
+        self.embedding_service_url = embedding_service_url
+        self.retrieval_mode = retrieval_mode
+        self.dedup_threshold = dedup_threshold
+        self.profile_mode = profile_mode
+        # (storage_path, quantization, reduced_dim, retrieval_mode, profile_mode, result_cache) -> store
+        self.stores = {}
+        # (embedder_backend, embedding_service_url) -> embedder
+        self._embedders = {}
+        self._code_pair = None
+        self._distilled_data = None
+        self._near_duplicates = None
+        self.lock = threading.RLock()
+
+    def configure(self, args):
+        """apply the retrieval options of parsed main_inference.py arguments (once per job in a sweep)"""
+        with self.lock:
+            self.result_cache = not args.no_retrieval_cache
+            self.quantization = args.store_quantization
+            self.reduced_dim = args.store_reduced_dim
+            self.embedder_backend = args.embedder_backend
+            self.embedding_service_url = args.embedding_service_url
+            self.retrieval_mode = args.retrieval_mode
+            self.dedup_threshold = args.dedup_threshold
+            self.profile_mode = args.profile_mode
+
+    def _timed(self, name, load):
+        start_time = time.time()
+        value = load()
+        logger.info(f"loaded {name} in {time.time() - start_time:.1f}s")
+        return value
+
+    def store(self, storage_path):
+        with self.lock:
+            # a store is built for one configuration, jobs with other options get their own instance
+            profile_mode = self.profile_mode if storage_path in CODE_STORES else None
+            key = (storage_path, self.quantization, self.reduced_dim, self.retrieval_mode, profile_mode, self.result_cache)
+            if key not in self.stores:
+                self.stores[key] = self._timed(
+                    f"vector store {storage_path}",
+                    lambda: DiskBackedVectorStore(storage_path, model_name=self.embedder_model_name, result_cache=self.result_cache,
+                                                 quantization=self.quantization, reduced_dim=self.reduced_dim, retrieval_mode=self.retrieval_mode,
+                                                 profile_mode=profile_mode, tracer=get_tracer())
+                )
+            return self.stores[key]
+
+    def embedder(self):
+        with self.lock:
+            key = (self.embedder_backend, self.embedding_service_url)
+            if key not in self._embedders:
+                self._embedders[key] = self._timed(
+                    f"embedder {self.embedder_model_name} ({self.embedder_backend})",
+                    lambda: load_embedder(self.embedder_model_name, self.embedder_backend, self.embedding_service_url)
+                )
+            return self._embedders[key]
+
+    def code_pair(self):
+        with self.lock:
+            if self._code_pair is None:
+                self._code_pair = self._timed(
+                    f"code pairs {self.train_data_path}",
+                    lambda: load_code_pair_corpus(self.train_data_path)
+                )
+                logger.info(f"Code pair length: {len(self._code_pair)}")
+            return self._code_pair
+
+    def distilled_data(self):
+        with self.lock:
+            if self._distilled_data is None:
+                loaded = [store for key, store in self.stores.items() if key[0] == self.distilled_store_path]
+                if loaded:
+                    # the distilled store is already loaded, its metadata is the same file
+                    self._distilled_data = distilled_data_from_metadata(loaded[0].metadata)
+                else:
+                    self._distilled_data = self._timed(
+                        f"distilled data {self.distilled_store_path}",
+                        lambda: load_distilled_data(self.distilled_store_path)
+                    )
+            return self._distilled_data
+
+    def near_duplicates(self):
+        with self.lock:
+            if self._near_duplicates is None:
+                self._near_duplicates = self._timed(
+                    f"MinHash index {self.train_data_path}",
+                    lambda: load_near_duplicate_index(self.train_data_path, threshold=self.dedup_threshold)
+                )
+            # the threshold can change between the jobs of a sweep
+            self._near_duplicates.threshold = self.dedup_threshold
+            return self._near_duplicates
+
+    def get(self, prompt_strategy):
+        """
+        the resources of a prompt strategy.
+
+        Returns:
+            tuple: (store, embedder, code_pair, distilled_data, near_duplicates), None for the unused components
+        """
+        if prompt_strategy not in STRATEGY_COMPONENTS:
+            return None, None, None, None, None
+        store_path, components = STRATEGY_COMPONENTS[prompt_strategy]
+
+        store = self.store(store_path) if store_path else None
+        embedder = self.embedder() if 'embedder' in components and self.retrieval_mode != 'lexical' else None
+        code_pair = self.code_pair() if 'code_pair' in components else None
+        distilled_data = self.distilled_data() if 'distilled_data' in components else None
+        near_duplicates = self.near_duplicates() if store_path and self.dedup_threshold is not None else None
+        if store_path:
+            logger.info(f"Rag storage: {store_path}, {self.embedder_model_name}, {self.retrieval_mode} retrieval")
+        return store, embedder, code_pair, distilled_data, near_duplicates
+
+    def cache_stats(self):
+        """hit / miss summary of the result caches of the loaded stores"""
+        return [f"{key[0]}: {store.result_cache.stats()}" for key, store in self.stores.items() if store.result_cache is not None]
+
+
+_shared_resources = None
+
+
+def get_shared_resources():
+    """the process-wide RetrievalResources instance"""
+    global _shared_resources
+    if _shared_resources is None:
+        _shared_resources = RetrievalResources()
+    return _shared_resources
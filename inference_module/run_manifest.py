@@ -0,0 +1,253 @@
+"""
+Shared run manifest for sharded / distributed inference.
+
+The manifest is an append-only JSONL event log on a shared filesystem. Every
+update (claim / complete / release of a src_id) is appended while holding an
+exclusive POSIX lock on the file, so concurrent processes on different nodes
+see a consistent state:
+
+    {"event": "claim", "run": "PIE/hybrid/qwen2.5-coder_7b_greedy", "src_id": "s123", "worker": "node1:4242", "time": ...}
+    {"event": "complete", ..., "output": "node1/PIE/hybrid/qwen2.5-coder_7b_greedy/s123.jsonl"}
+
+A claim that is neither completed nor released within `claim_timeout` seconds
+(e.g. the node died) can be claimed again by another worker.
+
+The `merge` command collects the per-node output directories into the layout of
+main_inference.create_output_directory (<output_root>/<dataset>/<strategy>/<model>_<sampling>).
+Items completed into a per-node result store (--result_store, the recorded output is the
+store file) are exported from the store as {src_id}.jsonl.
+"""
+import os
+import json
+import time
+import zlib
+import fcntl
+import shutil
+import socket
+import argparse
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+import sys
+sys.path.append('.')
+from inference_module.result_store import get_result_store, is_result_store
+
+logger = logging.getLogger(__name__)
+
+
+def parse_shard(shard: str) -> Tuple[int, int]:
+    """parse the 'i/N' shard notation (0-based i)"""
+    index, count = shard.split('/')
+    index, count = int(index), int(count)
+    if count <= 0 or not 0 <= index < count:
+        raise ValueError(f"invalid shard: {shard} (expected i/N with 0 <= i < N)")
+    return index, count
+
+
+def shard_of(src_id: str, shard_count: int) -> int:
+    """stable shard assignment of a src_id (independent of the data order and the Python hash seed)"""
+    return zlib.crc32(src_id.encode('utf-8')) % shard_count
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class RunManifest:
+    def __init__(self, path: str, claim_timeout: float = 6 * 3600):
+        """
+        Args:
+            path: the manifest file (on a filesystem shared by all nodes)
+            claim_timeout: seconds after which an unfinished claim is considered abandoned
+        """
+        self.path = path
+        self.claim_timeout = claim_timeout
+        self.worker = worker_id()
+        # (run, src_id) -> latest event
+        self.entries: Dict[Tuple[str, str], Dict] = {}
+        self._offset = 0
+        # POSIX locks are per process, so the threads of one worker also need a local lock
+        self._thread_lock = threading.Lock()
+
+        manifest_dir = os.path.dirname(path)
+        if manifest_dir:
+            os.makedirs(manifest_dir, exist_ok=True)
+
+    def _apply(self, event: Dict):
+        key = (event['run'], event['src_id'])
+        if event['event'] == 'release':
+            current = self.entries.get(key)
+            if current is not None and current['event'] == 'claim' and current['worker'] == event['worker']:
+                del self.entries[key]
+        elif event['event'] == 'claim':
+            current = self.entries.get(key)
+            if current is None or current['event'] != 'complete':
+                self.entries[key] = event
+        else:
+            self.entries[key] = event
+
+    def _read_new_events(self, f):
+        # only the events appended since the last read are parsed
+        f.seek(self._offset)
+        for line in f:
+            if not line.endswith(b'\n'):
+                break  # torn write of a crashed process; it is skipped and overwritten by later appends
+            self._offset += len(line)
+            if line.strip():
+                self._apply(json.loads(line))
+
+    def _locked_update(self, decide):
+        """read the latest state and append the event returned by decide() under an exclusive lock"""
+        with self._thread_lock, open(self.path, 'a+b') as f:
+            fcntl.lockf(f, fcntl.LOCK_EX)
+            try:
+                self._read_new_events(f)
+                event = decide()
+                if event is None:
+                    return None
+                event.update({'worker': self.worker, 'time': time.time()})
+                line = (json.dumps(event, ensure_ascii=False) + '\n').encode('utf-8')
+                f.seek(0, os.SEEK_END)
+                if f.tell() != self._offset:
+                    # drop the torn tail of a crashed writer before appending
+                    f.truncate(self._offset)
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+                self._offset += len(line)
+                self._apply(event)
+                return event
+            finally:
+                fcntl.lockf(f, fcntl.LOCK_UN)
+
+    def refresh(self):
+        if not os.path.exists(self.path):
+            return
+        with self._thread_lock, open(self.path, 'rb') as f:
+            fcntl.lockf(f, fcntl.LOCK_SH)
+            try:
+                self._read_new_events(f)
+            finally:
+                fcntl.lockf(f, fcntl.LOCK_UN)
+
+    def status(self, run: str, src_id: str) -> Optional[str]:
+        entry = self.entries.get((run, src_id))
+        return entry['event'] if entry else None
+
+    def claim(self, run: str, src_id: str) -> bool:
+        """atomically claim a src_id of the run; False if it is completed or claimed by another live worker"""
+        def decide():
+            entry = self.entries.get((run, src_id))
+            if entry is not None:
+                if entry['event'] == 'complete':
+                    return None
+                if entry['worker'] != self.worker and time.time() - entry['time'] < self.claim_timeout:
+                    return None
+            return {'event': 'claim', 'run': run, 'src_id': src_id}
+        return self._locked_update(decide) is not None
+
+    def complete(self, run: str, src_id: str, output: str):
+        self._locked_update(lambda: {'event': 'complete', 'run': run, 'src_id': src_id, 'output': output})
+
+    def release(self, run: str, src_id: str):
+        """give up a claim (e.g. after an error) so that another worker can take the item"""
+        self._locked_update(lambda: {'event': 'release', 'run': run, 'src_id': src_id})
+
+    def completed(self, run: str) -> Dict[str, str]:
+        """src_id -> output path of the completed items of the run"""
+        self.refresh()
+        return {src_id: e['output'] for (r, src_id), e in self.entries.items() if r == run and e['event'] == 'complete'}
+
+
+def merge_outputs(manifest_path: str, output_root: str, runs=None, reference_file_path: str = None) -> int:
+    """
+    copy the completed outputs recorded in the manifest into <output_root>/<run>/{src_id}.jsonl.
+
+    Args:
+        runs: the runs (dataset/strategy/model_sampling) to merge; all runs in the manifest if None
+        reference_file_path: optional test data file used to report missing src_ids
+
+    Returns:
+        int: the number of merged files
+    """
+    manifest = RunManifest(manifest_path)
+    manifest.refresh()
+    runs = runs or sorted({run for run, _ in manifest.entries})
+
+    expected_ids = None
+    if reference_file_path:
+        with open(reference_file_path, 'r') as f:
+            expected_ids = [json.loads(line)['src_id'] for line in f]
+
+    n_merged = 0
+    for run in runs:
+        completed = manifest.completed(run)
+        output_dir = os.path.join(output_root, run)
+        os.makedirs(output_dir, exist_ok=True)
+
+        for src_id, source_path in completed.items():
+            target_path = os.path.join(output_dir, f"{src_id}.jsonl")
+            if os.path.abspath(source_path) == os.path.abspath(target_path) or os.path.exists(target_path):
+                continue
+            if not os.path.exists(source_path):
+                logger.warning(f"[{run}] completed output of {src_id} not found: {source_path}")
+                continue
+            if is_result_store(source_path):
+                if not get_result_store(source_path).export_item(run, src_id, target_path):
+                    logger.warning(f"[{run}] completed item {src_id} not found in the result store {source_path}")
+                    continue
+            else:
+                shutil.copyfile(source_path, target_path + '.tmp')
+                os.replace(target_path + '.tmp', target_path)
+            n_merged += 1
+
+        claimed = sorted(src_id for (r, src_id), e in manifest.entries.items() if r == run and e['event'] == 'claim')
+        logger.info(f"[{run}] {len(completed)} completed, {len(claimed)} still claimed -> {output_dir}")
+        if claimed:
+            logger.info(f"[{run}] unfinished claims: {claimed}")
+        if expected_ids is not None:
+            missing = [src_id for src_id in expected_ids if src_id not in completed]
+            if missing:
+                logger.info(f"[{run}] {len(missing)} src_ids never completed: {missing}")
+
+    return n_merged
+
+
+def main():
+    # python3 inference_module/run_manifest.py merge \
+    #     --manifest /shared/sweep/manifest.jsonl \
+    #     --output_root results/inference_results \
+    #     --reference_file_path BRIDGE_data/PIE_test.jsonl
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description='shared run manifest tools')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    merge_parser = subparsers.add_parser('merge', help='merge the sharded outputs into one output directory per run')
+    merge_parser.add_argument('--manifest', type=str, required=True, help='shared manifest file')
+    merge_parser.add_argument('--output_root', type=str, default='results/inference_results', help='root of the merged output directories')
+    merge_parser.add_argument('--runs', type=str, nargs='*', default=None, help='runs to merge (default: all runs in the manifest)')
+    merge_parser.add_argument('--reference_file_path', type=str, default=None, help='test data file used to report missing src_ids')
+
+    status_parser = subparsers.add_parser('status', help='print the number of claimed / completed items per run')
+    status_parser.add_argument('--manifest', type=str, required=True, help='shared manifest file')
+
+    args = parser.parse_args()
+
+    if args.command == 'merge':
+        n_merged = merge_outputs(args.manifest, args.output_root, args.runs, args.reference_file_path)
+        logger.info(f"merged {n_merged} files into {args.output_root}")
+    elif args.command == 'status':
+        manifest = RunManifest(args.manifest)
+        manifest.refresh()
+        counts = {}
+        for (run, _), entry in manifest.entries.items():
+            counts.setdefault(run, {'claim': 0, 'complete': 0})
+            counts[run][entry['event']] += 1
+        for run, count in sorted(counts.items()):
+            print(f"{run}: {count['complete']} completed, {count['claim']} claimed")
+
+
+if __name__ == "__main__":
+    main()
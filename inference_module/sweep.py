@@ -0,0 +1,171 @@
+"""
+Sweep scheduler for models x prompt strategies x datasets (x sampling methods).
+
+Every (model, strategy, dataset, sampling) combination used to be a separate
+run_ollama_inference.sh invocation that started its own server and loaded the
+model again. The scheduler runs the whole matrix in one process instead:
+- jobs are grouped by model, and the model is preloaded once and kept resident
+  (Ollama keep_alive) for all jobs of the group, then unloaded for the next model
+- retrieval resources (vector store, embedder, code pairs, distilled data) are
+  loaded lazily once per process (retrieval_resources.py) and shared by all jobs
+- the model load times reported by the server are used to estimate the model-swap
+  time saved compared to one load per job
+
+Usage:
+    python inference_module/sweep.py \
+        --models qwen2.5-coder:7b,codellama:7b \
+        --strategies base,rules,hybrid \
+        --datasets BRIDGE_data/PIE_test.jsonl,BRIDGE_data/codeforce_test.jsonl \
+        --samplings greedy \
+        --hosts 11434
+"""
+import sys
+import time
+import logging
+import argparse
+from itertools import groupby
+
+sys.path.append('.')
+from inference_module.main_inference import (
+    PROMPT_STRATEGIES, build_parser, finalize_args, run_inference
+)
+from inference_module.retrieval_resources import get_shared_resources
+from inference_module.backend_pool import BackendPool
+from inference_module.run_manifest import RunManifest
+from inference_module.tracing import get_tracer
+
+logger = logging.getLogger(__name__)
+
+# strategies using the same vector store (or, without a store, the same code pairs) run back to back,
+# following the resources of retrieval_resources.STRATEGY_COMPONENTS
+RESOURCE_GROUPS = {
+    'retrieve_basic': 'code_store',
+    'retrieve_LLM_codesim': 'code_store',
+    'retrieve_random_strategy': 'code_pair',
+    'retrieve_LLM_NLsim': 'strategy_store',
+    'hybrid': 'strategy_store',
+    'hybrid_after_rules': 'strategy_store',
+    'ICL': 'code_pair',
+}
+
+
+def build_jobs(models, strategies, datasets, samplings):
+    """the job matrix, ordered so that all jobs of a model are consecutive"""
+    jobs = []
+    for model in models:
+        for dataset in datasets:
+            for sampling in samplings:
+                # strategies sharing retrieval resources run back to back
+                for strategy in sorted(strategies, key=lambda s: (RESOURCE_GROUPS.get(s, ''), strategies.index(s))):
+                    jobs.append({'model': model, 'strategy': strategy, 'dataset': dataset, 'sampling': sampling})
+    return jobs
+
+
+def run_sweep(jobs, pool, job_args=(), manifest=None, unload_between_models=True):
+    """
+    run all jobs, one model group at a time.
+
+    Args:
+        jobs: the job list from build_jobs
+        pool: the BackendPool (its keep_alive keeps the model resident between requests)
+        job_args: extra main_inference.py arguments for every job (e.g. ['--num_workers', '4'])
+
+    Returns:
+        dict: model -> {'jobs', 'loads', 'load_seconds', 'elapsed'}
+    """
+    resources = get_shared_resources()
+    summary = {}
+
+    for model, model_jobs in groupby(jobs, key=lambda job: job['model']):
+        model_jobs = list(model_jobs)
+        start_time = time.time()
+        logger.info(f"=== model {model}: {len(model_jobs)} jobs ===")
+        pool.preload(model)
+
+        for job in model_jobs:
+            args = finalize_args(build_parser().parse_args([
+                '--model_name', job['model'],
+                '--test_data_path', job['dataset'],
+                '--prompt_strategy', job['strategy'],
+                '--sampling', job['sampling'],
+                *job_args
+            ]))
+            # retrieval options (retrieval mode, quantization, profile mode, ...) can differ between jobs
+            resources.configure(args)
+            job_start = time.time()
+            output_dir = run_inference(args, pool, resources.get(job['strategy']), manifest)
+            logger.info(f"job {job['strategy']} / {job['dataset']} / {job['sampling']} done in {time.time() - job_start:.1f}s -> {output_dir}")
+
+        if unload_between_models:
+            pool.unload(model)
+
+        loads, load_seconds = pool.load_stats.get(model, [0, 0.0])
+        summary[model] = {
+            'jobs': len(model_jobs),
+            'loads': loads,
+            'load_seconds': load_seconds,
+            'elapsed': time.time() - start_time
+        }
+
+    report_swap_savings(summary)
+    for stats in resources.cache_stats():
+        logger.info(stats)
+    return summary
+
+
+def report_swap_savings(summary):
+    """compare the measured load time with one model load per job (the per-invocation workflow)"""
+    total_saved = 0.0
+    for model, stats in summary.items():
+        if stats['loads'] == 0:
+            logger.info(f"{model}: {stats['jobs']} jobs, no model load observed (already resident)")
+            continue
+        avg_load = stats['load_seconds'] / stats['loads']
+        ungrouped = avg_load * stats['jobs']
+        saved = ungrouped - stats['load_seconds']
+        total_saved += saved
+        logger.info(
+            f"{model}: {stats['jobs']} jobs, {stats['loads']} loads ({stats['load_seconds']:.1f}s, avg {avg_load:.1f}s/load), "
+            f"one load per job would take {ungrouped:.1f}s -> saved {saved:.1f}s"
+        )
+    logger.info(f"total model-swap time saved: {total_saved:.1f}s")
+    return total_saved
+
+
+def main():
+    parser = argparse.ArgumentParser(description='sweep scheduler (models x prompt strategies x datasets)')
+    parser.add_argument('--models', type=str, required=True, help='comma-separated model names')
+    parser.add_argument('--strategies', type=str, default=','.join(s for s in PROMPT_STRATEGIES if s != 'hybrid_after_rules'),
+                        help='comma-separated prompt strategies (default: all except hybrid_after_rules)')
+    parser.add_argument('--datasets', type=str, required=True, help='comma-separated test data files')
+    parser.add_argument('--samplings', type=str, default='greedy', help='comma-separated sampling methods (greedy, k_sample)')
+    parser.add_argument('--hosts', type=str, default='11434', help='comma-separated Ollama backends')
+    parser.add_argument('--keep_alive', type=str, default='60m', help='Ollama keep_alive while a model group is running')
+    parser.add_argument('--no_unload', action='store_true', help='do not unload a model after its group is finished')
+    parser.add_argument('--manifest', type=str, default=None, help='shared run manifest file (see run_manifest.py)')
+    parser.add_argument('--trace_file', type=str, default=None, help='JSONL span trace of all jobs (see tracing.py)')
+    parser.add_argument('--metrics_port', type=int, default=None, help='serve Prometheus metrics of the spans on this port')
+    args, job_args = parser.parse_known_args()
+
+    strategies = args.strategies.split(',')
+    for strategy in strategies:
+        if strategy not in PROMPT_STRATEGIES:
+            parser.error(f"unknown prompt strategy: {strategy}")
+
+    jobs = build_jobs(args.models.split(','), strategies, args.datasets.split(','), args.samplings.split(','))
+    logger.info(f"{len(jobs)} jobs for {len(args.models.split(','))} models")
+
+    if args.trace_file or args.metrics_port:
+        get_tracer().configure(args.trace_file, args.metrics_port)
+
+    pool = BackendPool(args.hosts.split(','), keep_alive=args.keep_alive)
+    logger.info(f"healthy backends: {pool.check_all()}/{len(pool.backends)}")
+
+    # --manifest is handled here; any other unknown arguments (e.g. --num_workers 4, --retrieval_mode hybrid,
+    # --no_retrieval_cache) are passed to every job and applied to the shared retrieval resources per job
+    manifest = RunManifest(args.manifest) if args.manifest else None
+    run_sweep(jobs, pool, job_args, manifest, unload_between_models=not args.no_unload)
+
+
+if __name__ == "__main__":
+    main()
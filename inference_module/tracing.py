@@ -0,0 +1,296 @@
+"""
+Structured tracing and Prometheus metrics of the inference loop.
+
+Every item is traced as a tree of spans:
+
+    item            src_id, strategy, model, sampling, status, samples, llm_calls / llm_calls_saved / stop_reason (--early_stop)
+      rule_prompt / search / token_trim / llm_call / write      the stages of profiling.py
+        retrieval   store, retrieval mode, k, cache_hit, retrieved_ids, similarities   (vector_store.search_parallel)
+      llm_call      backend, attempts, prompt / completion tokens, load / prompt eval / eval seconds reported by Ollama
+      token_trim    base_tokens, example_tokens, trimmed_tokens
+
+Finished spans are appended to a JSONL trace file, one object per span:
+
+    {"trace_id", "span_id", "parent_id", "name", "start" (unix time), "duration" (s), "thread", "attributes", "error"}
+
+and aggregated into metrics served in the Prometheus text format on /metrics:
+
+    eco_span_seconds{span, strategy}          histogram of the span durations
+    eco_span_errors_total{span, strategy}     spans that raised
+    eco_inflight_spans{span}                  spans currently open
+    eco_oldest_inflight_seconds{span}         age of the oldest open span (a stalled LLM server shows up here)
+    eco_retrieval_cache_total{store, result}  hits / misses of the retrieval result cache
+    eco_llm_tokens_total{kind}                prompt / completion tokens
+    eco_llm_calls_saved_total{strategy}       sample generations skipped by early stopping (adaptive_sampling.py)
+    eco_backend_requests_total{backend, result}
+
+Tracing is off until configure() is called (main_inference.py / sweep.py --trace_file,
+--metrics_port); when off, span() returns a shared no-op span.
+
+Usage:
+    python inference_module/main_inference.py ... --trace_file traces/run.jsonl --metrics_port 9464
+    curl localhost:9464/metrics
+"""
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# histogram buckets (seconds) of eco_span_seconds, from a BM25 lookup to a long reasoning-model answer
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+
+class Span:
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'strategy', 'start', 'start_time', 'attributes')
+
+    def __init__(self, name, trace_id, span_id, parent_id, strategy, attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.strategy = strategy
+        self.start = time.perf_counter()
+        self.start_time = time.time()
+        self.attributes = attributes
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+class NoSpan:
+    """span returned while tracing is off"""
+
+    def set(self, **attributes):
+        pass
+
+
+NO_SPAN = NoSpan()
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    parts = []
+    for key, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+class Metrics:
+    """span histograms and counters in the Prometheus text exposition format"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (span, strategy) -> [bucket counts, sum, count]
+        self.histograms = {}
+        # (metric, sorted label items) -> value
+        self.counters = {}
+
+    def observe(self, span: str, strategy: str, seconds: float, error: bool):
+        with self.lock:
+            histogram = self.histograms.setdefault((span, strategy), [[0] * len(BUCKETS), 0.0, 0])
+            index = bisect.bisect_left(BUCKETS, seconds)
+            if index < len(BUCKETS):
+                histogram[0][index] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+        if error:
+            self.inc('eco_span_errors_total', span=span, strategy=strategy)
+
+    def inc(self, metric: str, value: float = 1, **labels):
+        key = (metric, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def render(self, open_spans) -> str:
+        lines = ['# TYPE eco_span_seconds histogram']
+        with self.lock:
+            for (span, strategy), (counts, total, count) in sorted(self.histograms.items()):
+                labels = {'span': span, 'strategy': strategy}
+                cumulative = 0
+                for bound, n in zip(BUCKETS, counts):
+                    cumulative += n
+                    lines.append(f"eco_span_seconds_bucket{_labels({**labels, 'le': bound})} {cumulative}")
+                lines.append(f"eco_span_seconds_bucket{_labels({**labels, 'le': '+Inf'})} {count}")
+                lines.append(f"eco_span_seconds_sum{_labels(labels)} {total:.6f}")
+                lines.append(f"eco_span_seconds_count{_labels(labels)} {count}")
+            counters = sorted(self.counters.items())
+        metric_names = []
+        for (metric, labels), value in counters:
+            if metric not in metric_names:
+                metric_names.append(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{_labels(dict(labels))} {value:g}")
+
+        # open spans: how many and how long the oldest one has been running
+        now = time.perf_counter()
+        inflight = {}
+        for span in open_spans:
+            count, oldest = inflight.get(span.name, (0, 0.0))
+            inflight[span.name] = (count + 1, max(oldest, now - span.start))
+        lines.append('# TYPE eco_inflight_spans gauge')
+        for name, (count, _) in sorted(inflight.items()):
+            lines.append(f"eco_inflight_spans{_labels({'span': name})} {count}")
+        lines.append('# TYPE eco_oldest_inflight_seconds gauge')
+        for name, (_, oldest) in sorted(inflight.items()):
+            lines.append(f"eco_oldest_inflight_seconds{_labels({'span': name})} {oldest:.3f}")
+        return '\n'.join(lines) + '\n'
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.metrics = Metrics()
+        self.lock = threading.Lock()
+        self._trace_file = None
+        self._open: Dict[int, Span] = {}
+        self._next_id = 0
+        self._local = threading.local()
+        self._server = None
+
+    def configure(self, trace_file: Optional[str] = None, metrics_port: Optional[int] = None, metrics_host: str = '0.0.0.0'):
+        """enable tracing: spans are appended to trace_file and/or served as metrics on metrics_port"""
+        if trace_file and self._trace_file is None:
+            os.makedirs(os.path.dirname(trace_file) or '.', exist_ok=True)
+            self._trace_file = open(trace_file, 'a', encoding='utf-8')
+        if metrics_port and self._server is None:
+            self._server = start_metrics_server(self, metrics_port, metrics_host)
+        self.enabled = self._trace_file is not None or self._server is not None
+
+    def close(self):
+        self.enabled = False
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
+        with self.lock:
+            if self._trace_file is not None:
+                self._trace_file.close()
+                self._trace_file = None
+
+    def _stack(self):
+        return self._local.__dict__.setdefault('stack', [])
+
+    def span(self, name: str, **attributes):
+        """context manager of a span, child of the innermost open span of this thread"""
+        if not self.enabled:
+            return nullcontext(NO_SPAN)
+        return self._span(name, attributes)
+
+    @contextmanager
+    def _span(self, name, attributes):
+        stack = self._stack()
+        parent = stack[-1] if stack else None
+        with self.lock:
+            self._next_id += 1
+            span_id = self._next_id
+        trace_id = parent.trace_id if parent else f"{os.getpid():x}-{span_id:x}"
+        strategy = attributes.get('strategy', parent.strategy if parent else '')
+        span = Span(name, trace_id, span_id, parent.span_id if parent else None, strategy, attributes)
+        stack.append(span)
+        with self.lock:
+            self._open[span_id] = span
+        error = None
+        try:
+            yield span
+        except BaseException as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            stack.pop()
+            self._finish(span, time.perf_counter() - span.start, error)
+
+    def _finish(self, span: Span, duration: float, error: Optional[str]):
+        with self.lock:
+            self._open.pop(span.span_id, None)
+        self.metrics.observe(span.name, span.strategy, duration, error is not None)
+        if self._trace_file is None:
+            return
+        record = {
+            'trace_id': span.trace_id,
+            'span_id': span.span_id,
+            'parent_id': span.parent_id,
+            'name': span.name,
+            'start': round(span.start_time, 6),
+            'duration': round(duration, 6),
+            'thread': threading.current_thread().name,
+            'attributes': span.attributes,
+            'error': error
+        }
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self.lock:
+            if self._trace_file is not None:
+                # one flushed line per span, so a running job can be inspected (tail -f)
+                self._trace_file.write(line + '\n')
+                self._trace_file.flush()
+
+    def current_span(self):
+        """the innermost open span of this thread (a no-op span when tracing is off)"""
+        if not self.enabled:
+            return NO_SPAN
+        stack = self._stack()
+        return stack[-1] if stack else NO_SPAN
+
+    def count(self, metric: str, value: float = 1, **labels):
+        """increment a counter (no-op when tracing is off)"""
+        if self.enabled:
+            self.metrics.inc(metric, value, **labels)
+
+    def render_metrics(self) -> str:
+        with self.lock:
+            open_spans = list(self._open.values())
+        return self.metrics.render(open_spans)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """GET /metrics -> the tracer's metrics in the Prometheus text format"""
+    tracer: Tracer = None
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = self.tracer.render_metrics().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # scrapes are periodic, keep them out of the inference log
+        pass
+
+
+def start_metrics_server(tracer: Tracer, port: int, host: str = '0.0.0.0') -> ThreadingHTTPServer:
+    handler = type('BoundMetricsHandler', (MetricsHandler,), {'tracer': tracer})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    logger.info(f"metrics endpoint: http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+_tracer = Tracer()
+
+
+def get_tracer() -> Tracer:
+    """the process-wide tracer"""
+    return _tracer
+
+
+def configure(trace_file: Optional[str] = None, metrics_port: Optional[int] = None):
+    _tracer.configure(trace_file, metrics_port)
+
+
+def span(name: str, **attributes):
+    return _tracer.span(name, **attributes)
+
+
+def current_span():
+    return _tracer.current_span()
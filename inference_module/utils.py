@@ -4,14 +4,23 @@ import os
 
 templates_path = 'inference_module/templates'
 
+# prompt layouts: 'prefix_cache' templates (templates/prefix_cache/) put the content shared by the samples
+# of an item (instructions, src_code, tips) first and the per-sample content (retrieved examples) last,
+# so the server can reuse the KV cache of the common prefix; strategies without such a template use the default one
+PROMPT_LAYOUTS = ['default', 'prefix_cache']
+
 
 def get_data(data_path):
     with open(data_path, 'r') as file:
         data = [json.loads(line) for line in file]
     return data
 
-def get_prompt_template(prompt_strategy='base'):
+def get_prompt_template(prompt_strategy='base', layout='default'):
     template_path = os.path.join(templates_path, f"{prompt_strategy}.json")
+    if layout != 'default':
+        layout_path = os.path.join(templates_path, layout, f"{prompt_strategy}.json")
+        if os.path.exists(layout_path):
+            template_path = layout_path
     print(template_path)
     with open(template_path, 'r') as file:
         template = json.load(file)